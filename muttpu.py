@@ -5,16 +5,46 @@ Interactive tool for managing M365 email via OAuth2
 """
 
 import imaplib
+import asyncio
+import ssl
+import base64
+import hashlib
+import lzma
 import email
+import email.header
+import email.utils
 import json
 import os
+import re
 import sys
 import subprocess
+import tarfile
+import zlib
+import socket
+import bisect
+import contextlib
+import cProfile
+import pstats
+import tracemalloc
+import fnmatch
+import sqlite3
+import tempfile
+import itertools
+import collections
+import multiprocessing
+import threading
+import queue
 import time
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from datetime import datetime
-import mailbox
+
+try:
+    import zstandard  # Optional: --compress zstd
+except ImportError:
+    zstandard = None
 
 # Color codes for terminal output
 class Colors:
@@ -50,11 +80,260 @@ def print_info(text):
     """Print info message"""
     print(f"{Colors.BLUE}ℹ {text}{Colors.ENDC}")
 
+def format_duration(seconds):
+    """Format seconds as H:MM:SS (or M:SS under an hour)"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
 # Configuration
 TOKEN_FILE = Path.home() / "Downloads/muttpu/token.gpg"
 OAUTH2_SCRIPT = "/opt/homebrew/Cellar/neomutt/20260501/share/neomutt/oauth2/mutt_oauth2.py"
 IMAP_SERVER = "outlook.office365.com"
+IMAP_PORT = 993
+IMAP_ENGINE = "imaplib"  # or "async" (--engine)
+IMAP_DEFLATE = True  # Negotiate COMPRESS=DEFLATE when offered (--no-deflate)
 EMAIL = "user@example.com"
+TOKEN_CACHE_DIR = Path.home() / ".cache/muttpu/tokens"
+HEADER_CACHE_FILE = Path.home() / ".cache/muttpu/headers.db"
+
+class RunStats:
+    """Timings, counters and message sizes of a run (--stats-file, --prometheus-file)
+
+    Phase times add up the time spent in each kind of work across all
+    threads and worker processes, so with parallel connections they can
+    exceed the wall time.
+    """
+
+    # Upper bounds of the message size histogram buckets (bytes)
+    SIZE_BUCKETS = (4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.clock = time.monotonic()
+        self.phases = {}
+        self.counters = collections.Counter()
+        self.errors = collections.Counter()
+        self.sizes = [0] * (len(self.SIZE_BUCKETS) + 1)
+        self.size_sum = 0
+        self.exports = []
+
+    def add_time(self, phase, seconds, calls=1):
+        with self.lock:
+            entry = self.phases.setdefault(phase, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """Time a block of work as one call of phase"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.monotonic() - started)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def error(self, kind, amount=1):
+        with self.lock:
+            self.errors[kind] += amount
+
+    def message(self, size):
+        """Record an exported message of size bytes"""
+        with self.lock:
+            self.sizes[bisect.bisect_left(self.SIZE_BUCKETS, size)] += 1
+            self.size_sum += size
+            self.counters['messages'] += 1
+            self.counters['bytes'] += size
+
+    def export_done(self, **summary):
+        with self.lock:
+            self.exports.append(summary)
+
+    def summary(self, command=None, exit_code=0):
+        """Everything collected so far, as a JSON-compatible dict"""
+        with self.lock:
+            return {
+                "command": command,
+                "exit_code": exit_code,
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                "elapsed": round(time.monotonic() - self.clock, 3),
+                "phases": {name: {"seconds": round(seconds, 3), "calls": calls}
+                           for name, (seconds, calls) in sorted(self.phases.items())},
+                "counters": dict(self.counters),
+                "errors": dict(self.errors),
+                "message_sizes": {
+                    "buckets": {(f"<={bound}" if bound else "larger"): count for bound, count
+                                in zip(self.SIZE_BUCKETS + (None,), self.sizes)},
+                    "sum": self.size_sum,
+                },
+                "exports": list(self.exports),
+            }
+
+    def write_json(self, path, command=None, exit_code=0):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.summary(command, exit_code), indent=2) + "\n")
+
+    def write_prometheus(self, path, command=None, exit_code=0):
+        """Write the run as a node_exporter textfile (replaced atomically)"""
+        summary = self.summary(command, exit_code)
+        label = f'command="{command or "menu"}"'
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP muttpu_{name} {help_text}")
+            lines.append(f"# TYPE muttpu_{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"muttpu_{name}{suffix}{{{','.join([label] + labels)}}} {value}")
+
+        metric("last_run_timestamp_seconds", "gauge", "Start time of the last run",
+               [("", [], int(self.started))])
+        metric("run_seconds", "gauge", "Wall time of the last run", [("", [], summary["elapsed"])])
+        metric("run_success", "gauge", "Whether the last run exited successfully",
+               [("", [], int(exit_code == 0))])
+        metric("phase_seconds", "gauge", "Time spent per phase (summed across threads)",
+               [("", [f'phase="{name}"'], phase["seconds"]) for name, phase in summary["phases"].items()])
+        metric("phase_calls", "gauge", "Operations per phase",
+               [("", [f'phase="{name}"'], phase["calls"]) for name, phase in summary["phases"].items()])
+        metric("events", "gauge", "Messages, bytes and other counts of the last run",
+               [("", [f'name="{name}"'], value) for name, value in sorted(summary["counters"].items())])
+        metric("errors", "gauge", "Errors of the last run by kind",
+               [("", [f'kind="{kind}"'], value) for kind, value in sorted(summary["errors"].items())])
+        buckets, total = [], 0
+        for bound, count in zip(self.SIZE_BUCKETS + ("+Inf",), self.sizes):
+            total += count
+            buckets.append(("_bucket", [f'le="{bound}"'], total))
+        metric("message_size_bytes", "histogram", "Sizes of the exported messages",
+               buckets + [("_sum", [], self.size_sum), ("_count", [], total)])
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(path.name + ".tmp")
+        temp.write_text("\n".join(lines) + "\n")
+        os.replace(temp, path)
+
+STATS = RunStats()
+
+class Profiler:
+    """--profile: cProfile, stack sampling or tracemalloc around a command
+
+    cpu profiles the main thread with cProfile (a .prof file for pstats or
+    snakeviz, plus a text summary). sample records the stacks of all
+    threads every SAMPLE_INTERVAL seconds, which also shows the fetch
+    threads (a text summary, plus collapsed stacks for flame graphs). mem
+    snapshots tracemalloc at every export checkpoint (or at most every
+    snapshot_interval seconds, if given) and at the end. Only this process
+    is profiled, so main() turns parse worker processes off.
+    """
+
+    TOP = 25
+    SAMPLE_INTERVAL = 0.005
+
+    def __init__(self, mode, directory, command, snapshot_interval=0):
+        self.mode = mode
+        self.snapshot_interval = snapshot_interval
+        self.directory = Path(directory)
+        self.stem = f"muttpu-{mode}-{command}-{datetime.now():%Y%m%d-%H%M%S}"
+        self.profile = None
+        self.samples = collections.Counter()
+        self.sampling = threading.Event()
+        self.sampler = None
+        self.report = []
+        self.previous = None
+        self.last_snapshot = 0.0
+        self.lock = threading.Lock()
+
+    def _path(self, suffix):
+        return self.directory / (self.stem + suffix)
+
+    def start(self):
+        if self.mode == 'cpu':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.mode == 'sample':
+            self.sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+            self.sampler.start()
+        else:
+            tracemalloc.start(10)
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self.sampling.wait(self.SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[tuple(reversed(stack))] += 1
+
+    def checkpoint(self, label, force=False):
+        """Record the top allocators (mem mode only)"""
+        if self.mode != 'mem' or not tracemalloc.is_tracing():
+            return
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.last_snapshot and now - self.last_snapshot < self.snapshot_interval:
+                return
+            self.last_snapshot = now
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            self.report.append(f"== {label}: {current / 1048576:,.1f} MB traced, "
+                               f"peak {peak / 1048576:,.1f} MB")
+            self.report.append("Top allocations:")
+            self.report.extend(f"  {stat}" for stat in snapshot.statistics('lineno')[:self.TOP])
+            if self.previous is not None:
+                self.report.append("Growth since the previous snapshot:")
+                self.report.extend(f"  {stat}" for stat in snapshot.compare_to(self.previous, 'lineno')[:10])
+            self.report.append("")
+            self.previous = snapshot
+
+    def stop(self):
+        """Stop profiling and write the reports; returns their paths"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.mode == 'cpu':
+            self.profile.disable()
+            self.profile.dump_stats(self._path('.prof'))
+            with open(self._path('.txt'), 'w') as f:
+                stats = pstats.Stats(self.profile, stream=f).strip_dirs()
+                stats.sort_stats('cumulative').print_stats(self.TOP)
+                stats.sort_stats('tottime').print_stats(self.TOP)
+            return [self._path('.prof'), self._path('.txt')]
+        if self.mode == 'sample':
+            self.sampling.set()
+            self.sampler.join()
+            total = max(1, sum(self.samples.values()))
+            own, inclusive = collections.Counter(), collections.Counter()
+            for stack, count in self.samples.items():
+                own[stack[-1]] += count
+                for function in set(stack):
+                    inclusive[function] += count
+            lines = [f"{total:,} samples every {self.SAMPLE_INTERVAL * 1000:g} ms, all threads", "",
+                     "Own time (function on top of the stack):"]
+            lines += [f"  {count / total:6.1%}  {function}" for function, count in own.most_common(self.TOP)]
+            lines += ["", "Inclusive time (function anywhere on the stack):"]
+            lines += [f"  {count / total:6.1%}  {function}" for function, count in inclusive.most_common(self.TOP)]
+            self._path('.txt').write_text("\n".join(lines) + "\n")
+            # One "frame;frame;frame count" line per stack, for flamegraph.pl or speedscope
+            self._path('.collapsed').write_text("".join(
+                f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common()))
+            return [self._path('.txt'), self._path('.collapsed')]
+        self.checkpoint("end of run", force=True)
+        tracemalloc.stop()
+        self._path('.txt').write_text("\n".join(self.report))
+        return [self._path('.txt')]
+
+PROFILER = None  # Set by --profile
 
 def check_dependencies():
     """Check if required dependencies are installed"""
@@ -97,13 +376,116 @@ def test_connectivity():
     except (urllib.error.URLError, socket.timeout, ConnectionRefusedError):
         return False
 
+class TokenProvider:
+    """Hand out OAuth2 access tokens, running the OAuth2 script only when needed
+
+    Getting a token means launching mutt_oauth2.py, which decrypts TOKEN_FILE
+    with gpg. The access token is kept in memory until shortly before it
+    expires and is shared by every connection in the process. A token that
+    does not say when it expires (not a JWT) is kept until the server
+    rejects it. Optionally it is also cached on disk, per account, for a
+    short time so back-to-back invocations of muttpu can skip the script
+    entirely.
+    """
+
+    # Refresh this many seconds before the token expires
+    REFRESH_MARGIN = 120
+
+    def __init__(self, cache_dir=None, cache_ttl=0):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.cache_ttl = cache_ttl
+        self.token = None
+        # Expiry of the token, or None when it is not known
+        self.expires = None
+        self.lock = threading.Lock()
+
+    @property
+    def cache_file(self):
+        """Disk cache of the current account (EMAIL and TOKEN_FILE)"""
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha256(f"{EMAIL}\0{Path(TOKEN_FILE).resolve()}".encode()).hexdigest()[:16]
+        return self.cache_dir / f"{key}.json"
+
+    def get(self):
+        """Return a valid access token, refreshing it if it is about to expire"""
+        with self.lock:
+            if self.token and (self.expires is None or time.time() < self.expires - self.REFRESH_MARGIN):
+                return self.token
+            if self._load_cache():
+                return self.token
+
+            result = subprocess.run(
+                ["python3", str(OAUTH2_SCRIPT), str(TOKEN_FILE)],
+                capture_output=True, text=True
+            )
+            token = result.stdout.strip()
+            if not token:
+                return token
+
+            self.token = token
+            self.expires = self._token_expiry(token)
+            self._save_cache()
+            return token
+
+    def invalidate(self):
+        """Forget the current token (e.g. after the server rejected it)"""
+        with self.lock:
+            self.token = None
+            self.expires = None
+            cache_file = self.cache_file
+            if cache_file and cache_file.exists():
+                cache_file.unlink()
+
+    @staticmethod
+    def _token_expiry(token):
+        """Read the expiry time from a JWT access token, if it is one"""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+        except Exception:
+            return None
+
+    def _load_cache(self):
+        """Pick up a token cached on disk by a recent invocation"""
+        cache_file = self.cache_file
+        if not self.cache_ttl or not cache_file or not cache_file.exists():
+            return False
+        try:
+            with open(cache_file, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cached.get("email") != EMAIL or time.time() >= cached.get("cached_until", 0):
+            return False
+        self.token = cached["token"]
+        self.expires = cached.get("expires")
+        return True
+
+    def _save_cache(self):
+        """Cache the token on disk (owner-only) for at most cache_ttl seconds"""
+        cache_file = self.cache_file
+        if not self.cache_ttl or not cache_file:
+            return
+        cached_until = time.time() + self.cache_ttl
+        if self.expires is not None:
+            cached_until = min(cached_until, self.expires - self.REFRESH_MARGIN)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # O_CREAT's mode does not apply to a file that already exists
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"email": EMAIL, "token": self.token, "expires": self.expires,
+                       "cached_until": cached_until}, f)
+
+# Shared by every connection in the process
+TOKENS = TokenProvider(cache_dir=TOKEN_CACHE_DIR)
+
 def get_token():
     """Get OAuth2 access token"""
-    result = subprocess.run(
-        ["python3", str(OAUTH2_SCRIPT), str(TOKEN_FILE)],
-        capture_output=True, text=True
-    )
-    return result.stdout.strip()
+    with STATS.timer('token'):
+        return TOKENS.get()
 
 def setup_oauth2():
     """Setup OAuth2 authentication"""
@@ -160,6 +542,7 @@ def setup_oauth2():
                     elif choice == "3":
                         print_warning("Deleting existing token...")
                         TOKEN_FILE.unlink()
+                        TOKENS.invalidate()
                         print_success("Token deleted")
                     else:
                         print_error("Invalid option. Exiting.")
@@ -180,6 +563,7 @@ def setup_oauth2():
                     elif choice == "2":
                         print_warning("Deleting existing token...")
                         TOKEN_FILE.unlink()
+                        TOKENS.invalidate()
                         print_success("Token deleted")
                     else:
                         print_error("Invalid option. Exiting.")
@@ -190,6 +574,7 @@ def setup_oauth2():
                 choice = input(f"{Colors.BOLD}Delete and recreate? [Y/n]:{Colors.ENDC} ").strip().lower()
                 if choice == "" or choice == "y":
                     TOKEN_FILE.unlink()
+                    TOKENS.invalidate()
                     print_success("Token deleted")
                 else:
                     print_info("Exiting without changes")
@@ -200,6 +585,7 @@ def setup_oauth2():
             choice = input(f"{Colors.BOLD}Delete and recreate? [Y/n]:{Colors.ENDC} ").strip().lower()
             if choice == "" or choice == "y":
                 TOKEN_FILE.unlink()
+                TOKENS.invalidate()
                 print_success("Token deleted")
             else:
                 print_info("Exiting without changes")
@@ -304,6 +690,7 @@ def setup_oauth2():
         return_code = process.wait()
 
         if return_code == 0:
+            TOKENS.invalidate()
             print()
             print_success("OAuth2 setup completed successfully!")
             print_info(f"Token saved to: {TOKEN_FILE}")
@@ -462,6 +849,441 @@ color index red default ~D
         print_error(f"Failed to write configuration: {e}")
         return False
 
+class WireStats:
+    """Bytes on the wire vs. protocol bytes on COMPRESS=DEFLATE connections"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wire_in = self.data_in = self.wire_out = self.data_out = 0
+
+    def received(self, wire, data):
+        with self.lock:
+            self.wire_in += wire
+            self.data_in += data
+
+    def sent(self, wire, data):
+        with self.lock:
+            self.wire_out += wire
+            self.data_out += data
+
+    def snapshot(self):
+        with self.lock:
+            return (self.wire_in, self.data_in, self.wire_out, self.data_out)
+
+    @staticmethod
+    def describe(before, after):
+        """One-line ratio report for the traffic between two snapshots, or None"""
+        wire_in, data_in, wire_out, data_out = (b - a for a, b in zip(before, after))
+        if not data_in:
+            return None
+        return (f"{data_in / 1048576:.1f} MB received as {wire_in / 1048576:.1f} MB "
+                f"({data_in / max(wire_in, 1):.1f}x), "
+                f"{data_out / 1024:.0f} KB sent as {wire_out / 1024:.0f} KB")
+
+DEFLATE_STATS = WireStats()
+
+# imaplib refuses commands it doesn't know
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+def _deflater():
+    # Raw deflate streams (no zlib header), as RFC 4978 requires
+    return zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+def _inflater():
+    return zlib.decompressobj(-zlib.MAX_WBITS)
+
+class DeflateIMAP4_SSL(imaplib.IMAP4_SSL):
+    """imaplib.IMAP4_SSL that can switch to COMPRESS=DEFLATE (RFC 4978)
+
+    After compress_deflate() succeeds, everything read from the socket is
+    inflated into a buffer that read() and readline() serve from, and
+    everything sent is deflated with a sync flush per command.
+    """
+
+    _inflate = None
+
+    def compress_deflate(self):
+        typ, data = self._simple_command('COMPRESS', 'DEFLATE')
+        if typ == 'OK':
+            # The server compresses everything after this response
+            self._deflate = _deflater()
+            self._inflate = _inflater()
+            self._inflated = bytearray()
+        return typ, data
+
+    def _fill(self):
+        # read1() also returns compressed bytes the file object had buffered
+        wire = self.file.read1(65536)
+        if not wire:
+            return False
+        data = self._inflate.decompress(wire)
+        DEFLATE_STATS.received(len(wire), len(data))
+        self._inflated += data
+        return True
+
+    def read(self, size):
+        if self._inflate is None:
+            return super().read(size)
+        while len(self._inflated) < size and self._fill():
+            pass
+        data = bytes(self._inflated[:size])
+        del self._inflated[:size]
+        return data
+
+    def readline(self):
+        if self._inflate is None:
+            return super().readline()
+        while True:
+            end = self._inflated.find(b'\n') + 1
+            if end or len(self._inflated) > imaplib._MAXLINE or not self._fill():
+                break
+        end = end or len(self._inflated)
+        if end > imaplib._MAXLINE:
+            raise self.error("got more than %d bytes" % imaplib._MAXLINE)
+        line = bytes(self._inflated[:end])
+        del self._inflated[:end]
+        return line
+
+    def send(self, data):
+        if self._inflate is not None:
+            wire = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+            DEFLATE_STATS.sent(len(wire), len(data))
+            data = wire
+        super().send(data)
+
+class _InflatingReader:
+    """StreamReader stand-in that inflates a COMPRESS=DEFLATE stream"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.inflate = _inflater()
+        self.buffer = bytearray()
+        self.eof = False
+
+    async def _fill(self):
+        wire = await self.reader.read(65536)
+        if not wire:
+            self.eof = True
+            return
+        data = self.inflate.decompress(wire)
+        DEFLATE_STATS.received(len(wire), len(data))
+        self.buffer += data
+
+    async def readline(self):
+        while True:
+            end = self.buffer.find(b'\n') + 1
+            if end or self.eof:
+                break
+            if len(self.buffer) > imaplib._MAXLINE:
+                raise imaplib.IMAP4.error("got more than %d bytes" % imaplib._MAXLINE)
+            await self._fill()
+        end = end or len(self.buffer)
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return line
+
+    async def readexactly(self, size):
+        while len(self.buffer) < size:
+            if self.eof:
+                raise asyncio.IncompleteReadError(bytes(self.buffer), size)
+            await self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+class _DeflatingWriter:
+    """StreamWriter wrapper that deflates each write with a sync flush"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.deflate = _deflater()
+
+    def write(self, data):
+        wire = self.deflate.compress(data) + self.deflate.flush(zlib.Z_SYNC_FLUSH)
+        DEFLATE_STATS.sent(len(wire), len(data))
+        self.writer.write(wire)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+class AsyncIMAP:
+    """Minimal asyncio IMAP client that pipelines tagged commands
+
+    A command is written as soon as it is issued, without waiting for the
+    ones before it. Servers answer pipelined commands in order, so each
+    tagged completion takes the untagged responses received since the
+    previous one. Untagged data is kept in imaplib's shape (bytes lines,
+    and (line, literal) tuples), so parse_fetch_response() and the other
+    helpers work with either client.
+    """
+
+    _LITERAL = re.compile(rb'.*{(?P<size>\d+)}$', re.S)
+    _STATUS = re.compile(rb'(?P<data>\d+) (?P<type>[A-Za-z-]+)(?: (?P<data2>.*))?$', re.S)
+    _CODE = re.compile(rb'\[(?P<type>[A-Za-z-]+)(?: (?P<data>[^\]]*))?\]')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.tags = itertools.count(1)
+        self.pending = {}
+        self.switches = {}
+        self.received = []
+        self.responder = None
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, host, port=IMAP_PORT, tls=True, timeout=30):
+        """Connect and read the server greeting"""
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            host, port, ssl=ssl.create_default_context() if tls else None,
+            limit=imaplib._MAXLINE), timeout)
+        greeting = await asyncio.wait_for(reader.readline(), timeout)
+        if not greeting.startswith((b'* OK', b'* PREAUTH')):
+            writer.close()
+            raise imaplib.IMAP4.error(f"unexpected greeting: {greeting!r}")
+        return cls(reader, writer)
+
+    async def _readline(self):
+        line = await self.reader.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        return line[:-2] if line.endswith(b'\r\n') else line.rstrip(b'\n')
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._readline()
+                if line.startswith(b'+'):
+                    if self.responder:
+                        self.writer.write(self.responder(line[2:]) + b'\r\n')
+                    continue
+                if line.startswith(b'* '):
+                    await self._untagged(line[2:])
+                    continue
+                tag, _, rest = line.partition(b' ')
+                status, _, text = rest.partition(b' ')
+                status = status.decode().upper()
+                self._response_code(status, text)
+                received, self.received = self.received, []
+                switch = self.switches.pop(tag.decode(), None)
+                if switch and status == 'OK':
+                    switch()  # Before reading anything else from the stream
+                future = self.pending.pop(tag.decode(), None)
+                if future and not future.done():
+                    future.set_result((status, text, received))
+        except Exception as e:
+            self._fail(e if isinstance(e, imaplib.IMAP4.error) else imaplib.IMAP4.abort(f"socket error: {e}"))
+        except asyncio.CancelledError:
+            self._fail(imaplib.IMAP4.abort("connection closed"))
+            raise
+
+    async def _untagged(self, line):
+        match = self._STATUS.match(line)
+        if match:
+            typ, data = match.group('type'), match.group('data')
+            if match.group('data2') is not None:
+                data += b' ' + match.group('data2')
+        else:
+            typ, _, data = line.partition(b' ')
+        typ = typ.decode().upper()
+        while self._LITERAL.match(data):
+            size = int(self._LITERAL.match(data).group('size'))
+            self.received.append((typ, (data, await self.reader.readexactly(size))))
+            data = await self._readline()
+        self.received.append((typ, data))
+        self._response_code(typ, data)
+
+    def _response_code(self, typ, data):
+        # [UIDVALIDITY 123] and the like, recorded the way imaplib does
+        if typ in ('OK', 'NO', 'BAD'):
+            match = self._CODE.match(data)
+            if match:
+                self.received.append((match.group('type').decode().upper(), match.group('data')))
+
+    def _fail(self, error):
+        self.closed = True
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+        self.writer.close()
+
+    async def command(self, name, *args, responder=None, switch=None):
+        """Send a command and wait for its completion
+
+        Args:
+            responder: Called with each continuation request ("+ ..."),
+                returns the line to send back (for AUTHENTICATE)
+            switch: Called by the reader right after an OK completion,
+                before the next response is read (for COMPRESS)
+
+        Returns:
+            (status, completion text, [(type, data), ...] untagged responses)
+        """
+        if self.closed:
+            raise imaplib.IMAP4.abort("connection closed")
+        tag = f"M{next(self.tags):04d}"
+        future = asyncio.get_running_loop().create_future()
+        self.pending[tag] = future
+        if switch:
+            self.switches[tag] = switch
+        if responder:
+            self.responder = responder
+        line = " ".join([tag, name] + [str(arg) for arg in args if arg is not None])
+        self.writer.write(line.encode() + b'\r\n')
+        try:
+            await self.writer.drain()
+            return await future
+        except BaseException:
+            self.pending.pop(tag, None)
+            self.switches.pop(tag, None)
+            if not future.done():
+                future.cancel()
+            elif not future.cancelled():
+                future.exception()  # Already raised here; don't report it as unretrieved
+            raise
+        finally:
+            if responder:
+                self.responder = None
+
+    async def compress_deflate(self):
+        """Negotiate COMPRESS=DEFLATE; no other command may be in flight"""
+        def start():
+            self.reader = _InflatingReader(self.reader)
+            self.writer = _DeflatingWriter(self.writer)
+        return await self.command('COMPRESS', 'DEFLATE', switch=start)
+
+    async def close(self):
+        try:
+            if not self.closed:
+                await asyncio.wait_for(self.command('LOGOUT'), 10)
+        except Exception:
+            pass
+        self.task.cancel()
+        self.closed = True
+        self.writer.close()
+
+_EVENT_LOOP = None
+_EVENT_LOOP_LOCK = threading.Lock()
+
+def event_loop():
+    """The event loop shared by all async IMAP connections (in a background thread)"""
+    global _EVENT_LOOP
+    with _EVENT_LOOP_LOCK:
+        if _EVENT_LOOP is None:
+            _EVENT_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_EVENT_LOOP.run_forever, name='imap-event-loop', daemon=True).start()
+        return _EVENT_LOOP
+
+def run_async(coroutine):
+    """Run a coroutine on the shared event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result()
+
+class IMAPSession:
+    """Blocking imaplib-style interface to an AsyncIMAP connection
+
+    Implements the part of imaplib.IMAP4 this script uses, so the rest of
+    the code works with either engine. Commands from several threads share
+    the connection and are pipelined on it.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.untagged_responses = {}
+        self.capabilities = ()
+        self.state = 'NONAUTH'
+        self.is_readonly = False
+        self.lock = threading.Lock()
+
+    def _command(self, name, *args, result=None, responder=None):
+        """Run a command; untagged responses of type result are returned, the rest kept"""
+        status, text, received = run_async(self.client.command(name, *args, responder=responder))
+        data = []
+        with self.lock:
+            for typ, value in received:
+                if typ == result:
+                    data.append(value)
+                else:
+                    self.untagged_responses.setdefault(typ, []).append(value)
+        if status == 'BAD':
+            raise imaplib.IMAP4.error(f"{name} command error: BAD [{text!r}]")
+        if status != 'OK' or result is None:
+            return status, [text]
+        return status, data or [None]
+
+    def _simple_command(self, name, *args):
+        return self._command(name, *args)
+
+    def authenticate(self, mechanism, authobject):
+        def respond(challenge):
+            # A second challenge carries the error; answer it with an empty line
+            if respond.sent:
+                return b''
+            respond.sent = True
+            return base64.b64encode(authobject(base64.b64decode(challenge)))
+        respond.sent = False
+        status, data = self._command('AUTHENTICATE', mechanism, responder=respond)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(data[-1].decode(errors='replace'))
+        self.state = 'AUTH'
+        return status, data
+
+    def capability(self):
+        return self._command('CAPABILITY', result='CAPABILITY')
+
+    def enable(self, capability):
+        return self._command('ENABLE', capability, result='ENABLED')
+
+    def select(self, mailbox='INBOX', readonly=False):
+        with self.lock:
+            self.untagged_responses = {}
+        self.is_readonly = readonly
+        status, data = self._command('EXAMINE' if readonly else 'SELECT', mailbox)
+        if status != 'OK':
+            self.state = 'AUTH'
+            return status, data
+        self.state = 'SELECTED'
+        with self.lock:
+            return status, self.untagged_responses.get('EXISTS', [None])
+
+    def status(self, mailbox, names):
+        return self._command('STATUS', mailbox, names, result='STATUS')
+
+    def list(self, directory='""', pattern='*'):
+        return self._command('LIST', directory, pattern, result='LIST')
+
+    def uid(self, command, *args):
+        command = command.upper()
+        result = command if command in ('SEARCH', 'SORT', 'THREAD') else 'FETCH'
+        return self._command('UID', command, *args, result=result)
+
+    def compress_deflate(self):
+        status, text, _ = run_async(self.client.compress_deflate())
+        return status, [text]
+
+    def response(self, code):
+        with self.lock:
+            return code, self.untagged_responses.pop(code.upper(), [None])
+
+    def logout(self):
+        self.state = 'LOGOUT'
+        run_async(self.client.close())
+        return 'BYE', [b'']
+
+def open_imap(auth_string):
+    """Open an IMAP session with the configured engine and authenticate it"""
+    with STATS.timer('connect'):
+        if IMAP_ENGINE == "async":
+            imap = IMAPSession(run_async(AsyncIMAP.open(IMAP_SERVER, IMAP_PORT)))
+        else:
+            imap = DeflateIMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+        imap.authenticate("XOAUTH2", lambda x: auth_string.encode())
+        if IMAP_DEFLATE and 'COMPRESS=DEFLATE' in get_capabilities(imap):
+            # After authentication, so the token is never in the compressed stream
+            imap.compress_deflate()
+    return imap
+
 def connect_imap(quiet=False):
     """Connect to IMAP server with OAuth2
 
@@ -479,10 +1301,7 @@ def connect_imap(quiet=False):
             return None
 
         auth_string = f'user={EMAIL}\x01auth=Bearer {token}\x01\x01'
-
-        imap = imaplib.IMAP4_SSL(IMAP_SERVER)
-        imap.authenticate("XOAUTH2", lambda x: auth_string.encode())
-        return imap
+        return open_imap(auth_string)
     except socket.gaierror:
         if not quiet:
             print_error(f"Cannot resolve hostname: {IMAP_SERVER}")
@@ -513,42 +1332,430 @@ def connect_imap(quiet=False):
             print_warning("If the problem persists, try: ./muttpu.py setup")
         return None
 
-def list_mailboxes():
-    """List all available mailboxes"""
-    import re
+def get_capabilities(imap):
+    """Refresh and return the server's capabilities after authentication"""
+    status, data = imap.capability()
+    caps = set()
+    if status == "OK":
+        for line in data:
+            if line:
+                caps.update(line.decode().upper().split())
+        imap.capabilities = tuple(sorted(caps))
+    return caps
 
-    print_header("Your Mailboxes")
+def select_mailbox(imap, mailbox_name, qresync=None):
+    """Select a mailbox read-only and collect its status responses
 
-    print_info(f"Connecting to {IMAP_SERVER}...")
-    imap = connect_imap()
-    if not imap:
-        return
+    Args:
+        qresync: Optional (uidvalidity, highestmodseq) from a previous session.
+            The server then reports messages expunged since then as VANISHED
+            (QRESYNC, RFC 7162).
+
+    Returns:
+        Dict with EXISTS, UIDVALIDITY, UIDNEXT and HIGHESTMODSEQ as ints
+        (when the server reports them) and VANISHED as a UID set string, or
+        None if the mailbox could not be selected
+    """
+    if qresync:
+        imap.untagged_responses = {}
+        status, _ = imap._simple_command(
+            'EXAMINE', f'"{mailbox_name}"', f'(QRESYNC ({qresync[0]} {qresync[1]}))')
+        if status == "OK":
+            # imaplib only tracks the selected state for its own select()
+            imap.state = 'SELECTED'
+            imap.is_readonly = True
+    else:
+        status, _ = imap.select(f'"{mailbox_name}"', readonly=True)
+    if status != "OK":
+        return None
+
+    info = {}
+    for key in ('EXISTS', 'UIDVALIDITY', 'UIDNEXT', 'HIGHESTMODSEQ'):
+        _, values = imap.response(key)
+        if values and values[-1]:
+            info[key] = int(values[-1])
+    _, vanished = imap.response('VANISHED')
+    info['VANISHED'] = ",".join(v.decode().replace('(EARLIER)', '').strip()
+                                for v in vanished if v)
+    return info
+
+def format_uid_set(uids):
+    """Compress UIDs into an IMAP sequence set (e.g. 1001:1100,1200)"""
+    ranges = []
+    for uid in sorted(int(u) for u in uids):
+        if ranges and uid <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], uid)
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+SEARCH_WINDOW = 10000  # Message sequence numbers per windowed UID SEARCH
+SUMMARY_BATCH = 1000   # UIDs per FETCH when summarizing many messages
+
+def _esearch(imap, criteria, returns):
+    """Run UID SEARCH RETURN (...) and return the ESEARCH items (RFC 4731)
+
+    Returns:
+        Dict such as {'MIN': '1', 'MAX': '900', 'COUNT': '42', 'ALL': '1:40,899:900'}
+    """
+    imap.response('ESEARCH')  # Drop anything left over from an earlier command
+    with STATS.timer('search'):
+        status, data = imap.uid('search', f'RETURN ({returns})', criteria)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"search failed: {data[0]!r}")
+    _, responses = imap.response('ESEARCH')
+    items = {}
+    for line in responses:
+        if not line:
+            continue
+        words = re.sub(r'^\(TAG "[^"]*"\)\s*', '', line.decode()).split()
+        if words and words[0].upper() == 'UID':
+            words = words[1:]
+        items.update((key.upper(), value) for key, value in zip(words[::2], words[1::2]))
+    return items
+
+def search_uids(imap, criteria='ALL', exists=0, window=SEARCH_WINDOW):
+    """Yield the UIDs matching a search in ascending order
+
+    A plain UID SEARCH returns every match on one response line, which on
+    large folders runs into imaplib's line length limit. With ESEARCH the
+    server first reports MIN, MAX and COUNT; a contiguous result needs no
+    further round trip and a small one comes back as a compact set.
+    Everything else is searched a window of message sequence numbers at a
+    time, so only one window of UIDs is ever held in memory.
+
+    Args:
+        criteria: IMAP search criteria
+        exists: Number of messages in the selected mailbox (EXISTS)
+        window: Message sequence numbers per windowed search
+    """
+    esearch = 'ESEARCH' in imap.capabilities
+    if esearch:
+        result = _esearch(imap, criteria, 'MIN MAX COUNT')
+        count = int(result.get('COUNT', 0))
+        if not count:
+            return
+        low, high = int(result['MIN']), int(result['MAX'])
+        if high - low + 1 == count:
+            yield from range(low, high + 1)
+            return
+        if count <= window:
+            yield from UidSet(_esearch(imap, criteria, 'ALL').get('ALL', ''))
+            return
+
+    last = 0
+    for start in range(1, exists + 1, window):
+        window_criteria = f"{start}:{min(start + window - 1, exists)} {criteria}"
+        if esearch:
+            uids = UidSet(_esearch(imap, window_criteria, 'ALL').get('ALL', ''))
+        else:
+            with STATS.timer('search'):
+                status, data = imap.uid('search', None, window_criteria)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"search failed: {data[0]!r}")
+            # SEARCH results may come in any order
+            uids = sorted(int(uid) for line in data if line for uid in line.split())
+        for uid in uids:
+            # Sequence numbers shift if messages are expunged meanwhile
+            if uid > last:
+                last = uid
+                yield uid
+
+_FETCH_START = re.compile(rb'^\d+ \(')
+
+def _imap_tokens(segments):
+    """Tokenize (text, literal) segments of one untagged IMAP response
+
+    Parentheses and atoms are yielded as str, quoted strings and literals as
+    bytes.
+    """
+    for text, literal in segments:
+        pos, end = 0, len(text)
+        while pos < end:
+            c = text[pos:pos + 1]
+            if c in b' \r\n':
+                pos += 1
+            elif c in b'()':
+                yield c.decode()
+                pos += 1
+            elif c == b'"':
+                buf = bytearray()
+                pos += 1
+                while pos < end and text[pos:pos + 1] != b'"':
+                    if text[pos:pos + 1] == b'\\':
+                        pos += 1
+                    buf += text[pos:pos + 1]
+                    pos += 1
+                pos += 1
+                yield bytes(buf)
+            elif c == b'{' or text[pos:pos + 2] == b'~{':
+                # Literal marker - the literal itself follows this segment
+                break
+            else:
+                start, depth = pos, 0
+                while pos < end:
+                    c = text[pos:pos + 1]
+                    if c == b'[':
+                        depth += 1
+                    elif c == b']':
+                        depth -= 1
+                    elif depth <= 0 and c in b' ()':
+                        break
+                    pos += 1
+                yield text[start:pos].decode('ascii', errors='replace')
+        if literal is not None:
+            yield literal
+
+def _imap_parse(tokens):
+    """Build nested lists from IMAP tokens (NIL becomes None)"""
+    stack = [[]]
+    for tok in tokens:
+        if tok == '(':
+            stack.append([])
+        elif tok == ')':
+            if len(stack) > 1:
+                lst = stack.pop()
+                stack[-1].append(lst)
+        elif tok == 'NIL':
+            stack[-1].append(None)
+        else:
+            stack[-1].append(tok)
+    while len(stack) > 1:
+        lst = stack.pop()
+        stack[-1].append(lst)
+    return stack[0]
+
+def read_chunks(path, size=1048576):
+    """Yield the contents of a file in chunks of at most size bytes"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+def read_head(path, size=65536):
+    """First bytes of a file, enough for scan_headers() on a spooled message"""
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+def prepare_message(raw):
+    """Parse and re-serialize one message
+
+    Returns:
+        (message bytes, {'Date': ..., 'Subject': ...} for the filename)
+    """
+    msg = email.message_from_bytes(raw)
+    headers = {name: str(msg[name]) for name in ('Date', 'Subject') if msg[name] is not None}
+    return msg.as_bytes(), headers
+
+def prepare_batch(raws):
+    """prepare_message() for a batch, in a worker process (failures are returned, not raised)
+
+    Returns:
+        (results, seconds spent parsing)
+    """
+    started = time.monotonic()
+    results = []
+    for raw in raws:
+        try:
+            results.append(prepare_message(raw))
+        except Exception as e:
+            results.append(e)
+    return results, time.monotonic() - started
+
+def scan_headers(raw, names=('Date', 'Subject')):
+    """Extract a few header values from raw message bytes without MIME parsing
+
+    Only the header block is scanned. Values are returned the way
+    email.message.Message.get() would return them: first occurrence wins and
+    folded continuation lines are kept verbatim.
+    """
+    wanted = {name.lower(): name for name in names}
+    end = raw.find(b'\n\n')
+    crlf_end = raw.find(b'\r\n\r\n')
+    if crlf_end != -1 and (end == -1 or crlf_end < end):
+        end = crlf_end
+    header_block = raw if end == -1 else raw[:end + 1]
+
+    found = {}
+    current = None
+    for line in header_block.splitlines(keepends=True):
+        if line[:1] in (b' ', b'\t'):
+            if current is not None:
+                found[current] += line.decode('utf-8', errors='replace')
+            continue
+        current = None
+        name, sep, value = line.partition(b':')
+        key = name.strip().decode('ascii', errors='replace').lower()
+        if sep and key in wanted and wanted[key] not in found:
+            current = wanted[key]
+            found[current] = value.lstrip(b' \t').decode('utf-8', errors='replace')
+    return {name: value.rstrip('\r\n') for name, value in found.items()}
+
+def parse_fetch_response(data):
+    """Parse imaplib FETCH response data into one attribute dict per message
+
+    Keys are upper-cased FETCH item names (e.g. 'UID', 'RFC822'); UID and
+    RFC822.SIZE are returned as ints, literals as bytes.
+    """
+    groups = []
+    for item in data or []:
+        if item is None:
+            continue
+        text, literal = item if isinstance(item, tuple) else (item, None)
+        if not groups or _FETCH_START.match(text):
+            groups.append([])
+        groups[-1].append((text, literal))
+
+    messages = []
+    for segments in groups:
+        parsed = _imap_parse(_imap_tokens(segments))
+        if len(parsed) < 2 or not isinstance(parsed[1], list):
+            continue
+        attrs = {'SEQ': int(parsed[0])}
+        items = parsed[1]
+        for key, value in zip(items[0::2], items[1::2]):
+            key = str(key).upper()
+            if key in ('UID', 'RFC822.SIZE'):
+                value = int(value)
+            attrs[key] = value
+        messages.append(attrs)
+    return messages
+
+def fetch_summaries(imap, uids, items='(UID INTERNALDATE RFC822.SIZE ENVELOPE)',
+                    batch=SUMMARY_BATCH):
+    """Yield parsed FETCH attributes for many UIDs, one set-based FETCH per batch"""
+    uids = iter(uids)
+    while True:
+        chunk = list(itertools.islice(uids, batch))
+        if not chunk:
+            return
+        with STATS.timer('summaries'):
+            status, data = imap.uid('fetch', format_uid_set(chunk), items)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"fetch failed: {data[0]!r}")
+        yield from parse_fetch_response(data)
+
+def decode_header_text(value):
+    """Decode an RFC 2047 encoded header value (bytes or str) to text"""
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    try:
+        return str(email.header.make_header(email.header.decode_header(value)))
+    except Exception:
+        return value
+
+def message_date(date_header, internaldate=None):
+    """Parse a Date header, falling back to the INTERNALDATE (arrival time)
+
+    Returns:
+        datetime, or None if neither could be parsed
+    """
+    if isinstance(date_header, bytes):
+        date_header = date_header.decode('ascii', errors='replace')
+    try:
+        return email.utils.parsedate_to_datetime(date_header)
+    except (TypeError, ValueError):
+        pass
+    if isinstance(internaldate, bytes):
+        internaldate = internaldate.decode('ascii', errors='replace')
+    try:
+        return datetime.strptime(internaldate.strip(), '%d-%b-%Y %H:%M:%S %z')
+    except (AttributeError, ValueError):
+        return None
+
+def envelope_summary(msg):
+    """Condense FETCH (UID INTERNALDATE RFC822.SIZE ENVELOPE) attributes
 
+    Returns:
+        Dict with uid, date (ISO 8601 in the sender's timezone, or None),
+        size, subject, sender and message_id
+    """
+    envelope = msg.get('ENVELOPE') or []
+    envelope = list(envelope) + [None] * (10 - len(envelope))
+    when = message_date(envelope[0], msg.get('INTERNALDATE'))
+    sender = ''
+    if envelope[2] and isinstance(envelope[2][0], list) and len(envelope[2][0]) >= 4:
+        name, _, user, host = envelope[2][0][:4]
+        address = f"{decode_header_text(user)}@{decode_header_text(host)}"
+        name = decode_header_text(name)
+        sender = f"{name} <{address}>" if name else address
+    return {
+        'uid': msg.get('UID'),
+        'date': when.isoformat() if when else None,
+        'size': msg.get('RFC822.SIZE', 0),
+        'subject': decode_header_text(envelope[1]),
+        'sender': sender,
+        'message_id': decode_header_text(envelope[9]) or None,
+    }
+
+def get_mailboxes(imap):
+    """List mailboxes as (name, delimiter, flags) tuples, sorted by name
+
+    Hidden folders (starting with '.') are skipped.
+    """
     status, mailboxes = imap.list()
-    if status == "OK":
-        mailbox_names = []
-        for mailbox in mailboxes:
+    if status != "OK":
+        return []
+
+    result = []
+    for mailbox in mailboxes:
+        if mailbox is None:
+            continue
+        if isinstance(mailbox, tuple):
+            # Name sent as a literal
+            decoded = mailbox[0].decode('utf-8') + ' "' + mailbox[1].decode('utf-8') + '"'
+        else:
             decoded = mailbox.decode('utf-8')
 
-            # IMAP LIST format: (flags) "delimiter" mailbox_name
-            # or: (flags) "delimiter" "mailbox name with spaces"
-            # Pattern: everything after the delimiter
-            match = re.match(r'\([^)]*\)\s+"[^"]*"\s+(.+)$', decoded)
+        # IMAP LIST format: (flags) "delimiter" mailbox_name
+        # or: (flags) "delimiter" "mailbox name with spaces"
+        # Pattern: everything after the delimiter
+        match = re.match(r'\(([^)]*)\)\s+("[^"]*"|NIL)\s+(.+)$', decoded)
+
+        if match:
+            flags = match.group(1).split()
+            delimiter = match.group(2).strip('"') if match.group(2) != 'NIL' else None
+            name = match.group(3)
+            # Remove quotes if present
+            if name.startswith('"') and name.endswith('"'):
+                name = name[1:-1]
+
+            # Skip hidden folders
+            if name and not name.startswith('.'):
+                result.append((name, delimiter, flags))
+
+    result.sort()
+    return result
+
+def get_mailbox_status(imap, mailbox_name, items=('MESSAGES', 'UIDNEXT', 'UIDVALIDITY')):
+    """Run STATUS for a mailbox and return the requested items as ints"""
+    status, data = imap.status(f'"{mailbox_name}"', f"({' '.join(items)})")
+    if status != "OK" or not data or not data[0]:
+        return {}
+    line = data[0] if isinstance(data[0], bytes) else data[0][-1]
+    match = re.search(rb'\(([^()]*)\)\s*$', line)
+    if not match:
+        return {}
+    fields = match.group(1).decode().split()
+    return {key.upper(): int(value) for key, value in zip(fields[0::2], fields[1::2])}
 
-            if match:
-                name = match.group(1)
-                # Remove quotes if present
-                if name.startswith('"') and name.endswith('"'):
-                    name = name[1:-1]
+def list_mailboxes():
+    """List all available mailboxes"""
+    print_header("Your Mailboxes")
 
-                # Skip hidden folders
-                if name and not name.startswith('.'):
-                    mailbox_names.append(name)
+    print_info(f"Connecting to {IMAP_SERVER}...")
+    imap = connect_imap()
+    if not imap:
+        return
 
-        # Sort and display
-        mailbox_names.sort()
-        for idx, name in enumerate(mailbox_names, 1):
-            print(f"{Colors.BOLD}{idx:3d}.{Colors.ENDC} {Colors.CYAN}{name}{Colors.ENDC}")
+    # Sort and display
+    mailbox_names = [name for name, _, _ in get_mailboxes(imap)]
+    for idx, name in enumerate(mailbox_names, 1):
+        print(f"{Colors.BOLD}{idx:3d}.{Colors.ENDC} {Colors.CYAN}{name}{Colors.ENDC}")
 
     # Get INBOX count
     print()
@@ -559,14 +1766,199 @@ def list_mailboxes():
 
     imap.logout()
 
-def count_messages(mailbox_name):
-    """Count messages in a mailbox"""
+class HeaderCache:
+    """On-disk cache of message summaries (date, size, subject, sender)
+
+    One SQLite database holds every cached mailbox. A mailbox's rows are
+    only valid for the UIDVALIDITY they were fetched under and are topped up
+    from the cached UIDNEXT, so after the first run only new messages are
+    fetched. A STATUS command tells whether anything changed at all: the
+    message count, UIDNEXT and (with CONDSTORE) HIGHESTMODSEQ must all match.
+    Expunged messages are looked for when the count is off or HIGHESTMODSEQ
+    moved.
+    """
+
+    def __init__(self, path=HEADER_CACHE_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            # Subjects and senders are private - keep the cache owner-only
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self.db = sqlite3.connect(str(self.path))
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS mailboxes (
+                    id INTEGER PRIMARY KEY,
+                    account TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    uidvalidity INTEGER,
+                    uidnext INTEGER NOT NULL DEFAULT 1,
+                    messages INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (account, name)
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    mailbox_id INTEGER NOT NULL,
+                    uid INTEGER NOT NULL,
+                    date TEXT,
+                    size INTEGER,
+                    subject TEXT,
+                    sender TEXT,
+                    message_id TEXT,
+                    PRIMARY KEY (mailbox_id, uid)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS messages_date ON messages (mailbox_id, date);
+            """)
+            columns = [r[1] for r in self.db.execute('PRAGMA table_info(mailboxes)')]
+            if 'highestmodseq' not in columns:
+                self.db.execute('ALTER TABLE mailboxes ADD COLUMN highestmodseq INTEGER')
+
+    def close(self):
+        self.db.close()
+
+    def _mailbox(self, mailbox_name):
+        """Return the cached (id, uidvalidity, uidnext, messages, highestmodseq) row, or None"""
+        return self.db.execute(
+            'SELECT id, uidvalidity, uidnext, messages, highestmodseq FROM mailboxes '
+            'WHERE account = ? AND name = ?', (EMAIL, mailbox_name)).fetchone()
+
+    def refresh(self, imap, mailbox_name, quiet=False):
+        """Bring the cached summaries of a mailbox up to date with the server
+
+        Returns:
+            Number of messages in the mailbox
+        """
+        items = ('MESSAGES', 'UIDNEXT', 'UIDVALIDITY')
+        if 'CONDSTORE' in imap.capabilities:
+            items += ('HIGHESTMODSEQ',)
+        status = get_mailbox_status(imap, mailbox_name, items)
+        row = self._mailbox(mailbox_name)
+        if (row and status
+                and row[1:4] == (status.get('UIDVALIDITY'), status.get('UIDNEXT'), status.get('MESSAGES'))
+                and status.get('HIGHESTMODSEQ', row[4]) == row[4]):
+            return row[3]
+
+        info = select_mailbox(imap, mailbox_name)
+        if info is None:
+            raise imaplib.IMAP4.error(f"Failed to select mailbox: {mailbox_name}")
+        uidvalidity = info.get('UIDVALIDITY')
+        with self.db:
+            if row is None:
+                self.db.execute('INSERT INTO mailboxes (account, name, uidvalidity) VALUES (?, ?, ?)',
+                                (EMAIL, mailbox_name, uidvalidity))
+                row = self._mailbox(mailbox_name)
+            elif row[1] != uidvalidity:
+                # UIDs from another UIDVALIDITY mean nothing any more
+                self.db.execute('DELETE FROM messages WHERE mailbox_id = ?', (row[0],))
+                self.db.execute('UPDATE mailboxes SET uidvalidity = ?, uidnext = 1, messages = 0, '
+                                'highestmodseq = NULL WHERE id = ?', (uidvalidity, row[0]))
+                row = self._mailbox(mailbox_name)
+        mailbox_id, _, uidnext, _, highestmodseq = row
+        exists = info.get('EXISTS', 0)
+        modseq = info.get('HIGHESTMODSEQ')
+
+        # Top up from the cached UIDNEXT; progress is committed per batch so
+        # an interrupted warm-up carries on where it stopped
+        new_uids = (uid for uid in search_uids(imap, f'UID {uidnext}:*', exists) if uid >= uidnext)
+        added = 0
+        batch = []
+        for msg in fetch_summaries(imap, new_uids):
+            batch.append(envelope_summary(msg))
+            if len(batch) >= SUMMARY_BATCH:
+                added += self._store(mailbox_id, batch)
+                batch = []
+                if not quiet:
+                    print(f"\r  {Colors.CYAN}Caching headers: {added:,} new messages{Colors.ENDC}", end='', flush=True)
+        added += self._store(mailbox_id, batch)
+        if not quiet and added >= SUMMARY_BATCH:
+            print()
+
+        # Drop messages that were expunged on the server. An expunge plus an
+        # arrival can leave the count unchanged, but not HIGHESTMODSEQ
+        cached = self.db.execute('SELECT COUNT(*) FROM messages WHERE mailbox_id = ?',
+                                 (mailbox_id,)).fetchone()[0]
+        if cached != exists or (modseq is not None and modseq != highestmodseq):
+            on_server = UidSet(search_uids(imap, 'ALL', exists))
+            gone = [(mailbox_id, uid) for (uid,) in self.db.execute(
+                'SELECT uid FROM messages WHERE mailbox_id = ?', (mailbox_id,)) if uid not in on_server]
+            with self.db:
+                self.db.executemany('DELETE FROM messages WHERE mailbox_id = ? AND uid = ?', gone)
+            cached -= len(gone)
+
+        with self.db:
+            self.db.execute('UPDATE mailboxes SET uidnext = MAX(uidnext, ?), messages = ?, highestmodseq = ? '
+                            'WHERE id = ?', (info.get('UIDNEXT', 1), cached, modseq, mailbox_id))
+        return cached
+
+    def _store(self, mailbox_id, summaries):
+        """Insert a batch of summaries and advance the cached UIDNEXT past them"""
+        if not summaries:
+            return 0
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO messages (mailbox_id, uid, date, size, subject, sender, message_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(mailbox_id, m['uid'], m['date'], m['size'], m['subject'], m['sender'], m['message_id'])
+                 for m in summaries])
+            self.db.execute('UPDATE mailboxes SET uidnext = MAX(uidnext, ?) WHERE id = ?',
+                            (max(m['uid'] for m in summaries) + 1, mailbox_id))
+        return len(summaries)
+
+    def _query(self, mailbox_name, columns, since=None, before=None, tail=''):
+        """Select from a mailbox's cached messages, optionally within [since, before)"""
+        row = self._mailbox(mailbox_name)
+        sql = f'SELECT {columns} FROM messages WHERE mailbox_id = ?'
+        params = [row[0] if row else -1]
+        # Like SENTSINCE/SENTBEFORE, compare the date in the sender's timezone
+        if since:
+            sql += ' AND date >= ?'
+            params.append(since)
+        if before:
+            sql += ' AND date < ?'
+            params.append(before)
+        return self.db.execute(f'{sql} {tail}', params).fetchall()
+
+    def count(self, mailbox_name, since=None, before=None):
+        return self._query(mailbox_name, 'COUNT(*)', since, before)[0][0]
+
+    def summaries(self, mailbox_name, since=None, before=None, limit=20):
+        """Return the first messages by UID as envelope_summary() style dicts"""
+        rows = self._query(mailbox_name, 'uid, date, size, subject, sender, message_id',
+                           since, before, f'ORDER BY uid LIMIT {int(limit)}')
+        return [dict(zip(('uid', 'date', 'size', 'subject', 'sender', 'message_id'), r)) for r in rows]
+
+    def histogram(self, mailbox_name, period='month', since=None, before=None):
+        """Count cached messages per 'YYYY-MM' (or 'YYYY')"""
+        width = 4 if period == 'year' else 7
+        rows = self._query(mailbox_name, f"COALESCE(substr(date, 1, {width}), 'Unknown'), COUNT(*)",
+                           since, before, 'GROUP BY 1')
+        return dict(rows)
+
+def count_messages(mailbox_name, cached=False):
+    """Count messages in a mailbox
+
+    Args:
+        cached: Answer from (and top up) the local header cache
+    """
     print_header(f"Message Count: {mailbox_name}")
 
     imap = connect_imap()
     if not imap:
         return 0
 
+    if cached:
+        try:
+            get_capabilities(imap)
+            cache = HeaderCache()
+            count = cache.refresh(imap, mailbox_name)
+            cache.close()
+            print_success(f"{mailbox_name}: {count:,} messages")
+            return count
+        except (imaplib.IMAP4.error, sqlite3.Error) as e:
+            print_error(f"Error: {e}")
+            return 0
+        finally:
+            imap.logout()
+
     try:
         status, data = imap.select(f'"{mailbox_name}"', readonly=True)
         if status == "OK":
@@ -583,15 +1975,40 @@ def count_messages(mailbox_name):
         imap.logout()
         return 0
 
-def search_by_date(mailbox, year=None, limit=20):
-    """Search mailbox by date range"""
+def date_histogram(imap, uids, period='month'):
+    """Count messages per month or year
+
+    Dates come from the Date header (as SENTSINCE/SENTBEFORE use), fetched a
+    batch of UIDs at a time; INTERNALDATE fills in when it is missing.
+
+    Returns:
+        (counts, total) - counts maps 'YYYY-MM' (or 'YYYY') to a message count
+    """
+    fmt = '%Y' if period == 'year' else '%Y-%m'
+    counts = {}
+    total = 0
+    for msg in fetch_summaries(imap, uids, '(UID INTERNALDATE BODY.PEEK[HEADER.FIELDS (DATE)])'):
+        header = scan_headers(msg.get('BODY[HEADER.FIELDS (DATE)]') or b'', ('Date',))
+        when = message_date(header.get('Date'), msg.get('INTERNALDATE'))
+        key = when.strftime(fmt) if when else 'Unknown'
+        counts[key] = counts.get(key, 0) + 1
+        total += 1
+    return counts, total
+
+def search_by_date(mailbox, year=None, limit=20, histogram=None, cached=False):
+    """Search mailbox by date range
+
+    Args:
+        histogram: 'month' or 'year' to show the date distribution of all
+            matches instead of a preview
+        cached: Answer from (and top up) the local header cache
+    """
     print_header(f"Search: {mailbox}" + (f" (Year {year})" if year else ""))
 
     imap = connect_imap()
     if not imap:
         return
-
-    imap.select(f'"{mailbox}"', readonly=True)
+    get_capabilities(imap)
 
     # Search criteria
     if year:
@@ -603,58 +2020,1252 @@ def search_by_date(mailbox, year=None, limit=20):
         search_criteria = 'ALL'
         print_info("Getting all messages...")
 
-    status, data = imap.uid('search', None, search_criteria)
-    uids = data[0].decode().split()
+    counts, summaries = {}, []
+    try:
+        if cached:
+            cache = HeaderCache()
+            cache.refresh(imap, mailbox)
+            since, before = (f"{year}-01-01", f"{year}-12-31") if year else (None, None)
+            total = cache.count(mailbox, since, before)
+            if histogram:
+                counts = cache.histogram(mailbox, histogram, since, before)
+            else:
+                summaries = cache.summaries(mailbox, since, before, limit)
+            cache.close()
+        else:
+            status, data = imap.select(f'"{mailbox}"', readonly=True)
+            exists = int(data[0]) if status == "OK" else 0
+            uids = search_uids(imap, search_criteria, exists)
+            if histogram:
+                counts, total = date_histogram(imap, uids, histogram)
+            else:
+                # Keep the first few UIDs for the preview and count the rest
+                preview = []
+                total = 0
+                for uid in uids:
+                    total += 1
+                    if len(preview) < limit:
+                        preview.append(uid)
+                # ENVELOPE carries the parsed Date and Subject, so a whole
+                # window of messages is summarized by one FETCH
+                summaries = [envelope_summary(msg) for msg in fetch_summaries(imap, preview)]
+    except (imaplib.IMAP4.error, sqlite3.Error) as e:
+        print_error(f"Error: {e}")
+        imap.logout()
+        return
+    imap.logout()
+
+    print_success(f"Found {total:,} messages")
 
-    print_success(f"Found {len(uids)} messages")
+    if histogram:
+        if counts:
+            widest = max(counts.values())
+            print(f"\n{Colors.BOLD}{'Period':<10} {'Messages':>10}{Colors.ENDC}")
+            print("-" * 80)
+            for key in sorted(counts):
+                bar = '█' * max(1, round(counts[key] / widest * 50))
+                print(f"{key:<10} {counts[key]:>10,}  {Colors.CYAN}{bar}{Colors.ENDC}")
+        return
 
-    if not uids:
-        imap.logout()
+    if not summaries:
         return
 
     # Sample messages to show date distribution
-    print(f"\n{Colors.BOLD}Showing first {min(limit, len(uids))} messages:{Colors.ENDC}\n")
-    print(f"{Colors.BOLD}{'UID':<10} {'Date':<20} {'Subject'}{Colors.ENDC}")
+    print(f"\n{Colors.BOLD}Showing first {len(summaries)} messages:{Colors.ENDC}\n")
+    print(f"{Colors.BOLD}{'UID':<10} {'Date':<20} {'Size':>8}  {'Subject'}{Colors.ENDC}")
     print("-" * 80)
+    for summary in summaries:
+        date_display = summary['date'][:16].replace('T', ' ') if summary['date'] else 'Unknown'
+        subject = summary['subject'] or 'No subject'
+        size = f"{(summary['size'] or 0) / 1024:,.0f}K"
+        print(f"{summary['uid']:<10} {date_display:<20} {size:>8}  {subject[:50]}")
 
-    for uid in uids[:limit]:
-        try:
-            status, data = imap.uid('fetch', uid, '(BODY[HEADER.FIELDS (DATE SUBJECT)])')
-            if status == "OK":
-                headers = data[0][1].decode('utf-8', errors='ignore')
-                msg = email.message_from_string(headers)
-                date_str = msg.get('Date', 'Unknown')
-                subject = msg.get('Subject', 'No subject')[:50]
+    if total > len(summaries):
+        print(f"\n{Colors.YELLOW}... and {total - len(summaries):,} more messages{Colors.ENDC}")
+
+    print()
+    print_info(f"To export these messages, use:")
+    print(f"  {Colors.BOLD}./muttpu.py export \"{mailbox}\" ~/backup" +
+          (f" --year {year}" if year else "") + f"{Colors.ENDC}")
+
+class UidSet:
+    """Set of UIDs stored as sorted, non-overlapping [start, end] ranges
 
+    Mail is exported in roughly ascending UID order, so adding a UID almost
+    always extends the last range in O(1) and millions of UIDs collapse into a
+    handful of ranges.
+    """
+
+    def __init__(self, uids=None):
+        self.ranges = []
+        self.count = 0
+        if isinstance(uids, str):
+            self.update_spec(uids)
+        elif uids:
+            for uid in uids:
+                self.add(uid)
+
+    def __contains__(self, uid):
+        uid = int(uid)
+        i = bisect.bisect_right(self.ranges, [uid, float('inf')])
+        return i > 0 and self.ranges[i - 1][1] >= uid
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for start, end in self.ranges:
+            yield from range(start, end + 1)
+
+    def __str__(self):
+        return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in self.ranges)
+
+    def add(self, uid):
+        """Add a UID, returning False if it was already present"""
+        uid = int(uid)
+        ranges = self.ranges
+        if not ranges or uid > ranges[-1][1]:
+            # Fast path: UIDs usually arrive in ascending order
+            if ranges and ranges[-1][1] + 1 == uid:
+                ranges[-1][1] = uid
+            else:
+                ranges.append([uid, uid])
+            self.count += 1
+            return True
+
+        i = bisect.bisect_right(ranges, [uid, float('inf')])
+        if i > 0 and ranges[i - 1][1] >= uid:
+            return False
+        joins_left = i > 0 and ranges[i - 1][1] + 1 == uid
+        joins_right = i < len(ranges) and ranges[i][0] - 1 == uid
+        if joins_left and joins_right:
+            ranges[i - 1][1] = ranges[i][1]
+            del ranges[i]
+        elif joins_left:
+            ranges[i - 1][1] = uid
+        elif joins_right:
+            ranges[i][0] = uid
+        else:
+            ranges.insert(i, [uid, uid])
+        self.count += 1
+        return True
+
+    def update_spec(self, spec):
+        """Merge an IMAP sequence set such as '1:100,105' into the set"""
+        for part in spec.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            start, _, end = part.partition(':')
+            self.ranges.append([int(start), int(end or start)])
+        self.ranges.sort()
+        merged = []
+        for start, end in self.ranges:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.ranges = merged
+        self.count = sum(end - start + 1 for start, end in merged)
+
+SHARD_SCHEMES = ('none', 'date', 'uid', 'hash')
+UID_SHARD_SIZE = 10000  # UIDs per directory with --shard uid
+
+_EML_NAME = re.compile(r'^(\d{8})_\d{6}_(\d+)_')
+
+def eml_shard(filename, scheme):
+    """Subdirectory an exported .eml file belongs in under a sharding scheme
+
+    The shard depends only on the file name (YYYYMMDD_HHMMSS_UID_subject.eml),
+    so exports and reshard agree on where a message goes:
+    date -> YYYY/MM, uid -> UID // UID_SHARD_SIZE (000012 holds UIDs
+    120000-129999), hash -> the first 3 hex digits of the UID's SHA-1.
+
+    Returns:
+        Relative directory ('' when unsharded), or None if the name does not
+        follow the export naming scheme
+    """
+    if scheme in (None, 'none'):
+        return ''
+    match = _EML_NAME.match(filename)
+    if not match:
+        return None
+    day, uid = match.group(1), int(match.group(2))
+    if scheme == 'date':
+        return f"{day[:4]}/{day[4:6]}"
+    if scheme == 'uid':
+        return f"{uid // UID_SHARD_SIZE:06d}"
+    return hashlib.sha1(str(uid).encode()).hexdigest()[:3]
+
+class ExportState:
+    """Resumable export state: JSON metadata plus an append-only UID journal
+
+    Exported UIDs are kept as compact UID ranges tied to the mailbox
+    UIDVALIDITY. Each checkpoint appends only the newly exported UIDs to the
+    journal and fsyncs it; the JSON file is rewritten (atomically) only when
+    the journal gets long, when the export finishes, or when migrating a
+    state file that still has an 'exported_uids' list.
+    """
+
+    # Fold the journal into the JSON file after this many checkpoints
+    COMPACT_EVERY = 1000
+
+    def __init__(self, state_file, mailbox_name, format, fresh=False):
+        self.state_file = Path(state_file)
+        self.journal_file = self.state_file.with_suffix('.journal')
+        self.data = {
+            "mailbox": mailbox_name,
+            "format": format,
+            "uidvalidity": None,
+            "uidnext": None,
+            "highestmodseq": None,
+            "expunged": "",
+            "shard": None,
+            "compress": None,
+            "exported": "",
+            "total_exported": 0,
+            "last_updated": None
+        }
+        self.exported = UidSet()
+        self.pending = []
+        self.journal_lines = 0
+        # A fresh start must not pick up an old journal on the next save
+        self.needs_rewrite = fresh
+
+        if not fresh:
+            self._load()
+
+    def _load(self):
+        """Load the JSON state and replay the journal on top of it"""
+        if self.state_file.exists():
+            with open(self.state_file, 'r') as f:
+                self.data.update(json.load(f))
+
+        legacy_uids = self.data.pop("exported_uids", None)
+        self.exported.update_spec(self.data.get("exported") or "")
+
+        if self.journal_file.exists():
+            with open(self.journal_file, 'r') as f:
+                lines = f.read().split('\n')
+            # The last element is '' for a clean journal, or a torn write
+            entries = [line for line in lines[:-1] if line]
+            self.exported.update_spec(",".join(entries))
+            self.journal_lines = len(entries)
+
+        if legacy_uids is not None:
+            for uid in legacy_uids:
+                self.exported.add(uid)
+            print_info(f"Migrating export state ({len(self.exported):,} UIDs) to compact format")
+            self.compact()
+
+    def __contains__(self, uid):
+        return uid in self.exported
+
+    def __len__(self):
+        return len(self.exported)
+
+    @property
+    def total_exported(self):
+        return len(self.exported)
+
+    def set_uidvalidity(self, uidvalidity):
+        """Record the mailbox UIDVALIDITY, dropping UIDs that belong to an older one
+
+        Returns:
+            True if previously exported UIDs were discarded
+        """
+        previous = self.data.get("uidvalidity")
+        self.data["uidvalidity"] = uidvalidity
+        if previous == uidvalidity:
+            return False
+        self.needs_rewrite = True
+        if previous is None:
+            return False
+        self.exported = UidSet()
+        self.pending = []
+        self.data.update(uidnext=None, highestmodseq=None, expunged="")
+        return True
+
+    def set_sync_point(self, uidnext, highestmodseq=None):
+        """Remember how far the mailbox has been exported for --incremental"""
+        self.data["uidnext"] = uidnext
+        self.data["highestmodseq"] = highestmodseq
+        self.needs_rewrite = True
+
+    def add_expunged(self, uid_spec):
+        """Record UIDs the server reports as expunged, returning how many were new"""
+        expunged = UidSet(self.data.get("expunged") or "")
+        before = len(expunged)
+        expunged.update_spec(uid_spec)
+        self.data["expunged"] = str(expunged)
+        self.needs_rewrite = True
+        return len(expunged) - before
+
+    def set_shard(self, scheme):
+        """Record the directory layout of an eml export"""
+        if self.data.get("shard") != scheme:
+            self.data["shard"] = scheme
+            self.needs_rewrite = True
+
+    def set_compress(self, method):
+        """Record the compression of an mbox or tar export"""
+        if self.data.get("compress") != method:
+            self.data["compress"] = method
+            self.needs_rewrite = True
+
+    def add(self, uid):
+        """Mark a UID as exported (persisted at the next save)"""
+        if self.exported.add(uid):
+            self.pending.append(int(uid))
+
+    def save(self):
+        """Checkpoint: append newly exported UIDs to the journal"""
+        if self.needs_rewrite or self.journal_lines >= self.COMPACT_EVERY:
+            self.compact()
+            return
+        if not self.pending:
+            return
+        with open(self.journal_file, 'a') as f:
+            f.write(format_uid_set(self.pending) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = []
+        self.journal_lines += 1
+
+    def compact(self):
+        """Rewrite the JSON state with all exported UIDs and clear the journal"""
+        self.data["exported"] = str(self.exported)
+        self.data["total_exported"] = len(self.exported)
+        self.data["last_updated"] = datetime.now().isoformat()
+
+        tmp_file = self.state_file.with_name(self.state_file.name + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+        # A crash before this unlink just replays UIDs already in the JSON
+        if self.journal_file.exists():
+            self.journal_file.unlink()
+
+        self.pending = []
+        self.journal_lines = 0
+        self.needs_rewrite = False
+
+COMPRESS_SUFFIX = {'gzip': '.gz', 'zstd': '.zst', 'xz': '.xz'}
+
+class PlainStream:
+    """Uncompressed output file with the same interface as CompressedStream"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data):
+        self.file.write(data)
+
+    def end_member(self):
+        """Flush buffered data and return the end offset of the file"""
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+class CompressedStream:
+    """Compress data in a background thread and append it to a file
+
+    Output is a series of independent members (gzip members, zstd frames or
+    xz streams); gzip, zstd, xz and tar all read such a concatenation as one
+    stream. end_member() closes the current member, so the file can later be
+    cut back to that point and appended to again. zlib and lzma release the
+    GIL while compressing, so the export loop keeps fetching meanwhile.
+    """
+
+    def __init__(self, file, method, queue_size=16):
+        self.file = file
+        self.method = method
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.busy = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _compressor(self):
+        if self.method == 'gzip':
+            return zlib.compressobj(6, zlib.DEFLATED, 31)
+        if self.method == 'xz':
+            return lzma.LZMACompressor(lzma.FORMAT_XZ)
+        return zstandard.ZstdCompressor(level=3).compressobj()
+
+    def _run(self):
+        compressor = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            started = time.monotonic()
+            try:
+                if isinstance(item, threading.Event):
+                    if compressor is not None and self.error is None:
+                        out = compressor.flush()
+                        self.file.write(out)
+                        self.bytes_out += len(out)
+                        self.file.flush()
+                    compressor = None
+                elif self.error is None:
+                    if compressor is None:
+                        compressor = self._compressor()
+                    out = compressor.compress(item)
+                    self.file.write(out)
+                    self.bytes_in += len(item)
+                    self.bytes_out += len(out)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.busy += time.monotonic() - started
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _check(self):
+        if self.error is not None:
+            raise OSError(f"compression failed: {self.error}")
+
+    def write(self, data):
+        self._check()
+        self.queue.put(data)
+
+    def end_member(self):
+        """Finish the current member and return the end offset of the file"""
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        self._check()
+        return self.file.tell()
+
+    def close(self):
+        self.end_member()
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+class ArchiveWriter:
+    """Single-file output (mbox or tar) with a byte-offset index for resume
+
+    Next to ARCHIVE, ARCHIVE.idx gets one "uid start end" line per message
+    with its byte range. Compressed archives end a member at every
+    checkpoint instead, and the range of each message is then that of the
+    members written since the previous checkpoint. At each checkpoint the
+    archive and then the index are fsynced before the export state is
+    committed, so every UID in the state has its bytes on disk. On open,
+    anything written after the last committed message (a crash between
+    checkpoints) is truncated away; only the end of the index has to be read
+    to find it. An index line with UID 0 covers content that predates the
+    index and one with UID -1 a trailer that close() writes again. An
+    archive the state does not account for at all (--fresh, a UIDVALIDITY
+    change, a lost state file) is never truncated but renamed aside.
+    """
+
+    def __init__(self, path, committed, compress=None):
+        """
+        Args:
+            committed: Container of UIDs recorded in the export state
+            compress: None, 'gzip', 'zstd' or 'xz'
+        """
+        self.compress = compress
+        self.path = Path(str(path) + COMPRESS_SUFFIX.get(compress, ''))
+        self.index_path = self.path.with_name(self.path.name + '.idx')
+        self.rotated = None
+        self.discarded = self._recover(committed)
+        file = open(self.path, 'ab')
+        self.stream = CompressedStream(file, compress) if compress else PlainStream(file)
+        self.index = open(self.index_path, 'ab')
+        self.offset = file.tell()
+        self.unindexed = []
+
+    def _recover(self, committed):
+        """Truncate the archive and index to the last committed message
+
+        Returns:
+            Number of archive bytes discarded (not counting a trailer)
+        """
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if size and not len(committed):
+            self._rotate()
+            return self._recover(committed)
+        if not self.index_path.exists():
+            with open(self.index_path, 'wb') as f:
+                if size:
+                    f.write(f"0 0 {size}\n".encode())
+                f.flush()
+                os.fsync(f.fileno())
+            return 0
+
+        end, keep, trailer = 0, 0, 0
+        with open(self.index_path, 'rb') as f:
+            for offset, line in self._lines_backwards(f):
                 try:
-                    date_obj = email.utils.parsedate_to_datetime(date_str)
-                    date_display = date_obj.strftime('%Y-%m-%d %H:%M')
-                except:
-                    date_display = date_str[:16]
+                    uid, start, stop = map(int, line.split())
+                except ValueError:
+                    continue
+                if uid < 0:
+                    trailer += stop - start
+                # Messages are committed in the order they were written
+                elif uid == 0 or uid in committed:
+                    end, keep = stop, offset + len(line)
+                    break
+            else:
+                if size:
+                    # None of it is in the state: it belongs to another export
+                    self._rotate()
+                    return self._recover(committed)
+        end = min(end, size)
+        if size > end:
+            os.truncate(self.path, end)
+        if self.index_path.stat().st_size > keep:
+            os.truncate(self.index_path, keep)
+        return max(0, size - end - trailer)
+
+    def _rotate(self):
+        """Rename the archive and its index aside, e.g. INBOX.mbox to INBOX-20240101-120000.mbox"""
+        base, dot, suffixes = self.path.name.partition('.')
+        stamp = f"{datetime.now():%Y%m%d-%H%M%S}"
+        target = self.path.with_name(f"{base}-{stamp}{dot}{suffixes}")
+        for n in itertools.count(2):
+            if not target.exists():
+                break
+            target = self.path.with_name(f"{base}-{stamp}-{n}{dot}{suffixes}")
+        os.replace(self.path, target)
+        if self.index_path.exists():
+            os.replace(self.index_path, target.with_name(target.name + '.idx'))
+        self.rotated = target
+
+    @staticmethod
+    def _lines_backwards(f, block=65536):
+        """Yield (offset, line) for each complete line of a file, last line first"""
+        f.seek(0, os.SEEK_END)
+        pos, buf = f.tell(), b''
+        while pos > 0 and b'\n' not in buf:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+        # A torn last line (no newline) is not part of the index
+        buf = buf[:buf.rfind(b'\n') + 1]
+        while buf:
+            i = buf.rfind(b'\n', 0, len(buf) - 1)
+            if i < 0 and pos > 0:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+                continue
+            yield pos + i + 1, buf[i + 1:]
+            buf = buf[:i + 1]
+
+    def _append(self, uid, chunks):
+        """Write one message's bytes (an iterable of chunks) and index them"""
+        size = 0
+        for chunk in chunks:
+            self.stream.write(chunk)
+            size += len(chunk)
+        if self.compress:
+            # Its compressed range is only known when the member ends
+            self.unindexed.append(uid)
+        else:
+            start = self.offset
+            self.offset += size
+            self.index.write(f"{uid} {start} {self.offset}\n".encode())
+
+    def flush(self):
+        """Make everything written so far durable, the archive before its index"""
+        end = self.stream.end_member()
+        for uid in self.unindexed:
+            self.index.write(f"{uid} {self.offset} {end}\n".encode())
+        self.unindexed = []
+        self.offset = end
+        os.fsync(self.stream.file.fileno())
+        self.index.flush()
+        os.fsync(self.index.fileno())
+
+    def _trailer(self):
+        """Bytes that end the archive (rewritten by every close)"""
+        return b''
+
+    def close(self):
+        self.flush()
+        trailer = self._trailer()
+        if trailer:
+            self.stream.write(trailer)
+            end = self.stream.end_member()
+            self.index.write(f"-1 {self.offset} {end}\n".encode())
+            self.offset = end
+            os.fsync(self.stream.file.fileno())
+        self.stream.close()
+        self.index.close()
+
+    def compression_stats(self):
+        """(bytes in, bytes out, seconds spent compressing), or None"""
+        if not self.compress:
+            return None
+        return self.stream.bytes_in, self.stream.bytes_out, self.stream.busy
+
+class MboxWriter(ArchiveWriter):
+    """Append messages to an mbox file without reading what is already there"""
+
+    @staticmethod
+    def _from_line(message):
+        """Build the From_ separator line from the sender and Date header"""
+        headers = scan_headers(message, ('Return-Path', 'From', 'Date'))
+        sender = email.utils.parseaddr(headers.get('Return-Path') or headers.get('From') or '')[1]
+        if not sender or any(c.isspace() for c in sender):
+            sender = 'MAILER-DAEMON'
+        when = message_date(headers.get('Date'))
+        stamp = time.asctime(when.utctimetuple() if when else time.gmtime())
+        return f"From {sender} {stamp}\n".encode()
+
+    @staticmethod
+    def _escape(chunks, max_line=65536):
+        """Convert CRLF to LF and apply mboxo quoting, chunk by chunk
+
+        Chunks are cut at line ends so quoting sees whole lines; a line
+        longer than max_line is passed through in pieces.
+        """
+        carry, line_start, last = b'', True, b'\n'
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is None:
+                data, cut = carry, len(carry)
+            else:
+                data = carry + chunk
+                cut = data.rfind(b'\n') + 1
+                if not cut and len(data) > max_line:
+                    # Keep the last byte: it may be a CR whose LF is still to come
+                    cut = len(data) - 1
+            part, carry = data[:cut], data[cut:]
+            if not part:
+                continue
+            part = part.replace(b'\r\n', b'\n')
+            # mboxo quoting, as in the stdlib mailbox module
+            if line_start and part.startswith(b'From '):
+                part = b'>' + part
+            part = part.replace(b'\nFrom ', b'\n>From ')
+            line_start = last = part.endswith(b'\n')
+            yield part
+        if not last:
+            yield b'\n'
+
+    def add(self, uid, message):
+        """Append one message (bytes) and record its byte range in the index"""
+        self._append(uid, itertools.chain([self._from_line(message)], self._escape([message]), [b'\n']))
+
+    def add_file(self, uid, path):
+        """Append one message streamed to a file, without loading it into memory"""
+        self._append(uid, itertools.chain([self._from_line(read_head(path))],
+                                          self._escape(read_chunks(path)), [b'\n']))
+
+class TarWriter(ArchiveWriter):
+    """Append messages as .eml members of a tar archive"""
+
+    def _header(self, name, size, head):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        when = message_date(scan_headers(head, ('Date',)).get('Date'))
+        info.mtime = int(when.timestamp()) if when else int(time.time())
+        info.mode = 0o644
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    def add(self, uid, name, message):
+        """Append one message (bytes) as a file called name"""
+        padding = b'\0' * (-len(message) % tarfile.BLOCKSIZE)
+        self._append(uid, (self._header(name, len(message), message), message, padding))
+
+    def add_file(self, uid, name, path):
+        """Append one message streamed to a file, without loading it into memory"""
+        size = os.path.getsize(path)
+        padding = b'\0' * (-size % tarfile.BLOCKSIZE)
+        self._append(uid, itertools.chain([self._header(name, size, read_head(path))],
+                                          read_chunks(path), [padding]))
+
+    def _trailer(self):
+        # Two zero blocks mark the end of a tar archive
+        return b'\0' * (2 * tarfile.BLOCKSIZE)
+
+class ContentStore:
+    """Content-addressed message store shared by folders and runs
+
+    Each message is stored once, as objects/ab/<sha256 of its raw bytes>.
+    store.db maps Message-ID and size to stored objects so an exporter can
+    recognize a message it already has before downloading it.
+    """
 
-                print(f"{uid:<10} {date_display:<20} {subject}")
-        except Exception as e:
-            print(f"{uid:<10} {Colors.RED}Error: {e}{Colors.ENDC}")
+    _open = {}
+    _open_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        """Return the store for a directory, shared by every exporter in the process"""
+        path = Path(path).resolve()
+        with cls._open_lock:
+            if path not in cls._open:
+                cls._open[path] = cls(path)
+            return cls._open[path]
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.objects = self.path / "objects"
+        (self.objects / "tmp").mkdir(parents=True, exist_ok=True)
+        # Used from fetch threads and from several folder exports
+        self.db = sqlite3.connect(str(self.path / "store.db"), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.pending = []
+        with self.lock, self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS objects (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    message_id TEXT
+                );
+                CREATE INDEX IF NOT EXISTS objects_message_id ON objects (message_id, size);
+            """)
+
+    def _object_path(self, digest):
+        return self.objects / digest[:2] / digest
+
+    def lookup(self, message_id, size):
+        """Digest of a stored message with this Message-ID and size, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT sha256 FROM objects WHERE message_id = ? AND size = ? LIMIT 1',
+                                  (message_id, size)).fetchone()
+        if row and self._object_path(row[0]).exists():
+            return row[0]
+        return None
 
-    if len(uids) > limit:
-        print(f"\n{Colors.YELLOW}... and {len(uids) - limit} more messages{Colors.ENDC}")
+    def _index(self, digest, size, message_id, new_object=None):
+        """Add the index row of an object (committed at the next flush)
+
+        The row is added even when the object was already on disk: a run
+        interrupted before its commit, or a restored store.db, can leave
+        objects without one.
+        """
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO objects (sha256, size, message_id) VALUES (?, ?, ?)',
+                            (digest, size, message_id))
+            if new_object:
+                self.pending.append(new_object)
+
+    def put(self, message, message_id=None):
+        """Store a message unless identical bytes are stored already
+
+        Returns:
+            (digest, True if a new object was written)
+        """
+        digest = hashlib.sha256(message).hexdigest()
+        target = self._object_path(digest)
+        if target.exists():
+            self._index(digest, len(message), message_id)
+            return digest, False
+        target.parent.mkdir(exist_ok=True)
+        tmp = self.objects / "tmp" / f"{digest}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, 'wb') as f:
+            f.write(message)
+        # A concurrent put of the same message renames identical bytes
+        os.replace(tmp, target)
+        self._index(digest, len(message), message_id, target)
+        return digest, True
+
+    def put_file(self, path, message_id=None):
+        """Store a message streamed to a file (moved into the store or removed)
+
+        Returns:
+            (digest, True if a new object was written)
+        """
+        sha = hashlib.sha256()
+        size = 0
+        for chunk in read_chunks(path):
+            sha.update(chunk)
+            size += len(chunk)
+        digest = sha.hexdigest()
+        target = self._object_path(digest)
+        if target.exists():
+            os.unlink(path)
+            self._index(digest, size, message_id)
+            return digest, False
+        target.parent.mkdir(exist_ok=True)
+        os.replace(path, target)
+        self._index(digest, size, message_id, target)
+        return digest, True
+
+    def flush(self):
+        """Make new objects durable, then commit their index rows"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            for path in pending + sorted({path.parent for path in pending}):
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self.db.commit()
 
-    imap.logout()
+class StoreWriter(ArchiveWriter):
+    """Reference messages in a ContentStore from a NAME.refs file
 
-    print()
-    print_info(f"To export these messages, use:")
-    print(f"  {Colors.BOLD}./muttpu.py export \"{mailbox}\" ~/backup" +
-          (f" --year {year}" if year else "") + f"{Colors.ENDC}")
+    The refs file has one "uid sha256" line per message and is recovered
+    like an archive, so resumed exports stay consistent with the state.
+    """
+
+    def __init__(self, path, committed, store):
+        super().__init__(path, committed)
+        self.store = store
+        self.new_objects = 0
+        self.new_bytes = 0
+        self.reused = 0
+        self.not_downloaded = 0
+
+    def add(self, uid, message=None, message_id=None, digest=None):
+        """Reference a message, storing it first unless a digest of a stored copy is given"""
+        if digest is None:
+            digest, new = self.store.put(message, message_id)
+            if new:
+                self.new_objects += 1
+                self.new_bytes += len(message)
+            else:
+                self.reused += 1
+        else:
+            self.reused += 1
+            self.not_downloaded += 1
+        self._append(uid, (f"{uid} {digest}\n".encode(),))
+
+    def add_file(self, uid, path, message_id=None):
+        """Reference a message streamed to a file, moving it into the store"""
+        size = os.path.getsize(path)
+        digest, new = self.store.put_file(path, message_id)
+        if new:
+            self.new_objects += 1
+            self.new_bytes += size
+        else:
+            self.reused += 1
+        self._append(uid, (f"{uid} {digest}\n".encode(),))
+
+    def flush(self):
+        # Objects must be on disk before the references to them
+        self.store.flush()
+        super().flush()
+
+def process_running(pid):
+    """Whether a process with this pid exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class MaildirWriter:
+    """Deliver messages into a Maildir, committing them in batches
+
+    Each message is written to tmp/ under a unique name. flush() fsyncs the
+    batch, renames it into cur/ with its IMAP flags as the ":2," info and
+    fsyncs the directory once, so a checkpoint costs one directory sync
+    rather than one per message and cur/ only ever holds complete files.
+    Names include the pid, thread and a counter, and nothing is locked, so
+    any number of writers can deliver into the same Maildir. They also carry
+    the UID and UIDVALIDITY (",U=uid,V=uidvalidity"), so a resumed export can
+    tell which messages were delivered after the last saved checkpoint.
+    Opening a writer deletes what crashed writers left in tmp/.
+    """
+
+    FLAGS = {'\\DRAFT': 'D', '\\FLAGGED': 'F', '$FORWARDED': 'P', '\\ANSWERED': 'R',
+             '\\SEEN': 'S', '\\DELETED': 'T'}
+
+    _DELIVERED = re.compile(r',U=(\d+),V=(\d+)')
+    _WRITER = re.compile(r'^\d+\.M\d+P(\d+)T\d+Q\d+\.(.+?),S=')
+    STALE_TMP = 36 * 3600  # Maildir's rule for abandoned tmp/ files
+
+    def __init__(self, path, uidvalidity=None):
+        self.path = Path(path)
+        self.uidvalidity = uidvalidity
+        for sub in ('tmp', 'new', 'cur'):
+            (self.path / sub).mkdir(parents=True, exist_ok=True)
+        # "/" and ":" are not allowed in the unique part of the name
+        self.hostname = socket.gethostname().replace('/', '\\057').replace(':', '\\072')
+        self.counter = itertools.count()
+        self.pending = []
+        self.lock = threading.Lock()
+        self.discarded = self._clean_tmp()
+
+    def _clean_tmp(self):
+        """Delete tmp/ files whose writer is gone
+
+        A file from this host belongs to a dead writer if its process is no
+        longer running, or is this one (a process opens one writer per
+        Maildir). Anything else is left alone until it is 36 hours old.
+
+        Returns:
+            Number of files deleted
+        """
+        tmp = self.path / 'tmp'
+        removed = 0
+        for name in os.listdir(tmp):
+            match = self._WRITER.match(name)
+            if match and match.group(2) == self.hostname:
+                pid = int(match.group(1))
+                stale = pid == os.getpid() or not process_running(pid)
+            else:
+                try:
+                    stale = time.time() - os.stat(tmp / name).st_mtime > self.STALE_TMP
+                except FileNotFoundError:
+                    continue
+            if stale:
+                try:
+                    os.unlink(tmp / name)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    @classmethod
+    def delivered(cls, path, uidvalidity):
+        """UIDs of the messages in cur/ and new/ exported under this UIDVALIDITY"""
+        uids = []
+        for sub in ('cur', 'new'):
+            try:
+                names = os.listdir(Path(path) / sub)
+            except FileNotFoundError:
+                continue
+            for name in names:
+                match = cls._DELIVERED.search(name)
+                if match and int(match.group(2)) == uidvalidity:
+                    uids.append(int(match.group(1)))
+        return UidSet(sorted(uids))
+
+    def _name(self, uid, size):
+        now = time.time()
+        return (f"{int(now)}.M{int(now % 1 * 1e6)}P{os.getpid()}"
+                f"T{threading.get_ident()}Q{next(self.counter)}.{self.hostname},S={size}"
+                f",U={uid},V={self.uidvalidity or 0}")
+
+    def _pend(self, name, flags):
+        info = "".join(sorted({self.FLAGS[flag.upper()] for flag in flags if flag.upper() in self.FLAGS}))
+        with self.lock:
+            self.pending.append((name, f"{name}:2,{info}"))
+
+    def add(self, uid, message, flags=()):
+        """Write one message (bytes) to tmp/; it moves to cur/ at the next flush"""
+        name = self._name(uid, len(message))
+        with open(self.path / 'tmp' / name, 'wb') as f:
+            f.write(message)
+        self._pend(name, flags)
+
+    def add_file(self, uid, path, flags=()):
+        """Move a message streamed to a file (on the same filesystem) into tmp/"""
+        name = self._name(uid, os.path.getsize(path))
+        os.replace(path, self.path / 'tmp' / name)
+        self._pend(name, flags)
+
+    def flush(self):
+        """Make the pending messages durable and move them into cur/"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        tmp, cur = self.path / 'tmp', self.path / 'cur'
+        for name, _ in pending:
+            fd = os.open(tmp / name, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for name, final in pending:
+            os.rename(tmp / name, cur / final)
+        fd = os.open(cur, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self.flush()
+
+class FetchBudget:
+    """Adaptive byte budget for FETCH round trips
+
+    Every round trip reports how many bytes it brought in and how long it
+    took. The budget follows the smoothed throughput so that a round trip
+    takes about TARGET_SECONDS: it grows (at most doubling each time) while
+    the server keeps up and shrinks as soon as round trips slow down. Shared
+    by all fetch threads of an export.
+    """
+
+    TARGET_SECONDS = 2.0
+    START_BYTES = 1048576
+    MIN_BYTES = 64 * 1024
+    MAX_BYTES = 32 * 1048576
+    MAX_MESSAGES = 500
+
+    def __init__(self, max_bytes=None, max_messages=None):
+        """
+        Args:
+            max_bytes: Upper bound for the budget (--fetch-mb)
+            max_messages: Messages per round trip (--fetch-batch)
+        """
+        self.max_bytes = max_bytes or self.MAX_BYTES
+        self.messages = max_messages or self.MAX_MESSAGES
+        self.bytes = min(self.START_BYTES, self.max_bytes)
+        self.rate = None
+        self.lock = threading.Lock()
+
+    def record(self, nbytes, seconds):
+        """Adjust the budget after a round trip"""
+        if nbytes <= 0 or seconds <= 0:
+            return
+        with self.lock:
+            rate = nbytes / seconds
+            # Smooth out single unusually slow or fast round trips
+            self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+            target = min(self.rate * self.TARGET_SECONDS, self.bytes * 2)
+            self.bytes = int(min(self.max_bytes, max(self.MIN_BYTES, target)))
+
+class RateController:
+    """AIMD control of the FETCH requests sent to a throttling server
+
+    Throttle signals - busy/throttled NO or BAD responses, dropped sessions
+    and round trips far slower than the best seen so far - pause new
+    requests briefly (as long as the server suggests, if it does) and halve
+    the number of requests allowed in flight, at most once per COOLDOWN.
+    Once that is down to one, the request rate is halved instead, enforced
+    by a token bucket. Each round of successful requests gives back one
+    step: rate first, then concurrency. Shared by all fetch threads of an
+    export.
+    """
+
+    COOLDOWN = 5.0
+    SLOW_FACTOR = 4
+    MIN_RATE = 0.1
+    MAX_PAUSE = 300
+    SIGNALS = ('throttl', 'busy', 'try again', 'unavailable', 'too many', 'rate limit',
+               'limit exceeded', '[limit]', '[inuse]')
+    _BACKOFF = re.compile(r'backoff time:\s*(\d+)\s*milliseconds', re.I)
+
+    def __init__(self, max_limit):
+        """
+        Args:
+            max_limit: Requests in flight when the server keeps up
+        """
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.rate = None  # Requests per second while pacing
+        self.ceiling = None
+        self.tokens = 1.0
+        self.refilled = time.monotonic()
+        self.starts = collections.deque(maxlen=20)
+        self.paused_until = 0.0
+        self.strikes = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        self.smoothed = None
+        self.best = 0.0
+        self.throttles = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def is_throttle(cls, error):
+        """Whether an error is transient: the server is overloaded or dropped the session"""
+        if isinstance(error, ConnectionLost):
+            return False
+        if isinstance(error, (imaplib.IMAP4.abort, OSError, EOFError)):
+            return True
+        text = str(error).lower()
+        return any(signal in text for signal in cls.SIGNALS)
+
+    def wait_time(self):
+        """Take a token for one request; returns the seconds to wait before sending it"""
+        with self.lock:
+            now = time.monotonic()
+            self.starts.append(now)
+            wait = max(0.0, self.paused_until - now)
+            if self.rate is not None:
+                self.tokens = min(1.0, self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                self.tokens -= 1
+                wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def success(self, nbytes, seconds):
+        """Record a completed request; returns a description if the limits changed"""
+        with self.lock:
+            if nbytes > 0 and seconds > 0:
+                rate = nbytes / seconds
+                self.smoothed = rate if self.smoothed is None else 0.7 * self.smoothed + 0.3 * rate
+                self.best = max(self.best, self.smoothed)
+                if (seconds > FetchBudget.TARGET_SECONDS and
+                        self.smoothed * self.SLOW_FACTOR < self.best):
+                    return self._decrease("backing off")
+            self.strikes = 0
+            self.successes += 1
+            if self.successes < self.limit:
+                return None
+            self.successes = 0
+            if self.rate is not None:
+                self.rate += max(self.MIN_RATE, self.ceiling / 10)
+                if self.rate >= self.ceiling:
+                    self.rate = None
+                return None
+            if self.limit < self.max_limit:
+                self.limit += 1
+            return None
+
+    def throttle(self, error):
+        """Record a throttle signal; returns a description if the limits changed"""
+        with self.lock:
+            self.strikes += 1
+            match = self._BACKOFF.search(str(error))
+            pause = int(match.group(1)) / 1000 if match else 2 ** self.strikes
+            self.paused_until = max(self.paused_until, time.monotonic() + min(pause, self.MAX_PAUSE))
+            return self._decrease(f"paused {min(pause, self.MAX_PAUSE):,.1f}s")
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        if now - self.last_decrease < self.COOLDOWN:
+            return None
+        self.last_decrease = now
+        self.throttles += 1
+        self.successes = 0
+        # Measure afresh at the new settings
+        self.smoothed = None
+        self.best = 0.0
+        if self.limit > 1:
+            self.limit = max(1, self.limit // 2)
+            return f"{reason}, down to {self.limit} requests in flight"
+        if self.rate is None:
+            span = self.starts[-1] - self.starts[0] if len(self.starts) > 1 else 0
+            self.ceiling = (len(self.starts) - 1) / span if span > 0 else 1.0
+            self.rate = self.ceiling
+        self.rate = max(self.MIN_RATE, self.rate / 2)
+        self.tokens = 0.0
+        self.refilled = now
+        return f"{reason}, down to {self.rate:,.1f} requests/s"
+
+class Prefetcher:
+    """Run an iterator in a background thread, at most depth items ahead
+
+    One stage of the export pipeline: the producer blocks when the queue
+    is full, and exceptions it raises are re-raised to the consumer. The
+    queue fill level shows which side is the bottleneck.
+    """
+
+    _DONE = object()
+
+    def __init__(self, iterable, depth):
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(iter(iterable),), daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self, items):
+        try:
+            for item in items:
+                if not self._put((item, None)):
+                    return
+            self._put((self._DONE, None))
+        except BaseException as e:
+            self._put((self._DONE, e))
+        finally:
+            # Lets a generator source run its cleanup in this thread
+            close = getattr(items, 'close', None)
+            if close:
+                close()
+
+    def __iter__(self):
+        try:
+            while True:
+                item, error = self.queue.get()
+                if item is self._DONE:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            self.stop.set()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+class ConnectionLost(imaplib.IMAP4.error):
+    """The IMAP session died and could not be re-established"""
 
 class MailboxExporter:
     """Export mailbox to eml or mbox format"""
 
+    # Number of UIDs per RFC822.SIZE lookup when batching by byte budget
+    SIZE_WINDOW = 1000
+    # Messages per round trip when the server does not report sizes
+    FALLBACK_FETCH_BATCH = 50
+    # Messages this large are downloaded in chunks to a spool file
+    STREAM_THRESHOLD = 8 * 1048576
+    STREAM_CHUNK = 4 * 1048576
+    # Default number of processes parsing and re-serializing messages
+    MAX_PARSE_WORKERS = 4
+    # FETCH commands in flight per connection with --engine async
+    PIPELINE_DEPTH = 4
+    # Reconnect attempts for a dead session, with exponential backoff (seconds)
+    MAX_RETRIES = 5
+    RETRY_BACKOFF = 2
+    # Times a batch that failed transiently goes back into the queue
+    MAX_REQUEUES = 3
+
     def __init__(self, mailbox_name, output_dir, format="eml", batch_size=100,
-                 limit=None, skip=None, range_spec=None, year=None, fresh=False, verbose=False):
+                 limit=None, skip=None, range_spec=None, year=None, fresh=False, verbose=False,
+                 fetch_batch=None, fetch_bytes=None, connections=1, raw=False, incremental=False,
+                 quiet=False, progress=None, shard=None, compress=None, store_dir=None,
+                 parse_workers=None):
         self.mailbox_name = mailbox_name
         self.output_dir = Path(output_dir)
         self.format = format.lower()
         self.batch_size = batch_size
+        self.fetch_batch = max(1, fetch_batch) if fetch_batch else None
+        self.fetch_bytes = fetch_bytes
+        self.budget = FetchBudget(fetch_bytes, self.fetch_batch)
+        self.large_messages = 0
+        self.large_sizes = {}
+        self.connections = max(1, connections)
+        self.rate_control = RateController(
+            self.connections * (self.PIPELINE_DEPTH if IMAP_ENGINE == "async" else 1))
+        self.requeued = collections.deque()
+        self.requeues = collections.Counter()
+        self.drained = False
+        self.raw = raw
+        self.incremental = incremental
+        self.quiet = quiet
+        self.progress = progress
+        self.shard = shard
+        self.shard_dirs = set()
+        self.compress = compress
+        self.store_dir = Path(store_dir) if store_dir else self.output_dir
+        if parse_workers is None:
+            parse_workers = min(self.MAX_PARSE_WORKERS, os.cpu_count() or 1)
+        self.parse_workers = max(0, parse_workers)
+        self.fetch_stage = None
+        self.parse_stage = None
+        self.parsing = collections.deque()
+        self.depth_totals = collections.Counter()
+        self.depth_samples = 0
+        self.errors = []
+        self.finished = False
+        self.started = None
+        self.exported_bytes = 0
         self.limit = limit
         self.skip = skip
         self.range_spec = range_spec
@@ -665,26 +3276,32 @@ class MailboxExporter:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.state_file = self.output_dir / ".export_state.json"
         self.state = self._load_state()
+        self.store = None
         self.imap = None
+        self.uidvalidity = None
+        self.mailbox_info = {}
 
     def _load_state(self):
         """Load export state from file"""
-        if not self.fresh and self.state_file.exists():
-            with open(self.state_file, 'r') as f:
-                return json.load(f)
-        return {
-            "mailbox": self.mailbox_name,
-            "format": self.format,
-            "exported_uids": [],
-            "total_exported": 0,
-            "last_updated": None
-        }
+        return ExportState(self.state_file, self.mailbox_name, self.format, fresh=self.fresh)
 
-    def _save_state(self):
+    def _save_state(self, final=False):
         """Save export state to file"""
-        self.state["last_updated"] = datetime.now().isoformat()
-        with open(self.state_file, 'w') as f:
-            json.dump(self.state, f, indent=2)
+        if final:
+            self.state.compact()
+        else:
+            self.state.save()
+        if PROFILER:
+            PROFILER.checkpoint(f"{self.mailbox_name}: {self.state.total_exported:,} messages exported")
+
+    def _log(self, printer, text):
+        """Print a status message (quiet mode keeps only warnings and errors)"""
+        if not self.quiet:
+            printer(text)
+        elif printer in (print_warning, print_error):
+            # Clear the combined progress line before printing
+            print("\r" + " " * 100 + "\r", end='')
+            printer(f"{self.mailbox_name}: {text}")
 
     def _sanitize_filename(self, text, max_length=50):
         """Sanitize text for use in filename"""
@@ -692,160 +3309,1023 @@ class MailboxExporter:
         return safe[:max_length].strip()
 
     def _print_progress_bar(self, current, total, width=50):
-        """Print a progress bar"""
+        """Print a progress bar with throughput and ETA"""
         pct = (current / total) * 100
         filled = int(width * current / total)
         bar = '█' * filled + '░' * (width - filled)
-        print(f"\r  {Colors.CYAN}[{bar}] {pct:.1f}% ({current:,}/{total:,}){Colors.ENDC}", end='', flush=True)
+        rate = ""
+        elapsed = time.monotonic() - self.started if self.started else 0
+        if elapsed > 1 and current:
+            rate = (f" {current / elapsed:,.0f} msgs/s, {self.exported_bytes / elapsed / 1048576:,.1f} MB/s, "
+                    f"ETA {format_duration((total - current) * elapsed / current)}")
+        print(f"\r  {Colors.CYAN}[{bar}] {pct:.1f}% ({current:,}/{total:,}){rate}{Colors.ENDC}  ",
+              end='', flush=True)
 
     def export(self):
         """Run the export"""
-        print_header(f"Export: {self.mailbox_name}")
+        self._log(print_header, f"Export: {self.mailbox_name}")
 
-        # Connect to IMAP
-        print_info("Connecting to IMAP server...")
-        token = get_token()
-        auth_string = f'user={EMAIL}\x01auth=Bearer {token}\x01\x01'
+        if self.incremental and (self.range_spec or self.skip or self.limit):
+            self._log(print_error, "--incremental cannot be combined with --range, --skip or --limit")
+            return
 
-        self.imap = imaplib.IMAP4_SSL(IMAP_SERVER)
-        self.imap.authenticate("XOAUTH2", lambda x: auth_string.encode())
+        if self.format == "eml":
+            # Resumed exports keep the layout they were started with
+            previous = self.state.data.get("shard")
+            if self.shard is None:
+                self.shard = previous or "none"
+            elif previous and previous != self.shard and self.state.total_exported:
+                self._log(print_error, f"This export uses --shard {previous}; to change the layout run: "
+                                       f"./muttpu.py reshard {self.output_dir} --shard {self.shard}")
+                return
+            self.state.set_shard(self.shard)
+        elif self.format in ("mbox", "tar"):
+            # Appending to a differently compressed archive would split it
+            previous = self.state.data.get("compress")
+            if self.compress is None and self.state.total_exported:
+                self.compress = previous
+            if self.compress != previous and self.state.total_exported:
+                self._log(print_error, "This export was started " +
+                          (f"with --compress {previous}" if previous else "without --compress") +
+                          "; use --fresh to start over")
+                return
+            self.state.set_compress(self.compress)
+        elif self.format == "store":
+            self.store = ContentStore.open(self.store_dir)
+        # Spool files of large messages left behind by an interrupted run
+        for stale in self.output_dir.glob('.muttpu-*.part'):
+            stale.unlink()
 
-        status, data = self.imap.select(f'"{self.mailbox_name}"', readonly=True)
-        if status != "OK":
-            print_error(f"Failed to select mailbox: {self.mailbox_name}")
+        # Connect to IMAP
+        wire_before = DEFLATE_STATS.snapshot()
+        self._log(print_info, "Connecting to IMAP server...")
+        try:
+            self.imap, total_in_mailbox = self._connect(primary=True)
+        except (imaplib.IMAP4.error, OSError) as e:
+            self._log(print_error, str(e))
             return
 
-        total_in_mailbox = int(data[0].decode())
-        print_success(f"Connected to {self.mailbox_name} ({total_in_mailbox:,} total messages)")
+        self._log(print_success, f"Connected to {self.mailbox_name} ({total_in_mailbox:,} total messages)")
 
-        # Get UIDs to export
-        uids = self._get_uids_to_export()
+        if self.uidvalidity is not None and self.state.set_uidvalidity(self.uidvalidity):
+            self._log(print_warning, "Mailbox UIDVALIDITY changed since the last export - "
+                          "previously exported UIDs no longer apply, exporting everything again")
 
-        if not uids:
-            print_warning("No messages to export")
+        since_uid = self._incremental_start() if self.incremental else None
+        if since_uid is not None and since_uid >= self.mailbox_info.get('UIDNEXT', since_uid + 1):
+            self._log(print_success, "No new messages since the last sync")
+            self._record_sync_point()
+            self._save_state(final=True)
             self.imap.logout()
+            self.finished = True
             return
 
-        print_info(f"Will export {len(uids):,} messages")
+        # Maildir messages delivered after the last checkpoint was saved
+        maildir = self.output_dir / self._sanitize_filename(self.mailbox_name)
+        delivered = MaildirWriter.delivered(maildir, self.uidvalidity) if self.format == "maildir" else ()
+
+        # Get UIDs to export, keeping only those not exported yet as ranges
+        matched = 0
+        recovered = 0
+        uids_to_export = UidSet()
+        for uid in self._get_uids_to_export(since_uid):
+            matched += 1
+            if uid in delivered and uid not in self.state:
+                self.state.add(uid)
+                recovered += 1
+            if uid not in self.state:
+                uids_to_export.add(uid)
+        if recovered:
+            self._log(print_info, f"{recovered:,} messages were delivered before the last checkpoint "
+                                  "was saved; not fetching them again")
+
+        if not matched:
+            self._log(print_warning, "No messages to export")
+            self._record_sync_point()
+            self._save_state(final=True)
+            self.imap.logout()
+            self.finished = True
+            return
 
-        # Check resume
-        already_exported = set(self.state.get("exported_uids", []))
-        uids_to_export = [uid for uid in uids if uid not in already_exported]
+        self._log(print_info, f"Will export {matched:,} messages")
 
-        if len(already_exported) > 0:
-            print_warning(f"Resuming: {len(already_exported):,} already exported, {len(uids_to_export):,} remaining")
+        # Check resume
+        if self.state.total_exported > 0:
+            self._log(print_warning, f"Resuming: {self.state.total_exported:,} already exported, {len(uids_to_export):,} remaining")
 
         if not uids_to_export:
-            print_success("All messages already exported!")
+            self._log(print_success, "All messages already exported!")
+            self._record_sync_point()
+            self._save_state(final=True)
             self.imap.logout()
+            self.finished = True
             return
 
         # Setup output format
-        if self.format == "mbox":
-            mbox_path = self.output_dir / f"{self._sanitize_filename(self.mailbox_name)}.mbox"
-            mbox = mailbox.mbox(str(mbox_path))
-
-        # Export messages
-        errors = []
-        for idx, uid in enumerate(uids_to_export, 1):
-            try:
-                # Fetch message
-                status, data = self.imap.uid('fetch', uid, '(RFC822)')
-                if status != "OK":
+        writer = None
+        if self.format in ("mbox", "tar"):
+            archive_path = self.output_dir / f"{self._sanitize_filename(self.mailbox_name)}.{self.format}"
+            archive = MboxWriter if self.format == "mbox" else TarWriter
+            writer = archive(archive_path, self.state, self.compress)
+        elif self.format == "maildir":
+            writer = MaildirWriter(maildir, self.uidvalidity)
+        elif self.format == "store":
+            refs_path = self.output_dir / f"{self._sanitize_filename(self.mailbox_name)}.refs"
+            writer = StoreWriter(refs_path, self.state, self.store)
+        if isinstance(writer, ArchiveWriter) and writer.rotated:
+            self._log(print_warning, f"{writer.path.name} holds messages this export has no record of "
+                                     f"(--fresh or a UIDVALIDITY change); kept it as {writer.rotated.name}")
+        if isinstance(writer, ArchiveWriter) and writer.discarded:
+            self._log(print_warning, f"Discarded {writer.discarded:,} bytes of {writer.path.name} "
+                                     "written after the last checkpoint")
+        if isinstance(writer, MaildirWriter) and writer.discarded:
+            self._log(print_info, f"Removed {writer.discarded:,} unfinished deliveries from {maildir.name}/tmp")
+
+        if self.connections > 1:
+            self._log(print_info, f"Using {self.connections} parallel connections")
+
+        # Export messages, fetching several UIDs per round trip
+        errors = self.errors
+        idx = 0
+        last_checkpoint = 0
+        exported = 0
+        total = len(uids_to_export)
+        started = self.started = time.monotonic()
+        for batch, messages, error in self._pipeline(uids_to_export):
+            self._sample_depths()
+            # The batch will not be fetched again, however it turned out
+            for uid in batch:
+                self.large_sizes.pop(uid, None)
+            if error is not None:
+                errors.extend((uid, str(error)) for uid in batch)
+                STATS.error('fetch', len(batch))
+                idx += len(batch)
+                continue
+
+            for uid in batch:
+                idx += 1
+                fetched = messages.get(uid)
+                if fetched is None:
                     errors.append((uid, "fetch failed"))
+                    STATS.error('fetch')
                     continue
+                # Store exports skip the download of messages already stored
+                raw_email = fetched.get('RFC822')
+                spool = fetched.get('SPOOL')
 
-                raw_email = data[0][1]
-                msg = email.message_from_bytes(raw_email)
-
-                # Save based on format
-                if self.format == "eml":
-                    self._save_eml(uid, msg)
-                else:  # mbox
-                    mbox.add(msg)
+                write_started = time.monotonic()
+                try:
+                    if spool:
+                        # Streamed to disk; written as received, never parsed
+                        self._save_spooled(uid, fetched, writer)
+                    elif self.format == "store":
+                        # Stored byte-for-byte, so identical copies hash the same
+                        writer.add(uid, raw_email, fetched.get('MESSAGE-ID'), fetched.get('SHA256'))
+                    else:
+                        # Raw mode writes the fetched bytes untouched; otherwise
+                        # the message is parsed and re-serialized (normally
+                        # already done by the parse stage)
+                        if self.raw:
+                            data, headers = raw_email, raw_email
+                        else:
+                            prepared = fetched.get('PREPARED')
+                            if prepared is None:
+                                prepared = prepare_message(raw_email)
+                                STATS.add_time('parse', time.monotonic() - write_started)
+                                write_started = time.monotonic()
+                            if isinstance(prepared, Exception):
+                                raise prepared
+                            data, headers = prepared
+
+                        # Save based on format
+                        if self.format == "eml":
+                            self._save_eml(uid, data, headers)
+                        elif self.format == "maildir":
+                            writer.add(uid, data, fetched.get('FLAGS') or ())
+                        elif self.format == "tar":
+                            writer.add(uid, self._eml_filename(uid, headers), data)
+                        else:  # mbox
+                            writer.add(uid, data)
+                except Exception as e:
+                    errors.append((uid, str(e)))
+                    STATS.error('write')
+                    continue
+                finally:
+                    if spool and spool.exists():
+                        spool.unlink()
+                STATS.add_time('write', time.monotonic() - write_started)
 
                 # Update state
-                self.state["exported_uids"].append(uid)
-                self.state["total_exported"] += 1
+                self.state.add(uid)
+                exported += 1
+                size = len(raw_email) if raw_email is not None else fetched.get('RFC822.SIZE', 0)
+                self.exported_bytes += size
+                STATS.message(size)
 
                 # Progress indicator
-                if self.verbose:
+                if self.progress:
+                    self.progress(self, idx, total)
+                elif self.verbose:
                     # Verbose mode: show detailed progress
-                    pct = (idx / len(uids_to_export)) * 100
+                    pct = (idx / total) * 100
                     if idx % 10 == 0:
-                        print(f"  {Colors.CYAN}[{idx}/{len(uids_to_export)}] {pct:.1f}%{Colors.ENDC} - Exported UID {uid}")
+                        print(f"  {Colors.CYAN}[{idx}/{total}] {pct:.1f}%{Colors.ENDC} - Exported UID {uid}")
                 else:
                     # Normal mode: show progress bar
-                    self._print_progress_bar(idx, len(uids_to_export))
-
-                # Checkpoint save
-                if idx % self.batch_size == 0:
+                    self._print_progress_bar(idx, total)
+
+            # Checkpoint save (on batch boundaries, at least every batch_size messages)
+            if idx - last_checkpoint >= self.batch_size:
+                last_checkpoint = idx
+                # Messages must be on disk before the state says so
+                with STATS.timer('checkpoint'):
+                    if writer:
+                        writer.flush()
                     self._save_state()
-                    if self.format == "mbox":
-                        mbox.flush()
-                    if self.verbose:
-                        print(f"  {Colors.GREEN}💾 Checkpoint saved ({idx} messages){Colors.ENDC}")
-                    else:
-                        # In progress bar mode, clear line and show checkpoint
-                        print(f"\r  {Colors.GREEN}💾 Checkpoint saved ({idx:,} messages){Colors.ENDC}" + " " * 30)
-                        # Redraw progress bar
-                        self._print_progress_bar(idx, len(uids_to_export))
-
-            except Exception as e:
-                errors.append((uid, str(e)))
+                if self.verbose and not self.quiet:
+                    depths = ", ".join(f"{name} {current}/{capacity}"
+                                       for name, (current, capacity) in self.pipeline_depths().items())
+                    print(f"  {Colors.GREEN}💾 Checkpoint saved ({idx} messages){Colors.ENDC} - queues: {depths}")
+                elif not self.quiet:
+                    # In progress bar mode, clear line and show checkpoint
+                    print(f"\r  {Colors.GREEN}💾 Checkpoint saved ({idx:,} messages){Colors.ENDC}" + " " * 30)
+                    # Redraw progress bar
+                    self._print_progress_bar(idx, total)
+
+        elapsed = time.monotonic() - started
+        # Every UID was attempted (a lost connection can leave some untouched)
+        self.finished = idx >= total
 
         # Final save
-        self._save_state()
-        if self.format == "mbox":
-            mbox.close()
+        if not errors and self.finished:
+            self._record_sync_point()
+        if writer:
+            writer.close()
+        self._save_state(final=True)
 
         # Complete progress bar if in non-verbose mode
-        if not self.verbose:
+        if not self.verbose and not self.quiet:
             print()  # New line after progress bar
 
         # Summary
-        print()
-        print_success(f"Export complete: {self.state['total_exported']:,} messages")
-        print_info(f"Output: {self.output_dir}")
+        if not self.quiet:
+            print()
+        self._log(print_success, f"Export complete: {self.state.total_exported:,} messages")
+        self._log(print_info, f"Output: {self.output_dir}")
+        if elapsed > 0:
+            self._log(print_info, f"Throughput: {exported / elapsed:,.1f} msgs/sec "
+                       f"({self.exported_bytes / elapsed / 1048576:,.2f} MB/s over {elapsed:,.1f}s)")
+            self._log(print_info, f"Fetch budget: {self.budget.bytes / 1048576:,.1f} MB per round trip"
+                       + (f", {self.large_messages:,} large messages fetched one at a time"
+                          if self.large_messages else ""))
+            if self.depth_samples:
+                capacities = {name: capacity for name, (_, capacity) in self.pipeline_depths().items()}
+                self._log(print_info, "Pipeline queues (average fill): " + ", ".join(
+                    f"{name} {self.depth_totals[name] / self.depth_samples:,.1f}/{capacity}"
+                    for name, capacity in capacities.items()))
+        if self.rate_control.throttles or self.requeues:
+            control = self.rate_control
+            self._log(print_info, f"Throttling: backed off {control.throttles:,} times, "
+                       f"{sum(self.requeues.values()):,} batches retried; ended at {control.limit} "
+                       f"requests in flight" + (f", {control.rate:,.1f} requests/s" if control.rate else ""))
+        wire = WireStats.describe(wire_before, DEFLATE_STATS.snapshot())
+        if wire:
+            self._log(print_info, f"IMAP COMPRESS=DEFLATE: {wire}")
+        stats = writer.compression_stats() if isinstance(writer, ArchiveWriter) else None
+        if stats and stats[0] and stats[1]:
+            bytes_in, bytes_out, busy = stats
+            self._log(print_info, f"Compression ({self.compress}): {bytes_in / bytes_out:,.1f}x "
+                       f"({bytes_in / 1048576:,.1f} MB -> {bytes_out / 1048576:,.1f} MB), "
+                       f"{bytes_in / max(busy, 1e-6) / 1048576:,.1f} MB/s in the background thread")
+        if isinstance(writer, StoreWriter):
+            self._log(print_info, f"Store {self.store_dir}: {writer.new_objects:,} new messages "
+                       f"({writer.new_bytes / 1048576:,.1f} MB), {writer.reused:,} already stored "
+                       f"({writer.not_downloaded:,} not downloaded)")
+
+        STATS.export_done(mailbox=self.mailbox_name, format=self.format, output=str(self.output_dir),
+                          messages=exported, bytes=self.exported_bytes, errors=len(errors),
+                          seconds=round(elapsed, 3), finished=self.finished)
+        if self.verbose:
+            self._log(print_info, "Time by phase (all threads): " + ", ".join(
+                f"{name} {phase['seconds']:,.1f}s/{phase['calls']:,}"
+                for name, phase in STATS.summary()["phases"].items()))
 
         if errors:
-            print_warning(f"Errors: {len(errors)}")
+            self._log(print_warning, f"Errors: {len(errors)}")
             for uid, err in errors[:5]:
-                print(f"  {Colors.RED}- UID {uid}: {err}{Colors.ENDC}")
+                if not self.quiet:
+                    print(f"  {Colors.RED}- UID {uid}: {err}{Colors.ENDC}")
+
+        self._close_quietly(self.imap)
+
+    def _connect(self, primary=False):
+        """Open an authenticated IMAP session with the mailbox selected
+
+        Args:
+            primary: Record the mailbox status (UIDVALIDITY, UIDNEXT, ...) and,
+                for --incremental, enable CONDSTORE/QRESYNC on this session
+
+        Returns:
+            (imap, message_count) tuple
+        """
+        token = get_token()
+        auth_string = f'user={EMAIL}\x01auth=Bearer {token}\x01\x01'
+        imap = open_imap(auth_string)
+
+        qresync = None
+        caps = get_capabilities(imap) if primary else set()
+        if primary and self.incremental:
+            if 'ENABLE' in caps and 'QRESYNC' in caps:
+                imap.enable('QRESYNC')
+                last = (self.state.data.get("uidvalidity"), self.state.data.get("highestmodseq"))
+                if all(last):
+                    qresync = last
+            elif 'ENABLE' in caps and 'CONDSTORE' in caps:
+                imap.enable('CONDSTORE')
+
+        with STATS.timer('select'):
+            info = select_mailbox(imap, self.mailbox_name, qresync=qresync)
+        if info is None:
+            imap.logout()
+            raise imaplib.IMAP4.error(f"Failed to select mailbox: {self.mailbox_name}")
+
+        if primary:
+            self.mailbox_info = info
+            self.uidvalidity = info.get('UIDVALIDITY')
+        elif self.uidvalidity and info.get('UIDVALIDITY', self.uidvalidity) != self.uidvalidity:
+            imap.logout()
+            raise ConnectionLost("Mailbox UIDVALIDITY changed during the export - re-run to start over")
 
-        self.imap.logout()
+        # M365 ends the session when the token it was opened with expires
+        # (None when the token does not say; the server's rejection tells)
+        imap.token_expires = TOKENS.expires
+        return imap, info.get('EXISTS', 0)
 
-    def _get_uids_to_export(self):
-        """Get list of UIDs to export based on filters"""
+    @staticmethod
+    def _is_session_error(error):
+        """Whether an error means the session is gone, so reconnecting may help"""
+        if isinstance(error, ConnectionLost):
+            return False
+        if isinstance(error, (imaplib.IMAP4.abort, OSError, EOFError)):
+            return True
+        text = str(error).lower()
+        return isinstance(error, imaplib.IMAP4.error) and any(
+            word in text for word in ('auth', 'token', 'session', 'not connected', 'bye',
+                                      'illegal in state', 'logout'))
+
+    @staticmethod
+    def _close_quietly(imap):
+        """Log out of a session that may already be dead"""
+        if imap is None:
+            return
+        try:
+            imap.logout()
+        except Exception:
+            pass
+
+    def _with_reconnect(self, operation, imap):
+        """Run operation(imap), reconnecting and retrying if the session dies
+
+        The token is refreshed when the server rejects it, and the session is
+        replaced ahead of time when its token is about to expire.
+
+        Returns:
+            (result, imap) - imap is a new session if it had to reconnect
+
+        Raises:
+            ConnectionLost: if the session could not be re-established
+            Exception: any other error from operation, with the session to
+                carry on with (possibly a new one) as its .session attribute
+        """
+        attempt = 0
+        while True:
+            try:
+                expires = getattr(imap, 'token_expires', 0)
+                if imap is not None and expires and time.time() > expires - 60:
+                    self._close_quietly(imap)
+                    imap = None
+                if imap is None:
+                    imap, _ = self._connect()
+                return operation(imap), imap
+            except Exception as e:
+                if not self._is_session_error(e):
+                    e.session = imap
+                    raise
+                if attempt >= self.MAX_RETRIES:
+                    raise ConnectionLost(f"Gave up reconnecting after {attempt} attempts: {e}")
+                if any(word in str(e).lower() for word in ('auth', 'token')):
+                    TOKENS.invalidate()
+                else:
+                    self._throttled(e)
+                self._close_quietly(imap)
+                imap = None
+                delay = min(self.RETRY_BACKOFF * 2 ** attempt, 60)
+                attempt += 1
+                STATS.count('reconnects')
+                self._log(print_warning, f"Connection problem ({e}) - reconnecting in {delay}s "
+                              f"(attempt {attempt}/{self.MAX_RETRIES})")
+                time.sleep(delay)
+
+    def _throttled(self, error):
+        """Report a throttle signal to the rate controller"""
+        STATS.count('throttle_signals')
+        change = self.rate_control.throttle(error)
+        if change:
+            self._log(print_warning, f"Server is throttling ({error}) - {change}")
+
+    def _requeue(self, batch, error):
+        """Put a batch that failed transiently back into the queue
+
+        Returns:
+            False if the error is permanent or the batch was retried MAX_REQUEUES times
+        """
+        if not RateController.is_throttle(error) or self.requeues[batch[0]] >= self.MAX_REQUEUES:
+            return False
+        self.requeues[batch[0]] += 1
+        STATS.count('requeued_batches')
+        self._throttled(error)
+        self.requeued.append(batch)
+        return True
+
+    def _next_batch(self, batches):
+        """The next batch to fetch: requeued ones first"""
+        try:
+            return self.requeued.popleft()
+        except IndexError:
+            batch = next(batches, None)
+            self.drained = batch is None
+            return batch
+
+    def _incremental_start(self):
+        """Return the UID an incremental export starts from (None for a full export)"""
+        vanished = self.mailbox_info.get('VANISHED')
+        if vanished:
+            count = self.state.add_expunged(vanished)
+            if count:
+                self._log(print_info, f"{count:,} messages were expunged on the server since the last sync "
+                           f"(local copies are kept)")
+
+        since_uid = self.state.data.get("uidnext")
+        if not since_uid:
+            self._log(print_info, "No previous sync point - running a full export")
+            return None
+        self._log(print_info, f"Incremental sync: looking for messages from UID {since_uid}")
+        return since_uid
+
+    def _record_sync_point(self):
+        """Save UIDNEXT/HIGHESTMODSEQ once every message up to them is exported
+
+        A filtered run (--range, --skip, --limit or --year) leaves messages
+        below UIDNEXT unexported, so it never moves the sync point.
+        """
+        if (self.range_spec or self.skip or self.limit or self.year
+                or 'UIDNEXT' not in self.mailbox_info):
+            return
+        self.state.set_sync_point(self.mailbox_info['UIDNEXT'],
+                                  self.mailbox_info.get('HIGHESTMODSEQ'))
+
+    def _pipeline(self, uids):
+        """Yield (batch, messages, error) through the fetch and parse stages
+
+        Fetching runs in background threads (one per connection) and parsing
+        in worker processes, each stage a bounded number of batches ahead of
+        the next, so the connections stay busy while the caller writes.
+        Parsed messages carry PREPARED: the result of prepare_message().
+        """
+        self.fetch_stage = Prefetcher(self._iter_fetched(uids), self.connections * 2)
+        pool = None
+        if not (self.raw or self.format == "store" or not self.parse_workers):
+            pool = self._parse_pool(self.parse_workers)
+        if pool is None:
+            yield from self.fetch_stage
+            return
+
+        self.parse_stage = Prefetcher(self._parse_batches(self.fetch_stage, pool), 2)
+        try:
+            yield from self.parse_stage
+        finally:
+            for _, _, future in list(self.parsing):
+                if future is not None:
+                    future.cancel()
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+    _pools_broken = False
+
+    @classmethod
+    def _parse_pool(cls, workers):
+        """Process pool for parsing, shared by all exports of the run
+
+        Returns None once a pool has broken: the rest of the run parses in
+        the writer instead.
+        """
+        with cls._pools_lock:
+            if cls._pools_broken:
+                return None
+            if workers not in cls._pools:
+                # Not forked: fetch threads may already be running
+                cls._pools[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            return cls._pools[workers]
+
+    def _drop_pool(self, pool, error):
+        """Stop using a pool whose worker died; later batches are parsed in the writer"""
+        cls = type(self)
+        with cls._pools_lock:
+            cls._pools_broken = True
+            dropped = [workers for workers, shared in cls._pools.items() if shared is pool]
+            if not dropped:
+                return  # Already reported
+            for workers in dropped:
+                del cls._pools[workers]
+        pool.shutdown(wait=False, cancel_futures=True)
+        STATS.count('parse_pool_failures')
+        self._log(print_warning, f"Parse workers failed ({error or type(error).__name__}); "
+                                 "parsing in this process for the rest of the run")
+
+    def _parse_batches(self, fetched, pool):
+        """Hand fetched batches to the process pool, yielding them back in order
+
+        Batches the pool did not parse (it broke, or prepare_batch failed)
+        reach the writer without PREPARED and are parsed there.
+        """
+        def finish(entry):
+            (batch, messages, error), uids, future = entry
+            if future is not None:
+                try:
+                    results, seconds = future.result()
+                except BrokenProcessPool as e:
+                    self._drop_pool(pool, e)
+                except Exception as e:
+                    self._log(print_warning, f"Parsing a batch in a worker failed ({e}); parsing it here")
+                else:
+                    STATS.add_time('parse', seconds, len(uids))
+                    for uid, prepared in zip(uids, results):
+                        messages[uid]['PREPARED'] = prepared
+            return batch, messages, error
+
+        for batch, messages, error in fetched:
+            uids = [uid for uid, m in (messages or {}).items() if 'RFC822' in m]
+            future = None
+            if uids and not self._pools_broken:
+                try:
+                    future = pool.submit(prepare_batch, [messages[uid]['RFC822'] for uid in uids])
+                except (BrokenProcessPool, RuntimeError) as e:
+                    # RuntimeError: another export already shut the broken pool down
+                    self._drop_pool(pool, e)
+            self.parsing.append(((batch, messages, error), uids, future))
+            if len(self.parsing) >= self.parse_workers * 2:
+                yield finish(self.parsing.popleft())
+        while self.parsing:
+            yield finish(self.parsing.popleft())
+
+    def pipeline_depths(self):
+        """Current and maximum number of batches waiting at each stage"""
+        depths = {}
+        if self.fetch_stage:
+            depths['fetched'] = (self.fetch_stage.qsize(), self.fetch_stage.depth)
+        if self.parse_stage:
+            depths['parsing'] = (len(self.parsing), self.parse_workers * 2)
+            depths['parsed'] = (self.parse_stage.qsize(), self.parse_stage.depth)
+        return depths
+
+    def _sample_depths(self):
+        for name, (current, _) in self.pipeline_depths().items():
+            self.depth_totals[name] += current
+        self.depth_samples += 1
+
+    def _iter_fetched(self, uids):
+        """Yield (batch, messages, error) for each FETCH batch
+
+        With more than one connection, batches are handed out on demand to
+        worker threads so a slow connection never holds up the others. All
+        writing and state updates stay with the caller.
+        """
+        if IMAP_ENGINE == "async":
+            yield from self._iter_fetched_pipelined(uids)
+            return
+        batches = self._iter_fetch_batches(uids)
+        if self.connections <= 1:
+            yield from self._fetch_serially(batches)
+            return
+
+        lock = threading.Lock()
+        stop = threading.Event()
+        results = queue.Queue(maxsize=self.connections * 2)
+        workers = [threading.Thread(target=self._fetch_worker, args=(slot, batches, lock, results, stop),
+                                    daemon=True)
+                   for slot in range(self.connections)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            running = len(workers)
+            while running:
+                item = results.get()
+                if item is None:
+                    running -= 1
+                elif item[0] is None:
+                    self._log(print_warning, f"A connection gave up (its remaining work goes to the others): {item[2]}")
+                else:
+                    yield item
+        finally:
+            stop.set()
+        # Batches handed back by a connection that gave up after the others ran out of work
+        yield from self._fetch_serially(batches)
+
+    def _fetch_serially(self, batches):
+        """Yield (batch, messages, error) for each batch, fetched on the primary session"""
+        while True:
+            batch = self._next_batch(batches)
+            if batch is None:
+                return
+            try:
+                messages, self.imap = self._with_reconnect(
+                    lambda imap: self._fetch_measured(batch, imap), self.imap)
+            except ConnectionLost as e:
+                self._log(print_error, f"{e} - re-run the same command to resume")
+                return
+            except Exception as e:
+                self.imap = getattr(e, 'session', self.imap)
+                if not self._requeue(batch, e):
+                    yield batch, None, e
+                continue
+            yield batch, messages, None
+
+    def _iter_fetched_pipelined(self, uids):
+        """Yield (batch, messages, error) with several FETCH commands in flight per connection
+
+        Used with --engine async: the connections share one event loop and
+        each has up to PIPELINE_DEPTH batches requested at once, so the server
+        always has the next command waiting. Batches are yielded as they
+        complete; a connection that cannot be re-established hands its work
+        to the others.
+        """
+        loop = event_loop()
+        # The first connection is the primary session, as with --engine imaplib
+        self.sessions = [self.imap] + [None] * (self.connections - 1)
+        self.slot_locks = [asyncio.Lock() for _ in self.sessions]
+        self.slot_done = [0.0] * len(self.sessions)
+        load = [0] * len(self.sessions)
+        dead = set()
+        batches = self._iter_fetch_batches(uids)
+        in_flight = {}
+        try:
+            while True:
+                live = [slot for slot in range(len(self.sessions)) if slot not in dead]
+                if not live:
+                    self._log(print_error, "All connections gave up - re-run the same command to resume")
+                    return
+                while len(in_flight) < min(len(live) * self.PIPELINE_DEPTH, self.rate_control.limit):
+                    batch = self._next_batch(batches)
+                    if batch is None:
+                        break
+                    slot = min(live, key=lambda s: load[s])
+                    load[slot] += 1
+                    future = asyncio.run_coroutine_threadsafe(self._fetch_pipelined(batch, slot), loop)
+                    in_flight[future] = (batch, slot)
+                if not in_flight:
+                    return
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, slot = in_flight.pop(future)
+                    load[slot] -= 1
+                    try:
+                        messages = future.result()
+                    except ConnectionLost as e:
+                        if slot not in dead:
+                            dead.add(slot)
+                            self._log(print_warning, f"A connection gave up (its remaining work goes to the others): {e}")
+                        self.requeued.append(batch)
+                        continue
+                    except Exception as e:
+                        if not self._requeue(batch, e):
+                            yield batch, None, e
+                        continue
+                    yield batch, messages, None
+        finally:
+            for future in in_flight:
+                future.cancel()
+            for session in self.sessions:
+                if session is not self.imap:
+                    self._close_quietly(session)
+
+    async def _fetch_pipelined(self, batch, slot):
+        """Fetch one batch on a shared async session, reconnecting it if it dies"""
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            session = self.sessions[slot]
+            try:
+                expires = getattr(session, 'token_expires', 0)
+                if session is None or session.client.closed or (expires and time.time() > expires - 60):
+                    async with self.slot_locks[slot]:
+                        if self.sessions[slot] is session:
+                            fresh, _ = await loop.run_in_executor(None, self._connect)
+                            self.sessions[slot] = fresh
+                            if session is not None:
+                                loop.create_task(self._retire(session))
+                    continue
+                await asyncio.sleep(self.rate_control.wait_time())
+                started = time.monotonic()
+                messages = await self._fetch_batch_async(batch, session)
+                # Pipelined commands overlap; count only the time since the
+                # previous one on this connection completed
+                now = time.monotonic()
+                nbytes = sum(len(m['RFC822']) if 'RFC822' in m else m.get('RFC822.SIZE', 0)
+                             for m in messages.values())
+                seconds = now - max(started, self.slot_done[slot])
+                self.budget.record(nbytes, seconds)
+                self._measured(nbytes, seconds)
+                self.slot_done[slot] = now
+                return messages
+            except Exception as e:
+                if not self._is_session_error(e):
+                    raise
+                if attempt >= self.MAX_RETRIES:
+                    raise ConnectionLost(f"Gave up reconnecting after {attempt} attempts: {e}")
+                if any(word in str(e).lower() for word in ('auth', 'token')):
+                    TOKENS.invalidate()
+                else:
+                    self._throttled(e)
+                if session is not None and self.sessions[slot] is session:
+                    self.sessions[slot] = None
+                    await session.client.close()
+                delay = min(self.RETRY_BACKOFF * 2 ** attempt, 60)
+                attempt += 1
+                STATS.count('reconnects')
+                self._log(print_warning, f"Connection problem ({e}) - reconnecting in {delay}s "
+                              f"(attempt {attempt}/{self.MAX_RETRIES})")
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _retire(session):
+        """Log out of a replaced session once its pipelined commands are answered"""
+        while session.client.pending:
+            await asyncio.sleep(0.1)
+        await session.client.close()
+
+    async def _fetch_batch_async(self, batch, session):
+        """Async version of _fetch_batch() for ordinary batches"""
+        if self.format == "store" or (len(batch) == 1 and
+                                      self.large_sizes.get(batch[0], 0) >= self.STREAM_THRESHOLD):
+            # Several dependent round trips; run the blocking version off the event loop
+            return await asyncio.get_running_loop().run_in_executor(None, self._fetch_batch, batch, session)
+        items = '(UID FLAGS RFC822)' if self.format == "maildir" else '(UID RFC822)'
+        status, text, received = await session.client.command('UID', 'FETCH', format_uid_set(batch), items)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"fetch failed: {text!r}")
+        data = [value for typ, value in received if typ == 'FETCH']
+        return {m['UID']: m
+                for m in parse_fetch_response(data) if 'UID' in m and m.get('RFC822') is not None}
+
+    def _fetch_worker(self, slot, batches, lock, results, stop):
+        """Fetch batches on a dedicated connection until the work runs out
+
+        Connections beyond the rate controller's limit sit idle until it
+        allows them again, or until there are no new batches left.
+        """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        imap = None
+        try:
+            while not stop.is_set():
+                if slot >= self.rate_control.limit and not self.drained:
+                    time.sleep(0.5)
+                    continue
+                with lock:
+                    batch = self._next_batch(batches)
+                if batch is None:
+                    break
+                try:
+                    messages, imap = self._with_reconnect(
+                        lambda session: self._fetch_measured(batch, session), imap)
+                except ConnectionLost:
+                    # Its batch goes to the other connections
+                    self.requeued.append(batch)
+                    raise
+                except Exception as e:
+                    imap = getattr(e, 'session', imap)
+                    if not self._requeue(batch, e):
+                        put((batch, None, e))
+                    continue
+                put((batch, messages, None))
+        except Exception as e:
+            put((None, None, e))
+        finally:
+            put(None)
+            self._close_quietly(imap)
+
+    def _get_uids_to_export(self, since_uid=None):
+        """Yield the UIDs to export based on filters, in ascending order
+
+        Args:
+            since_uid: Only look at UIDs from this one upwards (--incremental)
+        """
+        criteria = []
+        if since_uid:
+            criteria.append(f'UID {since_uid}:*')
         if self.year:
             # Year-based search
             start_date = f"01-Jan-{self.year}"
             end_date = f"31-Dec-{self.year}"
-            search_criteria = f'SENTSINCE {start_date} SENTBEFORE {end_date}'
-            status, data = self.imap.uid('search', None, search_criteria)
-        else:
-            # Get all UIDs
-            status, data = self.imap.uid('search', None, 'ALL')
-
-        uids = data[0].decode().split()
+            criteria.append(f'SENTSINCE {start_date} SENTBEFORE {end_date}')
+        uids = search_uids(self.imap, ' '.join(criteria) or 'ALL',
+                           self.mailbox_info.get('EXISTS', 0))
+        if since_uid:
+            # "n:*" always matches the highest UID, even when it is below n
+            uids = (uid for uid in uids if uid >= since_uid)
 
         # Apply range/skip/limit
         if self.range_spec:
             start, end = map(int, self.range_spec.split(':'))
-            uids = uids[start-1:end]
-        else:
-            if self.skip:
-                uids = uids[self.skip:]
-            if self.limit:
-                uids = uids[:self.limit]
+            return itertools.islice(uids, start - 1, end)
+        return itertools.islice(uids, self.skip or 0,
+                                (self.skip or 0) + self.limit if self.limit else None)
+
+    def _iter_fetch_batches(self, uids):
+        """Group UIDs into FETCH batches by the adaptive byte budget
+
+        Sizes are looked up SIZE_WINDOW UIDs at a time. Messages larger than
+        the budget (or large enough to be streamed) are fetched one per round
+        trip after the rest of their window, so small messages never wait
+        behind them.
+        """
+        uids = iter(uids)
+        while True:
+            window = list(itertools.islice(uids, self.SIZE_WINDOW))
+            if not window:
+                return
+            try:
+                sizes, self.imap = self._with_reconnect(
+                    lambda imap: self._fetch_sizes(window, imap), self.imap)
+            except Exception as e:
+                self.imap = getattr(e, 'session', self.imap)
+                sizes = {}
+            # Without sizes, fall back to batching by message count
+            limit = self.budget.messages if sizes else self.fetch_batch or self.FALLBACK_FETCH_BATCH
+            batch, batch_bytes, large = [], 0, []
+            for uid in window:
+                size = sizes.get(uid, 0)
+                budget = self.budget.bytes
+                if size > budget or size >= self.STREAM_THRESHOLD:
+                    large.append(uid)
+                    self.large_sizes[uid] = size
+                    continue
+                if batch and (len(batch) >= limit or batch_bytes + size > budget):
+                    yield batch
+                    batch, batch_bytes = [], 0
+                batch.append(uid)
+                batch_bytes += size
+            if batch:
+                yield batch
+            for uid in large:
+                self.large_messages += 1
+                yield [uid]
+
+    def _fetch_sizes(self, uids, imap=None):
+        """Get RFC822.SIZE for a set of UIDs in one round trip"""
+        imap = imap or self.imap
+        with STATS.timer('sizes'):
+            status, data = imap.uid('fetch', format_uid_set(uids), '(UID RFC822.SIZE)')
+        if status != "OK":
+            return {}
+        return {m['UID']: m.get('RFC822.SIZE', 0)
+                for m in parse_fetch_response(data) if 'UID' in m}
+
+    def _fetch_measured(self, uids, imap):
+        """Fetch a batch and let the fetch budget adapt to how long it took"""
+        time.sleep(self.rate_control.wait_time())
+        started = time.monotonic()
+        messages = self._fetch_batch(uids, imap)
+        nbytes = sum(len(m['RFC822']) if 'RFC822' in m else m.get('RFC822.SIZE', 0)
+                     for m in messages.values())
+        seconds = time.monotonic() - started
+        self.budget.record(nbytes, seconds)
+        self._measured(nbytes, seconds)
+        return messages
+
+    def _measured(self, nbytes, seconds):
+        """Report a completed fetch to the statistics and the rate controller"""
+        STATS.add_time('fetch', seconds)
+        STATS.count('fetched_bytes', nbytes)
+        change = self.rate_control.success(nbytes, seconds)
+        if change:
+            self._log(print_warning, f"Server responses slowed down - {change}")
+
+    def _fetch_batch(self, uids, imap=None):
+        """Fetch a batch of messages with one UID FETCH
+
+        Returns:
+            Dict of UID to FETCH attributes (RFC822 or SPOOL, plus FLAGS for Maildir)
+        """
+        imap = imap or self.imap
+        if self.format == "store":
+            return self._fetch_store_batch(uids, imap)
+        return self._fetch_messages(uids, imap, flags=self.format == "maildir")
+
+    def _fetch_messages(self, uids, imap, flags=False):
+        """UID FETCH whole messages; a single very large one is streamed instead"""
+        if len(uids) == 1 and self.large_sizes.get(uids[0], 0) >= self.STREAM_THRESHOLD:
+            return self._fetch_streamed(uids[0], imap, flags)
+        items = '(UID FLAGS RFC822)' if flags else '(UID RFC822)'
+        status, data = imap.uid('fetch', format_uid_set(uids), items)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"fetch failed: {data[0]!r}")
+        return {m['UID']: m
+                for m in parse_fetch_response(data) if 'UID' in m and m.get('RFC822') is not None}
+
+    def _fetch_streamed(self, uid, imap, flags=False):
+        """Download one message in BODY.PEEK[]<offset.length> chunks to a spool file
+
+        Only one chunk is held in memory at a time. The spool file is created
+        next to where the message ends up, so most formats can simply rename
+        it into place.
+
+        Returns:
+            {uid: attributes} with SPOOL (the file path) and RFC822.SIZE
+        """
+        spool_dir = self.store.objects / "tmp" if self.format == "store" else self.output_dir
+        fd, spool = tempfile.mkstemp(dir=spool_dir, prefix='.muttpu-', suffix='.part')
+        attrs = {'UID': uid}
+        offset = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    items = f"(UID{' FLAGS' if flags and not offset else ''} "
+                    items += f"BODY.PEEK[]<{offset}.{self.STREAM_CHUNK}>)"
+                    status, data = imap.uid('fetch', str(uid), items)
+                    if status != "OK":
+                        raise imaplib.IMAP4.error(f"fetch failed: {data[0]!r}")
+                    m = next((m for m in parse_fetch_response(data) if m.get('UID') == uid), None)
+                    if m is None:
+                        # Expunged meanwhile
+                        os.unlink(spool)
+                        return {}
+                    if 'FLAGS' in m:
+                        attrs['FLAGS'] = m['FLAGS']
+                    chunk = next((v for k, v in m.items() if k.startswith('BODY[]')), None) or b''
+                    f.write(chunk)
+                    offset += len(chunk)
+                    if len(chunk) < self.STREAM_CHUNK:
+                        break
+        except BaseException:
+            os.unlink(spool)
+            raise
+        attrs.update({'SPOOL': Path(spool), 'RFC822.SIZE': offset})
+        return {uid: attrs}
+
+    def _fetch_store_batch(self, uids, imap):
+        """Fetch a batch for --format store, downloading only messages not yet stored
+
+        Returns:
+            Dict of UID to attributes: MESSAGE-ID, plus SHA256 of the stored
+            copy or RFC822 for a message to store
+        """
+        status, data = imap.uid('fetch', format_uid_set(uids),
+                                '(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])')
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"fetch failed: {data[0]!r}")
+        fetched, missing = {}, []
+        for m in parse_fetch_response(data):
+            if 'UID' not in m:
+                continue
+            header = next((v for k, v in m.items() if k.startswith('BODY[HEADER.FIELDS')), None)
+            message_id = scan_headers(header or b'', ('Message-ID',)).get('Message-ID')
+            message_id = "".join(message_id.split()) if message_id else None
+            # Without a Message-ID there is nothing to recognize a message by
+            digest = message_id and self.store.lookup(message_id, m.get('RFC822.SIZE'))
+            fetched[m['UID']] = {'MESSAGE-ID': message_id}
+            if digest:
+                fetched[m['UID']]['SHA256'] = digest
+            else:
+                missing.append(m['UID'])
+
+        if missing:
+            for uid, m in self._fetch_messages(missing, imap).items():
+                if uid in fetched:
+                    fetched[uid].update(m)
+        return {uid: m for uid, m in fetched.items() if 'SHA256' in m or 'RFC822' in m or 'SPOOL' in m}
 
-        return uids
+    def _eml_filename(self, uid, msg):
+        """Build the YYYYMMDD_HHMMSS_UID_subject.eml name for a message
 
-    def _save_eml(self, uid, msg):
-        """Save message as EML file"""
+        Args:
+            msg: email.message.Message or a dict of its headers, or raw message bytes
+        """
         # Get date and subject for filename
-        date_str = msg.get('Date', '')
-        subject = msg.get('Subject', 'no-subject')
+        if isinstance(msg, bytes):
+            headers = scan_headers(msg)
+            date_str = headers.get('Date', '')
+            subject = headers.get('Subject', 'no-subject')
+        else:
+            date_str = msg.get('Date', '')
+            subject = msg.get('Subject', 'no-subject')
 
         try:
             date_obj = email.utils.parsedate_to_datetime(date_str)
@@ -854,11 +4334,340 @@ class MailboxExporter:
             date_prefix = datetime.now().strftime('%Y%m%d_%H%M%S')
 
         safe_subject = self._sanitize_filename(subject)
-        filename = f"{date_prefix}_{uid}_{safe_subject}.eml"
-        filepath = self.output_dir / filename
-
+        return f"{date_prefix}_{uid}_{safe_subject}.eml"
+
+    def _save_eml(self, uid, data, headers, spool=None):
+        """Save message as EML file
+
+        Args:
+            data: Message bytes
+            headers: What _eml_filename() takes to name the file
+            spool: File holding the whole message, moved into place instead
+                of writing data
+        """
+        filename = self._eml_filename(uid, headers)
+        shard = eml_shard(filename, self.shard)
+        if shard and shard not in self.shard_dirs:
+            (self.output_dir / shard).mkdir(parents=True, exist_ok=True)
+            self.shard_dirs.add(shard)
+        filepath = self.output_dir / shard / filename
+
+        if spool:
+            os.replace(spool, filepath)
+            return
         with open(filepath, 'wb') as f:
-            f.write(msg.as_bytes())
+            f.write(data)
+
+    def _save_spooled(self, uid, fetched, writer):
+        """Move or copy a message streamed to a spool file into the export"""
+        spool = fetched['SPOOL']
+        if self.format == "eml":
+            self._save_eml(uid, None, read_head(spool), spool=spool)
+        elif self.format == "maildir":
+            writer.add_file(uid, spool, fetched.get('FLAGS') or ())
+        elif self.format == "tar":
+            writer.add_file(uid, self._eml_filename(uid, read_head(spool)), spool)
+        elif self.format == "store":
+            writer.add_file(uid, spool, fetched.get('MESSAGE-ID'))
+        else:  # mbox
+            writer.add_file(uid, spool)
+
+class AccountExporter:
+    """Export every folder of the account into a per-folder directory layout
+
+    Folders are exported several at a time, one connection each, largest
+    first so the run finishes on small folders. Each folder keeps its own
+    resume state; .account_state.json in the output directory records which
+    folders are complete so unchanged folders are skipped on the next run.
+    With --format store and no --store, the folders share a store in .store/,
+    which no folder directory can be called (their names never start with
+    a dot).
+    """
+
+    STORE_DIR = ".store"
+
+    def __init__(self, output_dir, include=None, exclude=None, connections=1,
+                 fresh=False, verbose=False, **export_options):
+        self.output_dir = Path(output_dir)
+        self.include = include or []
+        self.exclude = exclude or []
+        self.connections = max(1, connections)
+        self.fresh = fresh
+        self.verbose = verbose
+        self.export_options = export_options
+        if not export_options.get('store_dir'):
+            export_options['store_dir'] = self.output_dir / self.STORE_DIR
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.state_file = self.output_dir / ".account_state.json"
+        self.state = self._load_state()
+        self.lock = threading.Lock()
+        self.progress = {}
+        self.started = None
+        self.last_draw = 0
+
+    def _load_state(self):
+        """Load account state from file"""
+        if not self.fresh and self.state_file.exists():
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        return {"folders": {}, "last_updated": None}
+
+    def _save_state(self):
+        """Save account state to file (atomically)"""
+        self.state["last_updated"] = datetime.now().isoformat()
+        tmp_file = self.state_file.with_name(self.state_file.name + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def _selected(self, name):
+        """Apply --include/--exclude globs (case-insensitive)"""
+        lowered = name.lower()
+        if self.include and not any(fnmatch.fnmatchcase(lowered, p.lower()) for p in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(lowered, p.lower()) for p in self.exclude)
+
+    def _folder_dir(self, name, delimiter):
+        """Output directory for a folder, mirroring the folder hierarchy"""
+        parts = name.split(delimiter) if delimiter else [name]
+        safe = ["".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in part).strip() or '_'
+                for part in parts]
+        return self.output_dir.joinpath(*safe)
+
+    def _discover(self):
+        """List folders to export with their STATUS, largest first"""
+        imap = connect_imap()
+        if not imap:
+            return None
+
+        caps = get_capabilities(imap)
+        items = ('MESSAGES', 'UIDNEXT', 'UIDVALIDITY') + (('SIZE',) if 'STATUS=SIZE' in caps else ())
+        folders = []
+        for name, delimiter, flags in get_mailboxes(imap):
+            if any(flag.lower() in ('\\noselect', '\\nonexistent') for flag in flags):
+                continue
+            if not self._selected(name):
+                continue
+            status = get_mailbox_status(imap, name, items)
+            if not status:
+                print_warning(f"Skipping {name}: STATUS failed")
+                continue
+            folders.append({"name": name, "dir": self._folder_dir(name, delimiter), **status})
+        imap.logout()
+
+        # Largest first (by size when the server reports it, else by count)
+        folders.sort(key=lambda f: (f.get('SIZE', 0), f.get('MESSAGES', 0)), reverse=True)
+        return folders
+
+    def _filter(self):
+        """The --year/--range/--skip/--limit options of this run, or None"""
+        options = {key: self.export_options[key] for key in ('year', 'range_spec', 'skip', 'limit')
+                   if self.export_options.get(key)}
+        return options or None
+
+    def _unchanged(self, folder):
+        """Whether a folder was fully exported, with the same filter, and has not changed since"""
+        previous = self.state["folders"].get(folder["name"], {})
+        return (previous.get("status") == "done"
+                and previous.get("filter") == self._filter()
+                and previous.get("uidvalidity") == folder.get("UIDVALIDITY")
+                and previous.get("uidnext") == folder.get("UIDNEXT"))
+
+    def _on_progress(self, exporter, done, total):
+        """Progress callback from a folder exporter - redraw the combined view"""
+        with self.lock:
+            self.progress[exporter.mailbox_name] = (done, total)
+            now = time.monotonic()
+            if now - self.last_draw >= 0.2 or done == total:
+                self.last_draw = now
+                self._draw_progress()
+
+    def _draw_progress(self, width=40):
+        """Draw one progress line for the whole account"""
+        done = sum(d for d, _ in self.progress.values())
+        total = max(1, sum(t for _, t in self.progress.values()))
+        filled = int(width * done / total)
+        bar = '█' * filled + '░' * (width - filled)
+        rate = ""
+        elapsed = time.monotonic() - self.started if self.started else 0
+        if elapsed > 1 and done:
+            rate = f", {done / elapsed:,.0f} msgs/s, ETA {format_duration((total - done) * elapsed / done)}"
+        print(f"\r  {Colors.CYAN}[{bar}] {done / total * 100:.1f}% ({done:,}/{total:,}) "
+              f"- folders {self.folders_done}/{self.folders_total}{rate}{Colors.ENDC}   ", end='', flush=True)
+
+    def _run_folder(self, folder):
+        """Export one folder and record the outcome in the account state"""
+        exporter = MailboxExporter(folder["name"], folder["dir"], connections=1,
+                                   fresh=self.fresh, verbose=self.verbose,
+                                   quiet=True, progress=self._on_progress, **self.export_options)
+        try:
+            exporter.export()
+        except Exception as e:
+            exporter.errors.append((None, str(e)))
+            print_error(f"{folder['name']}: {e}")
+
+        with self.lock:
+            complete = exporter.finished and not exporter.errors
+            self.state["folders"][folder["name"]] = {
+                "path": str(folder["dir"].relative_to(self.output_dir)),
+                "status": "done" if complete else "partial",
+                # A filtered run leaves out messages an unfiltered one must still export
+                "filter": self._filter(),
+                "uidvalidity": folder.get("UIDVALIDITY"),
+                "uidnext": folder.get("UIDNEXT"),
+                "messages": folder.get("MESSAGES"),
+                "exported": exporter.state.total_exported,
+                "errors": len(exporter.errors),
+                "last_updated": datetime.now().isoformat()
+            }
+            self._save_state()
+            _, total = self.progress.get(folder["name"], (0, 0))
+            self.progress[folder["name"]] = (total, total)
+            self.folders_done += 1
+            self._draw_progress()
+
+    def export(self):
+        """Export all selected folders"""
+        print_header(f"Export: all folders → {self.output_dir}")
+        wire_before = DEFLATE_STATS.snapshot()
+
+        print_info(f"Connecting to {IMAP_SERVER}...")
+        folders = self._discover()
+        if folders is None:
+            return
+        if not folders:
+            print_warning("No folders match")
+            return
+
+        pending = [f for f in folders if self.fresh or not self._unchanged(f)]
+        skipped = len(folders) - len(pending)
+        print_success(f"Found {len(folders)} folders "
+                      f"({sum(f.get('MESSAGES', 0) for f in folders):,} messages)")
+        if skipped:
+            print_info(f"Skipping {skipped} folders unchanged since the last export")
+        if not pending:
+            print_success("All folders already exported!")
+            return
+
+        workers = min(self.connections, len(pending))
+        print_info(f"Exporting {len(pending)} folders over {workers} connections, largest first")
+
+        self.folders_done = 0
+        self.folders_total = len(pending)
+        for folder in pending:
+            self.progress[folder["name"]] = (0, folder.get("MESSAGES", 0))
+
+        work = queue.Queue()
+        for folder in pending:
+            work.put(folder)
+
+        def worker():
+            while True:
+                try:
+                    folder = work.get_nowait()
+                except queue.Empty:
+                    return
+                self._run_folder(folder)
+
+        started = self.started = time.monotonic()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+        elapsed = time.monotonic() - started
+
+        # Summary
+        print()
+        print()
+        print(f"{Colors.BOLD}{'Folder':<40} {'Status':<10} {'Exported':>10} {'Errors':>8}{Colors.ENDC}")
+        print("-" * 72)
+        for folder in pending:
+            entry = self.state["folders"].get(folder["name"], {})
+            color = Colors.GREEN if entry.get("status") == "done" else Colors.YELLOW
+            print(f"{folder['name'][:40]:<40} {color}{entry.get('status', '?'):<10}{Colors.ENDC} "
+                  f"{entry.get('exported', 0):>10,} {entry.get('errors', 0):>8,}")
+
+        print()
+        exported = sum(d for d, _ in self.progress.values())
+        print_success(f"Account export complete: {exported:,} messages processed in {elapsed:,.1f}s")
+        print_info(f"Output: {self.output_dir}")
+        wire = WireStats.describe(wire_before, DEFLATE_STATS.snapshot())
+        if wire:
+            print_info(f"IMAP COMPRESS=DEFLATE: {wire}")
+        partial = [f["name"] for f in pending
+                   if self.state["folders"].get(f["name"], {}).get("status") != "done"]
+        if partial:
+            print_warning(f"{len(partial)} folders incomplete - re-run the same command to resume")
+
+def reshard_export(output_dir, scheme):
+    """Move the .eml files of an existing export into another directory layout
+
+    Files are renamed one at a time, so an interrupted run can simply be
+    started again. Exports of other folders nested in output_dir (with their
+    own state file) are left alone.
+    """
+    print_header(f"Reshard: {output_dir} ({scheme})")
+
+    output_dir = Path(output_dir)
+    state_file = output_dir / ".export_state.json"
+    if not state_file.exists():
+        print_error(f"No export found in {output_dir}")
+        return
+    state = ExportState(state_file, None, "eml")
+    if state.data.get("format") != "eml":
+        print_error("Only eml exports can be resharded")
+        return
+
+    moved = skipped = 0
+    created = set()
+    pending = [output_dir]
+    visited = []
+    while pending:
+        directory = pending.pop()
+        visited.append(directory)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    path = Path(entry.path)
+                    # Directories created by this run already hold the new layout
+                    if (not entry.name.startswith('.') and path not in created
+                            and not (path / ".export_state.json").exists()):
+                        pending.append(path)
+                    continue
+                if not entry.name.endswith('.eml'):
+                    continue
+                shard = eml_shard(entry.name, scheme)
+                if shard is None:
+                    skipped += 1
+                    continue
+                target = output_dir / shard
+                if target == directory:
+                    continue
+                if target not in created:
+                    target.mkdir(parents=True, exist_ok=True)
+                    created.update([target, *target.parents])
+                os.rename(entry.path, target / entry.name)
+                moved += 1
+                if moved % 10000 == 0:
+                    print(f"\r  {Colors.CYAN}Moved {moved:,} files...{Colors.ENDC}", end='', flush=True)
+    if moved >= 10000:
+        print()
+
+    # Remove the shard directories the files were moved out of
+    for directory in reversed(visited[1:]):
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+
+    state.set_shard(scheme)
+    state.compact()
+    print_success(f"Moved {moved:,} files into the '{scheme}' layout")
+    if skipped:
+        print_warning(f"Left {skipped:,} .eml files in place (names not in the export format)")
 
 def interactive_menu():
     """Display interactive menu"""
@@ -871,6 +4680,7 @@ def interactive_menu():
     print(f"  {Colors.CYAN}count{Colors.ENDC} <mailbox>    - Count messages in mailbox")
     print(f"  {Colors.CYAN}search{Colors.ENDC} <mailbox>   - Search/preview messages")
     print(f"  {Colors.CYAN}export{Colors.ENDC} <mailbox>   - Export mailbox")
+    print(f"  {Colors.CYAN}reshard{Colors.ENDC} <dir>      - Change the directory layout of an eml export")
     print()
     print(f"{Colors.BOLD}Examples:{Colors.ENDC}\n")
     print(f"  ./muttpu.py setup")
@@ -890,6 +4700,27 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
 
+    parser.add_argument('--engine', choices=['imaplib', 'async'], default='imaplib',
+                        help='IMAP client: imaplib, or asyncio with pipelined FETCH commands')
+    parser.add_argument('--stats-file', metavar='PATH',
+                        help='Write timings, byte counts, message sizes and errors of the run as JSON')
+    parser.add_argument('--prometheus-file', metavar='PATH',
+                        help='Write the same statistics as a Prometheus textfile (node_exporter)')
+    parser.add_argument('--profile', choices=['cpu', 'sample', 'mem'],
+                        help='Profile the command: cProfile of the main thread, stack sampling of '
+                             'all threads, or tracemalloc snapshots at export checkpoints')
+    parser.add_argument('--profile-dir', metavar='DIR',
+                        help='Where to write profiles (default: the export output directory, '
+                             'else the current directory)')
+    parser.add_argument('--profile-interval', type=float, default=0, metavar='SECONDS',
+                        help='With --profile mem: at most one snapshot every SECONDS '
+                             '(default: one at every checkpoint)')
+    parser.add_argument('--no-deflate', action='store_true',
+                        help="Don't negotiate IMAP COMPRESS=DEFLATE even if the server offers it")
+    parser.add_argument('--token-cache', type=int, default=0, metavar='SECONDS',
+                        help='Reuse the OAuth2 access token across invocations for up to '
+                             'SECONDS (cached owner-only in ~/.cache/muttpu)')
+
     subparsers = parser.add_subparsers(dest='command', help='Command to run')
 
     # Setup command
@@ -904,19 +4735,52 @@ def main():
     # Count command
     count_parser = subparsers.add_parser('count', help='Count messages in mailbox')
     count_parser.add_argument('mailbox', help='Mailbox name')
+    count_parser.add_argument('--cached', action='store_true',
+                              help='Answer from the local header cache (built on first use)')
 
     # Search command
     search_parser = subparsers.add_parser('search', help='Search/preview messages')
     search_parser.add_argument('mailbox', help='Mailbox name')
     search_parser.add_argument('--year', type=int, help='Filter by year')
     search_parser.add_argument('--limit', type=int, default=20, help='Number of messages to show')
+    search_parser.add_argument('--histogram', nargs='?', const='month', choices=['month', 'year'],
+                               help='Show how many messages fall in each month (or year) instead')
+    search_parser.add_argument('--cached', action='store_true',
+                               help='Answer from the local header cache (built on first use)')
 
     # Export command
     export_parser = subparsers.add_parser('export', help='Export mailbox')
-    export_parser.add_argument('mailbox', help='Mailbox name')
-    export_parser.add_argument('output_dir', help='Output directory')
-    export_parser.add_argument('--format', choices=['eml', 'mbox'], default='eml', help='Export format')
+    export_parser.add_argument('mailbox', nargs='?', help='Mailbox name (omit with --all)')
+    export_parser.add_argument('output_dir', nargs='?', help='Output directory')
+    export_parser.add_argument('--all', action='store_true',
+                               help='Export every folder into <output_dir>/<folder>')
+    export_parser.add_argument('--include', action='append', metavar='GLOB',
+                               help='With --all: only folders matching GLOB (repeatable)')
+    export_parser.add_argument('--exclude', action='append', metavar='GLOB',
+                               help='With --all: skip folders matching GLOB (repeatable)')
+    export_parser.add_argument('--format', choices=['eml', 'mbox', 'maildir', 'tar', 'store'], default='eml',
+                               help='Export format')
+    export_parser.add_argument('--compress', choices=list(COMPRESS_SUFFIX),
+                               help='Compress mbox or tar output while exporting')
+    export_parser.add_argument('--shard', choices=SHARD_SCHEMES,
+                               help='Spread eml files over subdirectories: YYYY/MM, UID bucket or hash prefix')
+    export_parser.add_argument('--store', metavar='DIR',
+                               help='With --format store: content store shared between exports '
+                                    '(default: the output directory, or <output_dir>/.store with --all)')
     export_parser.add_argument('--batch-size', type=int, default=100, help='Checkpoint frequency')
+    export_parser.add_argument('--fetch-batch', type=int,
+                               help='Messages per FETCH round trip (default: up to 500, by size)')
+    export_parser.add_argument('--fetch-mb', type=float,
+                               help='Cap the adaptive byte budget per FETCH round trip in MB (default: 32)')
+    export_parser.add_argument('--parse-workers', type=int, metavar='N',
+                               help='Processes parsing messages while others download (default: CPUs, up to 4; '
+                                    '0 parses in the main process)')
+    export_parser.add_argument('--connections', type=int, default=1,
+                               help='Parallel IMAP connections (default: 1)')
+    export_parser.add_argument('--raw', action='store_true',
+                               help='Write messages byte-for-byte as fetched, without re-encoding')
+    export_parser.add_argument('--incremental', action='store_true',
+                               help='Only look for messages added since the last complete export')
     export_parser.add_argument('--limit', type=int, help='Limit number of messages')
     export_parser.add_argument('--skip', type=int, help='Skip first N messages')
     export_parser.add_argument('--range', help='Export range (e.g., 1:100)')
@@ -924,15 +4788,74 @@ def main():
     export_parser.add_argument('--fresh', action='store_true', help='Start fresh, ignore previous state')
     export_parser.add_argument('--verbose', action='store_true', help='Show detailed progress with UIDs')
 
+    # Reshard command
+    reshard_parser = subparsers.add_parser('reshard', help='Change the directory layout of an eml export')
+    reshard_parser.add_argument('output_dir', help='Output directory of the export')
+    reshard_parser.add_argument('--shard', choices=SHARD_SCHEMES, required=True, help='New layout')
+
     args = parser.parse_args()
+    TOKENS.cache_ttl = args.token_cache
+    global IMAP_ENGINE, IMAP_DEFLATE
+    IMAP_ENGINE = args.engine
+    IMAP_DEFLATE = not args.no_deflate
+
+    if args.command == 'export':
+        if args.all and args.output_dir is None:
+            args.mailbox, args.output_dir = None, args.mailbox
+        if args.output_dir is None or (args.mailbox is None) != args.all:
+            export_parser.error("usage: export <mailbox> <output_dir>, or export --all <output_dir>")
+        if args.shard and args.format != 'eml':
+            export_parser.error("--shard only applies to --format eml")
+        if args.compress and args.format not in ('mbox', 'tar'):
+            export_parser.error("--compress only applies to --format mbox or tar")
+        if args.compress == 'zstd' and zstandard is None:
+            export_parser.error("--compress zstd needs the zstandard package (pip install zstandard)")
+        if args.store and args.format != 'store':
+            export_parser.error("--store only applies to --format store")
+
+    global PROFILER
+    if args.profile:
+        directory = args.profile_dir or getattr(args, 'output_dir', None) or '.'
+        PROFILER = Profiler(args.profile, directory, args.command or 'menu', args.profile_interval)
+        if getattr(args, 'parse_workers', 0) != 0:
+            # Worker processes are invisible to the profiler
+            print_info("Profiling: parsing messages in this process (--parse-workers 0)")
+            args.parse_workers = 0
+        PROFILER.start()
+
+    exit_code = 1
+    try:
+        run_command(args)
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+        raise
+    finally:
+        if PROFILER:
+            for path in PROFILER.stop():
+                print_info(f"Profile written to {path}")
+        write_stats(args, exit_code)
+
+def write_stats(args, exit_code):
+    """Write --stats-file and --prometheus-file at the end of a run"""
+    for path, write in ((args.stats_file, STATS.write_json),
+                        (args.prometheus_file, STATS.write_prometheus)):
+        if not path:
+            continue
+        try:
+            write(path, args.command, exit_code)
+        except OSError as e:
+            print_warning(f"Could not write statistics to {path}: {e}")
 
+def run_command(args):
+    """Run the subcommand selected on the command line"""
     # No command - show menu
     if not args.command:
         interactive_menu()
         return
 
-    # Check token file exists for all commands except setup and configure
-    if args.command not in ['setup', 'configure'] and not TOKEN_FILE.exists():
+    # Check token file exists for all commands except setup, configure and reshard
+    if args.command not in ['setup', 'configure', 'reshard'] and not TOKEN_FILE.exists():
         print_error("OAuth2 token not found!")
         print()
         print_warning("You need to authenticate before using this command.")
@@ -950,9 +4873,35 @@ def main():
     elif args.command == 'list':
         list_mailboxes()
     elif args.command == 'count':
-        count_messages(args.mailbox)
+        count_messages(args.mailbox, args.cached)
     elif args.command == 'search':
-        search_by_date(args.mailbox, args.year, args.limit)
+        search_by_date(args.mailbox, args.year, args.limit, args.histogram, args.cached)
+    elif args.command == 'reshard':
+        reshard_export(args.output_dir, args.shard)
+    elif args.command == 'export' and args.all:
+        exporter = AccountExporter(
+            args.output_dir,
+            include=args.include,
+            exclude=args.exclude,
+            connections=args.connections,
+            fresh=args.fresh,
+            verbose=args.verbose,
+            format=args.format,
+            batch_size=args.batch_size,
+            limit=args.limit,
+            skip=args.skip,
+            range_spec=args.range,
+            year=args.year,
+            fetch_batch=args.fetch_batch,
+            fetch_bytes=int(args.fetch_mb * 1048576) if args.fetch_mb else None,
+            raw=args.raw,
+            incremental=args.incremental,
+            shard=args.shard,
+            compress=args.compress,
+            store_dir=args.store,
+            parse_workers=args.parse_workers
+        )
+        exporter.export()
     elif args.command == 'export':
         exporter = MailboxExporter(
             args.mailbox,
@@ -964,7 +4913,16 @@ def main():
             range_spec=args.range,
             year=args.year,
             fresh=args.fresh,
-            verbose=args.verbose
+            verbose=args.verbose,
+            fetch_batch=args.fetch_batch,
+            fetch_bytes=int(args.fetch_mb * 1048576) if args.fetch_mb else None,
+            connections=args.connections,
+            raw=args.raw,
+            incremental=args.incremental,
+            shard=args.shard,
+            compress=args.compress,
+            store_dir=args.store,
+            parse_workers=args.parse_workers
         )
         exporter.export()
 
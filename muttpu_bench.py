@@ -0,0 +1,637 @@
+#!/usr/bin/env python3
+"""
+MuttPU Benchmark - measure list, search and export throughput offline
+Serves synthetic mailboxes from a local stand-in IMAP server
+"""
+
+import argparse
+import base64
+import contextlib
+import imaplib
+import json
+import os
+import platform
+import queue
+import random
+import re
+import resource
+import shutil
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pathlib import Path
+
+import muttpu
+from muttpu import Colors, print_error, print_header, print_info, print_success, print_warning
+
+BENCH_TOKEN = "bench-token"
+BENCH_MAILBOX = "Bench"
+SCENARIOS = ('list', 'search', 'histogram', 'export-eml', 'export-mbox')
+
+WORDS = ("the of and to in is was for on that with as by at from it this be are have not "
+         "meeting report budget quarter review project draft schedule attached please thanks "
+         "regards invoice travel update client contract proposal deadline summary notes team "
+         "office campus library faculty research grant committee agenda minutes lecture").split()
+
+# Text the message bodies are cut from (generated once per run)
+_TEXT = None
+
+def text_pool(size=2 * 1048576):
+    """Deterministic pseudo-English lines, CRLF terminated"""
+    global _TEXT
+    if _TEXT is None:
+        rng = random.Random(0)
+        lines = []
+        total = 0
+        while total < size:
+            words = rng.choices(WORDS, k=rng.randint(4, 14))
+            if rng.random() < 0.01:
+                words[0] = "From"  # Exercises mbox From-quoting
+            line = " ".join(words).capitalize() + ".\r\n"
+            lines.append(line)
+            total += len(line)
+        _TEXT = "".join(lines).encode()
+    return _TEXT
+
+def parse_size(text):
+    """Parse a size such as 4096, 64k or 20m"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([kKmM]?)', text)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    scale = {'': 1, 'k': 1024, 'm': 1048576}[match.group(2).lower()]
+    return int(float(match.group(1)) * scale)
+
+def size_distribution(spec):
+    """Parse --sizes into a function rng -> message size
+
+    fixed:SIZE, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA (sizes like 8k or 2m)
+    """
+    kind, _, rest = spec.partition(':')
+    params = rest.split(':') if rest else []
+    try:
+        if kind == 'fixed' and len(params) == 1:
+            size = parse_size(params[0])
+            return lambda rng: size
+        if kind == 'uniform' and len(params) == 2:
+            low, high = parse_size(params[0]), parse_size(params[1])
+            return lambda rng: rng.randint(low, high)
+        if kind == 'lognormal' and len(params) == 2:
+            median, sigma = parse_size(params[0]), float(params[1])
+            return lambda rng: min(64 * 1048576, int(rng.lognormvariate(0, sigma) * median))
+    except (argparse.ArgumentTypeError, ValueError):
+        pass
+    raise argparse.ArgumentTypeError(f"invalid size distribution: {spec}")
+
+def make_message(rng, uid, size, when):
+    """A message of about size bytes; larger ones carry an incompressible attachment"""
+    boundary = f"bench-{uid}"
+    attachment = max(0, size - 16384) if size > 65536 else 0
+    header = (f"From: Sender {uid % 97} <sender{uid % 97}@example.com>\r\n"
+              f"To: bench@example.com\r\n"
+              f"Subject: {' '.join(rng.choices(WORDS, k=5)).capitalize()} #{uid}\r\n"
+              f"Date: {format_datetime(when)}\r\n"
+              f"Message-ID: <bench{uid}@example.com>\r\n"
+              f"MIME-Version: 1.0\r\n")
+    if attachment:
+        header += f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n--{boundary}\r\n'
+        header += "Content-Type: text/plain; charset=utf-8\r\n"
+    header = (header + "\r\n").encode()
+
+    pool = text_pool()
+    length = max(64, size - len(header) - attachment)
+    start = pool.find(b"\r\n", rng.randrange(len(pool) - length - 2)) + 2 if length < len(pool) // 2 else 0
+    body = pool[start:start + length].rpartition(b"\r\n")[0] + b"\r\n"
+    if attachment:
+        data = base64.encodebytes(rng.randbytes(attachment * 3 // 4)).replace(b"\n", b"\r\n")
+        body += (f"--{boundary}\r\nContent-Type: application/octet-stream\r\n"
+                 f"Content-Transfer-Encoding: base64\r\n"
+                 f'Content-Disposition: attachment; filename="file{uid}.bin"\r\n\r\n').encode()
+        body += data + f"--{boundary}--\r\n".encode()
+    return header + body
+
+class SyntheticMailbox:
+    """A mailbox of deterministic messages spread over 2015-2024"""
+
+    def __init__(self, name, count, sizes, seed=0, uidvalidity=1):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        rng = random.Random(f"{seed}:{name}")
+        start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        span = datetime(2025, 1, 1, tzinfo=timezone.utc) - start
+        self.messages = []
+        for uid in range(1, count + 1):
+            when = start + span * (uid / (count + 1))
+            raw = make_message(rng, uid, sizes(rng), when)
+            self.messages.append({'uid': uid, 'date': when, 'raw': raw,
+                                  'flags': '\\Seen' if uid % 3 else ''})
+        self.uidnext = count + 1
+        self.modseq = 1
+
+    @property
+    def size(self):
+        return sum(len(m['raw']) for m in self.messages)
+
+def _quote(value):
+    if value is None:
+        return b"NIL"
+    value = value.encode() if isinstance(value, str) else value
+    return b'"' + value.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+
+def _uid_ranges(spec, highest):
+    ranges = []
+    for part in spec.split(','):
+        low, _, high = part.partition(':')
+        low = highest if low == '*' else int(low)
+        high = low if not high else highest if high == '*' else int(high)
+        ranges.append((min(low, high), max(low, high)))
+    return ranges
+
+def _compact(numbers):
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][1] + 1 == number:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in runs)
+
+class BenchIMAPHandler(socketserver.StreamRequestHandler):
+    """One client connection, speaking the part of IMAP4rev1 that muttpu uses
+
+    Responses go out through a sender thread that holds each one until the
+    injected latency has passed since its command arrived, so pipelined
+    commands overlap their round trips as they would on a real network.
+    """
+
+    def setup(self):
+        super().setup()
+        self.selected = None
+        self.inflate = None
+        self.inflated = b""
+        self.received = time.monotonic()
+        self.outbox = queue.Queue()
+        self.sender = threading.Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
+
+    def finish(self):
+        self.outbox.put((0, None, False))
+        self.sender.join()
+        super().finish()
+
+    def send(self, data, start_deflate=False):
+        self.outbox.put((self.received + self.server.latency, data, start_deflate))
+
+    def _send_loop(self):
+        deflate = None
+        while True:
+            due, data, start_deflate = self.outbox.get()
+            if data is None:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if deflate:
+                data = deflate.compress(data) + deflate.flush(zlib.Z_SYNC_FLUSH)
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                return
+            if start_deflate:
+                deflate = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def readline(self):
+        if self.inflate is None:
+            return self.rfile.readline(imaplib._MAXLINE)
+        while b"\n" not in self.inflated:
+            data = self.rfile.read1(65536)
+            if not data:
+                return b""
+            self.inflated += self.inflate.decompress(data)
+        line, _, self.inflated = self.inflated.partition(b"\n")
+        return line + b"\n"
+
+    def handle(self):
+        self.send(b"* OK muttpu benchmark server ready\r\n")
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            self.received = time.monotonic()
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command, uid = command.upper(), False
+            if command == "UID":
+                uid = True
+                command, _, args = args.partition(" ")
+                command = command.upper()
+            handler = getattr(self, f"cmd_{command.lower()}", None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command {command}\r\n".encode())
+            elif handler(tag, args, uid) is False:
+                return
+
+    def cmd_capability(self, tag, args, uid):
+        self.send(f"* CAPABILITY {' '.join(self.server.capabilities)}\r\n{tag} OK done\r\n".encode())
+
+    def cmd_noop(self, tag, args, uid):
+        self.send(f"{tag} OK done\r\n".encode())
+
+    def cmd_logout(self, tag, args, uid):
+        self.send(f"* BYE logging out\r\n{tag} OK done\r\n".encode())
+        return False
+
+    def cmd_authenticate(self, tag, args, uid):
+        mechanism, _, initial = args.partition(" ")
+        if mechanism.upper() != "XOAUTH2":
+            self.send(f"{tag} NO unsupported mechanism\r\n".encode())
+            return
+        if not initial:
+            self.send(b"+ \r\n")
+            initial = self.readline().strip().decode()
+        try:
+            response = base64.b64decode(initial)
+        except ValueError:
+            response = b""
+        if f"auth=Bearer {BENCH_TOKEN}".encode() in response:
+            self.send(f"{tag} OK authenticated\r\n".encode())
+        else:
+            self.send(f"{tag} NO [AUTHENTICATIONFAILED] invalid token\r\n".encode())
+
+    def cmd_enable(self, tag, args, uid):
+        self.send(f"* ENABLED {args}\r\n{tag} OK done\r\n".encode())
+
+    def cmd_compress(self, tag, args, uid):
+        if "COMPRESS=DEFLATE" not in self.server.capabilities:
+            self.send(f"{tag} BAD not supported\r\n".encode())
+            return
+        self.send(f"{tag} OK deflate active\r\n".encode(), start_deflate=True)
+        self.inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def _mailbox(self, args):
+        match = re.match(r'"((?:[^"\\]|\\.)*)"\s*(.*)', args)
+        name, rest = match.groups() if match else args.partition(" ")[::2]
+        return self.server.mailboxes.get(name), rest
+
+    def cmd_list(self, tag, args, uid):
+        lines = [f'* LIST (\\HasNoChildren) "/" "{name}"\r\n' for name in self.server.mailboxes]
+        self.send(("".join(lines) + f"{tag} OK done\r\n").encode())
+
+    def cmd_status(self, tag, args, uid):
+        mailbox, items = self._mailbox(args)
+        if mailbox is None:
+            self.send(f"{tag} NO no such mailbox\r\n".encode())
+            return
+        values = {'MESSAGES': len(mailbox.messages), 'UIDNEXT': mailbox.uidnext,
+                  'UIDVALIDITY': mailbox.uidvalidity, 'UNSEEN': 0, 'HIGHESTMODSEQ': mailbox.modseq,
+                  'SIZE': mailbox.size}
+        answer = " ".join(f"{item} {values.get(item, 0)}" for item in items.strip("()").upper().split())
+        self.send(f'* STATUS "{mailbox.name}" ({answer})\r\n{tag} OK done\r\n'.encode())
+
+    def cmd_select(self, tag, args, uid):
+        mailbox, _ = self._mailbox(args)
+        if mailbox is None:
+            self.send(f"{tag} NO no such mailbox\r\n".encode())
+            return
+        self.selected = mailbox
+        self.send((f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n"
+                   f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+                   f"* OK [UIDNEXT {mailbox.uidnext}] next UID\r\n"
+                   f"* OK [HIGHESTMODSEQ {mailbox.modseq}] modseq\r\n"
+                   f"{tag} OK [READ-ONLY] done\r\n").encode())
+
+    cmd_examine = cmd_select
+
+    def _matching(self, spec, uid):
+        """(sequence number, message) pairs for a UID or sequence set"""
+        messages = self.selected.messages
+        if uid:
+            ranges = _uid_ranges(spec, messages[-1]['uid'] if messages else 0)
+            return [(seq, m) for seq, m in enumerate(messages, 1)
+                    if any(low <= m['uid'] <= high for low, high in ranges)]
+        ranges = _uid_ranges(spec, len(messages))
+        return [(seq, m) for seq, m in enumerate(messages, 1)
+                if any(low <= seq <= high for low, high in ranges)]
+
+    def cmd_search(self, tag, args, uid):
+        if self.selected is None:
+            self.send(f"{tag} BAD no mailbox selected\r\n".encode())
+            return
+        returns = None
+        match = re.match(r'RETURN \(([^)]*)\)\s*(.*)', args, re.I)
+        if match:
+            returns, args = match.group(1).upper().split(), match.group(2)
+        candidates = list(enumerate(self.selected.messages, 1))
+        words = args.split()
+        while words:
+            word = words.pop(0).upper()
+            if word in ('UID',) and words:
+                keep = {id(m) for _, m in self._matching(words.pop(0), True)}
+                candidates = [(s, m) for s, m in candidates if id(m) in keep]
+            elif word in ('SINCE', 'SENTSINCE', 'BEFORE', 'SENTBEFORE') and words:
+                day = datetime.strptime(words.pop(0), "%d-%b-%Y").date()
+                if word.endswith('SINCE'):
+                    candidates = [(s, m) for s, m in candidates if m['date'].date() >= day]
+                else:
+                    candidates = [(s, m) for s, m in candidates if m['date'].date() < day]
+            elif re.fullmatch(r'[\d*:,]+', word):
+                keep = {id(m) for _, m in self._matching(word, False)}
+                candidates = [(s, m) for s, m in candidates if id(m) in keep]
+        results = [m['uid'] if uid else seq for seq, m in candidates]
+        if returns is None:
+            self.send(("* SEARCH" + "".join(f" {r}" for r in results) + f"\r\n{tag} OK done\r\n").encode())
+            return
+        items = [f'* ESEARCH (TAG "{tag}")' + (" UID" if uid else "")]
+        if results and 'MIN' in returns:
+            items.append(f"MIN {results[0]}")
+        if results and 'MAX' in returns:
+            items.append(f"MAX {results[-1]}")
+        if results and 'ALL' in returns:
+            items.append(f"ALL {_compact(results)}")
+        if 'COUNT' in returns:
+            items.append(f"COUNT {len(results)}")
+        self.send((" ".join(items) + f"\r\n{tag} OK done\r\n").encode())
+
+    _ITEM = re.compile(r'BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+')
+
+    def cmd_fetch(self, tag, args, uid):
+        if self.selected is None:
+            self.send(f"{tag} BAD no mailbox selected\r\n".encode())
+            return
+        spec, _, items = args.partition(" ")
+        items = re.sub(r'\s*\(CHANGEDSINCE \d+\)\s*$', '', items.strip(), flags=re.I)
+        wanted = self._ITEM.findall(items.strip("()").upper())
+        if uid and 'UID' not in wanted:
+            wanted.insert(0, 'UID')
+        for seq, message in self._matching(spec, uid):
+            parts = [self._fetch_item(item, message) for item in wanted]
+            self.send(f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+        self.send(f"{tag} OK done\r\n".encode())
+
+    def _fetch_item(self, item, message):
+        raw = message['raw']
+        if item == 'UID':
+            return f"UID {message['uid']}".encode()
+        if item == 'FLAGS':
+            return f"FLAGS ({message['flags']})".encode()
+        if item == 'RFC822.SIZE':
+            return f"RFC822.SIZE {len(raw)}".encode()
+        if item == 'INTERNALDATE':
+            return f'INTERNALDATE "{message["date"].strftime("%d-%b-%Y %H:%M:%S +0000")}"'.encode()
+        header = raw.split(b"\r\n\r\n", 1)[0]
+        if item == 'ENVELOPE':
+            fields = dict(re.findall(rb'^([A-Za-z-]+): (.*?)\r?$', header, re.M))
+            sender = re.match(rb'(.*) <([^@]+)@([^>]+)>', fields.get(b'From', b'x <x@x>'))
+            address = b"((" + b" ".join(_quote(part) for part in (sender.group(1), None, sender.group(2),
+                                                                  sender.group(3))) + b"))"
+            envelope = [_quote(fields.get(b'Date')), _quote(fields.get(b'Subject')), address, address,
+                        address, b'((NIL NIL "bench" "example.com"))', b"NIL", b"NIL", b"NIL",
+                        _quote(fields.get(b'Message-ID'))]
+            return b"ENVELOPE (" + b" ".join(envelope) + b")"
+        if 'HEADER.FIELDS' in item:
+            names = set(re.search(r'\(([^)]*)\)', item).group(1).encode().split())
+            lines = [line for line in header.split(b"\r\n") if line.split(b":")[0].upper() in names]
+            data = b"".join(line + b"\r\n" for line in lines) + b"\r\n"
+            return item.replace(".PEEK", "").encode() + f" {{{len(data)}}}\r\n".encode() + data
+        # RFC822, BODY[] or a partial BODY[]<offset.length>
+        name, data = item.replace(".PEEK", ""), raw
+        partial = re.search(r'<(\d+)\.(\d+)>', item)
+        if partial:
+            offset, length = int(partial.group(1)), int(partial.group(2))
+            data = raw[offset:offset + length]
+            name = f"BODY[]<{offset}>"
+        return f"{name} {{{len(data)}}}\r\n".encode() + data
+
+class BenchIMAPServer(socketserver.ThreadingTCPServer):
+    """Plain-text IMAP server on localhost serving synthetic mailboxes"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailboxes, latency=0.0, compress=True):
+        super().__init__(("127.0.0.1", 0), BenchIMAPHandler)
+        self.mailboxes = {mailbox.name: mailbox for mailbox in mailboxes}
+        self.latency = latency
+        self.capabilities = ["IMAP4rev1", "AUTH=XOAUTH2", "ESEARCH", "ENABLE", "CONDSTORE", "UIDPLUS"]
+        if compress:
+            self.capabilities.append("COMPRESS=DEFLATE")
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def point_muttpu_at(port, engine):
+    """Send muttpu's connections to the local server, without TLS, with a stub token"""
+    class PlainIMAP(muttpu.DeflateIMAP4_SSL):
+        def _create_socket(self, timeout):
+            return imaplib.IMAP4._create_socket(self, timeout)
+
+    open_async = muttpu.AsyncIMAP.open.__func__
+    muttpu.DeflateIMAP4_SSL = PlainIMAP
+    muttpu.AsyncIMAP.open = classmethod(
+        lambda cls, host, port=port, **kwargs: open_async(cls, host, port, tls=False))
+    muttpu.IMAP_SERVER = "127.0.0.1"
+    muttpu.IMAP_PORT = port
+    muttpu.IMAP_ENGINE = engine
+    muttpu.get_token = lambda: BENCH_TOKEN
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB (ru_maxrss is bytes on macOS, KB elsewhere)
+
+    With RUSAGE_CHILDREN, that of the largest child process waited for.
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1048576 if sys.platform == 'darwin' else 1024), 1)
+
+def run_worker(args):
+    """Run one scenario in this (fresh) process and print its result as JSON"""
+    point_muttpu_at(args.port, args.engine)
+    work_dir = Path(tempfile.mkdtemp(prefix=f"{args.worker}-", dir=args.work_dir))
+    messages = nbytes = None
+    started = time.monotonic()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.worker == 'list':
+            muttpu.list_mailboxes()
+        elif args.worker == 'search':
+            muttpu.search_by_date(BENCH_MAILBOX, year=2020, limit=20)
+        elif args.worker == 'histogram':
+            muttpu.search_by_date(BENCH_MAILBOX, histogram='month')
+            messages = args.messages
+        else:
+            exporter = muttpu.MailboxExporter(
+                BENCH_MAILBOX, work_dir, format=args.worker.split('-', 1)[1],
+                connections=args.connections, raw=args.raw, parse_workers=args.parse_workers)
+            exporter.export()
+            messages, nbytes = exporter.state.total_exported, exporter.exported_bytes
+    seconds = time.monotonic() - started
+    # Parse workers only count in RUSAGE_CHILDREN once they have exited
+    for pool in muttpu.MailboxExporter._pools.values():
+        pool.shutdown()
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps({
+        "scenario": args.worker,
+        "engine": args.engine,
+        "seconds": round(seconds, 3),
+        "messages": messages,
+        "bytes": nbytes,
+        "msgs_per_sec": round(messages / seconds, 1) if messages else None,
+        "mb_per_sec": round(nbytes / seconds / 1048576, 2) if nbytes else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "worker_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "phases": muttpu.STATS.summary()["phases"],
+    }))
+
+def run_scenario(args, scenario, engine, port, work_dir):
+    """Run a scenario in a child process, so peak RSS is its own"""
+    command = [sys.executable, str(Path(__file__).resolve()), '--worker', scenario,
+               '--engine', engine, '--port', str(port), '--work-dir', str(work_dir),
+               '--messages', str(args.messages), '--connections', str(args.connections)]
+    if args.raw:
+        command.append('--raw')
+    if args.keep:
+        command.append('--keep')
+    if args.parse_workers is not None:
+        command += ['--parse-workers', str(args.parse_workers)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0 or not result.stdout.strip():
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip()
+                           else f"exit status {result.returncode}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def total_rss_mb(result):
+    """Peak RSS of the main process plus that of one parse worker"""
+    return result["peak_rss_mb"] + result.get("worker_peak_rss_mb", 0)
+
+def compare(report, baseline):
+    """Print each scenario's change against a baseline report"""
+    before = {(r["scenario"], r["engine"]): r for r in baseline.get("results", [])}
+    changed = sorted(key for key, value in report["config"].items()
+                     if baseline.get("config", {}).get(key) != value)
+    if changed:
+        print_warning(f"The baseline was run with different settings: {', '.join(changed)}")
+    print(f"\n{Colors.BOLD}{'Scenario':<24} {'Time':>10} {'Peak RSS':>10}{Colors.ENDC}")
+    print("-" * 46)
+    for result in report["results"]:
+        old = before.get((result["scenario"], result["engine"]))
+        if not old:
+            continue
+        speed = (old["seconds"] / result["seconds"] - 1) * 100 if result["seconds"] else 0
+        memory = (total_rss_mb(result) / total_rss_mb(old) - 1) * 100 if total_rss_mb(old) else 0
+        color = Colors.RED if speed < -10 or memory > 20 else Colors.GREEN
+        print(f"{color}{result['scenario'] + ' (' + result['engine'] + ')':<24} "
+              f"{speed:>+9.1f}% {memory:>+9.1f}%{Colors.ENDC}")
+    print_info("Time: positive is faster. Peak RSS (main process plus one parse worker): "
+               "positive uses more memory.")
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(
+        description='MuttPU Benchmark - throughput against a local stand-in IMAP server')
+    parser.add_argument('--messages', type=int, default=2000,
+                        help='Messages in the benchmark folder (default: 2000)')
+    parser.add_argument('--sizes', default='lognormal:8k:1.2', metavar='DIST',
+                        help='Message sizes: fixed:SIZE, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA '
+                             '(default: lognormal:8k:1.2)')
+    parser.add_argument('--latency', type=float, default=0, metavar='MS',
+                        help='Round-trip latency the server adds to every command')
+    parser.add_argument('--no-compress', action='store_true',
+                        help="Don't offer COMPRESS=DEFLATE")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                        help='Scenarios to run (default: all)')
+    parser.add_argument('--engine', choices=['imaplib', 'async', 'both'], default='imaplib',
+                        help='IMAP engine(s) to benchmark')
+    parser.add_argument('--connections', type=int, default=1, help='Connections for exports')
+    parser.add_argument('--parse-workers', type=int, help='Parse processes for exports')
+    parser.add_argument('--raw', action='store_true', help='Export with --raw')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic mailboxes')
+    parser.add_argument('--output', '-o', metavar='PATH', help='Write the JSON report here')
+    parser.add_argument('--compare', metavar='PATH', help='Compare against an earlier JSON report')
+    parser.add_argument('--keep', action='store_true', help='Keep the exported files')
+    # Internal: run one scenario in a child process
+    parser.add_argument('--worker', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    try:
+        sizes = size_distribution(args.sizes)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    print_header("MuttPU Benchmark")
+    started = time.monotonic()
+    mailboxes = [SyntheticMailbox(BENCH_MAILBOX, args.messages, sizes, args.seed),
+                 SyntheticMailbox("INBOX", 100, size_distribution('fixed:4k'), args.seed),
+                 SyntheticMailbox("Sent Items", 100, size_distribution('fixed:4k'), args.seed)]
+    total = mailboxes[0].size
+    print_info(f"Generated {args.messages:,} messages ({total / 1048576:,.1f} MB) "
+               f"in {time.monotonic() - started:,.1f}s")
+    server = BenchIMAPServer(mailboxes, latency=args.latency / 1000, compress=not args.no_compress).start()
+    print_info(f"Serving on 127.0.0.1:{server.port}"
+               + (f" with {args.latency:g} ms latency" if args.latency else ""))
+
+    engines = ['imaplib', 'async'] if args.engine == 'both' else [args.engine]
+    results = []
+    work_dir = Path(tempfile.mkdtemp(prefix="muttpu-bench-"))
+    print(f"\n{Colors.BOLD}{'Scenario':<24} {'Seconds':>9} {'Msgs/s':>10} {'MB/s':>8} "
+          f"{'Main RSS':>10} {'Worker RSS':>11}{Colors.ENDC}")
+    print("-" * 77)
+    try:
+        for engine in engines:
+            for scenario in args.scenarios:
+                label = f"{scenario} ({engine})"
+                try:
+                    result = run_scenario(args, scenario, engine, server.port, work_dir)
+                except (RuntimeError, ValueError) as e:
+                    print_error(f"{label}: {e}")
+                    continue
+                results.append(result)
+                rate = f"{result['msgs_per_sec']:,.0f}" if result['msgs_per_sec'] else "-"
+                speed = f"{result['mb_per_sec']:,.1f}" if result['mb_per_sec'] else "-"
+                print(f"{label:<24} {result['seconds']:>9,.2f} {rate:>10} {speed:>8} "
+                      f"{result['peak_rss_mb']:>8,.0f}MB {result['worker_peak_rss_mb']:>9,.0f}MB")
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "benchmark": "muttpu",
+        "date": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"messages": args.messages, "sizes": args.sizes, "bytes": total,
+                   "latency_ms": args.latency,
+                   "compress": not args.no_compress, "connections": args.connections,
+                   "raw": args.raw, "parse_workers": args.parse_workers, "seed": args.seed},
+        "results": results,
+    }
+    print()
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+        print_success(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        try:
+            compare(report, json.loads(Path(args.compare).read_text()))
+        except (OSError, ValueError) as e:
+            print_warning(f"Cannot compare with {args.compare}: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Fixtures: muttpu pointed at the stand-in IMAP server from muttpu_bench.py"""
+
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import muttpu
+import muttpu_bench
+
+
+class FaultyHandler(muttpu_bench.BenchIMAPHandler):
+    """Bench handler whose UID FETCH can be made to fail
+
+    server.on_fetch(args) returns None to answer normally, 'drop' to close
+    the connection or any other string to answer NO with it. With
+    server.reverse_search set, SEARCH results come in descending order.
+    """
+
+    def send(self, data, start_deflate=False):
+        if self.server.reverse_search and data.startswith(b"* SEARCH"):
+            line, _, rest = data.partition(b"\r\n")
+            data = b" ".join([b"* SEARCH", *reversed(line.split()[2:])]) + b"\r\n" + rest
+        super().send(data, start_deflate)
+
+    def cmd_fetch(self, tag, args, uid):
+        outcome = self.server.on_fetch(args) if self.server.on_fetch else None
+        if outcome == 'drop':
+            return False
+        if outcome:
+            self.send(f"{tag} NO {outcome}\r\n".encode())
+            return
+        return super().cmd_fetch(tag, args, uid)
+
+
+def add_messages(mailbox, count, when=None):
+    """Deliver count new messages to a SyntheticMailbox"""
+    for _ in range(count):
+        uid = mailbox.uidnext
+        date = when or datetime.now(timezone.utc)
+        raw = muttpu_bench.make_message(muttpu_bench.random.Random(uid), uid, 3000, date)
+        mailbox.messages.append({'uid': uid, 'date': date, 'raw': raw, 'flags': ''})
+        mailbox.uidnext += 1
+        mailbox.modseq += 1
+
+
+@pytest.fixture
+def mailbox():
+    """INBOX with 60 small messages spread over 2015-2024"""
+    return muttpu_bench.SyntheticMailbox("INBOX", 60, muttpu_bench.size_distribution("uniform:2k:6k"))
+
+
+@pytest.fixture
+def engine():
+    return "imaplib"
+
+
+@pytest.fixture
+def server(mailbox, engine, monkeypatch):
+    """A running stand-in server with muttpu connected to it"""
+    for name in ("DeflateIMAP4_SSL", "IMAP_SERVER", "IMAP_PORT", "IMAP_ENGINE", "get_token"):
+        monkeypatch.setattr(muttpu, name, getattr(muttpu, name))
+    monkeypatch.setattr(muttpu.AsyncIMAP, "open", muttpu.AsyncIMAP.__dict__["open"])
+    monkeypatch.setattr(muttpu.MailboxExporter, "RETRY_BACKOFF", 0.01)
+    server = muttpu_bench.BenchIMAPServer([mailbox])
+    server.RequestHandlerClass = FaultyHandler
+    server.on_fetch = None
+    server.reverse_search = False
+    server.start()
+    muttpu_bench.point_muttpu_at(server.port, engine)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def export(server, tmp_path):
+    """Run a quiet single-process export of INBOX into tmp_path/out"""
+    def run(mailbox="INBOX", output=None, **options):
+        options.setdefault("parse_workers", 0)
+        exporter = muttpu.MailboxExporter(mailbox, output or tmp_path / "out", quiet=True,
+                                          progress=lambda *args: None, **options)
+        exporter.export()
+        return exporter
+    return run
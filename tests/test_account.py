@@ -0,0 +1,54 @@
+"""export --all: folder selection and order"""
+
+import pytest
+
+import muttpu
+import muttpu_bench
+
+SIZES = muttpu_bench.size_distribution("uniform:2k:6k")
+
+
+@pytest.fixture
+def folders(server):
+    """Add folders next to INBOX (60 messages); return {name: message count}"""
+    counts = {"Archive/2019": 5, "Archive/2020": 30, "Trash": 10, "Junk Email": 3}
+    for seed, (name, count) in enumerate(counts.items(), 1):
+        server.mailboxes[name] = muttpu_bench.SyntheticMailbox(name, count, SIZES, seed=seed)
+    return {"INBOX": 60, **counts}
+
+
+def exported(out):
+    state = muttpu.AccountExporter(out).state
+    return {name: entry["exported"] for name, entry in state["folders"].items()}
+
+
+def test_include_exclude(folders, tmp_path):
+    out = tmp_path / "out"
+    # Globs are case-insensitive; excludes win over includes
+    muttpu.AccountExporter(out, include=["inbox", "ARCHIVE/*"], exclude=["*2019"],
+                           format="mbox", raw=True, parse_workers=0).export()
+    assert exported(out) == {"INBOX": 60, "Archive/2020": 30}
+    assert (out / "Archive" / "2020" / "Archive_2020.mbox").exists()
+    assert not (out / "Archive" / "2019").exists()
+
+    muttpu.AccountExporter(out, exclude=["Trash", "Junk*"], format="mbox", raw=True, parse_workers=0).export()
+    assert exported(out) == {"INBOX": 60, "Archive/2019": 5, "Archive/2020": 30}
+
+
+@pytest.mark.parametrize("status_size", [False, True])
+def test_largest_folders_first(server, folders, tmp_path, monkeypatch, status_size):
+    if status_size:
+        server.capabilities.append("STATUS=SIZE")
+        # By bytes, the 30 small messages of Archive/2020 outweigh INBOX
+        for message in server.mailboxes["Archive/2020"].messages:
+            message['raw'] += b"x" * 20000 + b"\r\n"
+    order = []
+    run_folder = muttpu.AccountExporter._run_folder
+    monkeypatch.setattr(muttpu.AccountExporter, "_run_folder",
+                        lambda self, folder: order.append(folder["name"]) or run_folder(self, folder))
+
+    muttpu.AccountExporter(tmp_path / "out", format="mbox", raw=True, parse_workers=0).export()
+    if status_size:
+        assert order[:2] == ["Archive/2020", "INBOX"]
+    else:
+        assert order == sorted(folders, key=folders.get, reverse=True)
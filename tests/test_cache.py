@@ -0,0 +1,53 @@
+"""HeaderCache: topping up and noticing expunges"""
+
+import pytest
+
+import muttpu
+from conftest import add_messages
+
+
+@pytest.fixture
+def imap(server):
+    session = muttpu.connect_imap(quiet=True)
+    yield session
+    session.logout()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = muttpu.HeaderCache(tmp_path / "headers.db")
+    yield cache
+    cache.close()
+
+
+def cached_uids(cache):
+    return [m['uid'] for m in cache.summaries("INBOX", limit=1000)]
+
+
+def test_refresh_tops_up_new_messages(imap, cache, mailbox):
+    assert cache.refresh(imap, "INBOX", quiet=True) == 60
+    add_messages(mailbox, 3)
+    assert cache.refresh(imap, "INBOX", quiet=True) == 63
+    assert cached_uids(cache) == [m['uid'] for m in mailbox.messages]
+
+
+def test_expunge_plus_arrival_keeps_count(imap, cache, mailbox):
+    cache.refresh(imap, "INBOX", quiet=True)
+    gone = mailbox.messages.pop(10)
+    add_messages(mailbox, 1)
+    assert cache.refresh(imap, "INBOX", quiet=True) == 60
+    assert cache.count("INBOX") == 60
+    assert cached_uids(cache) == [m['uid'] for m in mailbox.messages]
+    assert gone['uid'] not in cached_uids(cache)
+    assert sum(cache.histogram("INBOX", 'year').values()) == 60
+
+
+def test_expunge_seen_through_highestmodseq(imap, cache, mailbox):
+    cache.refresh(imap, "INBOX", quiet=True)
+    # The count, UIDNEXT and UIDVALIDITY all still match the cached row
+    gone = mailbox.messages.pop(0)
+    with cache.db:
+        cache.db.execute('UPDATE mailboxes SET messages = 59')
+    mailbox.modseq += 1
+    assert cache.refresh(imap, "INBOX", quiet=True) == 59
+    assert gone['uid'] not in cached_uids(cache)
@@ -0,0 +1,56 @@
+"""--compress: resuming a compressed archive at a member boundary"""
+
+import gzip
+import lzma
+import mailbox as mailboxes
+import tarfile
+
+import pytest
+
+from test_export import expected_ids
+
+OPENERS = {"gzip": gzip.open, "xz": lzma.open}
+
+
+def mbox_ids(path, method, tmp_path):
+    plain = tmp_path / "plain.mbox"
+    with OPENERS[method](path) as f:
+        plain.write_bytes(f.read())
+    return [message['Message-ID'] for message in mailboxes.mbox(str(plain))]
+
+
+@pytest.mark.parametrize("method", ["gzip", "xz"])
+def test_resumed_mbox_appends_members(export, mailbox, tmp_path, method):
+    export(format="mbox", compress=method, limit=25)
+    archive = tmp_path / "out" / f"INBOX.mbox.{'gz' if method == 'gzip' else 'xz'}"
+    first_run = archive.read_bytes()
+
+    exporter = export(format="mbox")
+    assert exporter.compress == method and exporter.finished
+    # The first run's members are kept as they were and the rest follows them
+    assert archive.read_bytes().startswith(first_run)
+    assert mbox_ids(archive, method, tmp_path) == expected_ids(mailbox)
+
+
+def test_resume_cuts_a_torn_member(export, mailbox, tmp_path):
+    export(format="mbox", compress="gzip", limit=25)
+    archive = tmp_path / "out" / "INBOX.mbox.gz"
+    size = archive.stat().st_size
+    # A crash halfway through compressing the next checkpoint's member
+    torn = gzip.compress(b"From MAILER-DAEMON Thu Jan  1 00:00:00 2015\nMessage-ID: <torn@example.com>\n\n")
+    with open(archive, "ab") as f:
+        f.write(torn[:len(torn) // 2])
+    with open(archive.with_name("INBOX.mbox.gz.idx"), "ab") as f:
+        f.write(f"26 {size} {archive.stat().st_size}\n".encode())
+
+    exporter = export(format="mbox")
+    assert exporter.finished and not exporter.errors
+    assert mbox_ids(archive, "gzip", tmp_path) == expected_ids(mailbox)
+
+
+def test_resumed_tar_drops_the_old_trailer(export, mailbox, tmp_path):
+    export(format="tar", compress="gzip", limit=25)
+    export(format="tar")
+    with tarfile.open(tmp_path / "out" / "INBOX.tar.gz", "r:gz") as tar:
+        uids = [int(name.split("_")[2]) for name in tar.getnames()]
+    assert uids == [m['uid'] for m in mailbox.messages]
@@ -0,0 +1,29 @@
+"""IMAP COMPRESS=DEFLATE on both engines"""
+
+import pytest
+
+import muttpu
+from test_export import expected_ids, message_ids
+
+
+@pytest.mark.parametrize("engine", ["imaplib", "async"])
+def test_export_over_deflate(export, mailbox, tmp_path, engine):
+    before = muttpu.DEFLATE_STATS.snapshot()
+    exporter = export(format="mbox", raw=True, connections=2)
+    assert exporter.finished and not exporter.errors
+    assert sorted(message_ids(tmp_path / "out" / "INBOX.mbox")) == sorted(expected_ids(mailbox))
+
+    wire_in, data_in, wire_out, data_out = (b - a for a, b in zip(before, muttpu.DEFLATE_STATS.snapshot()))
+    # Every message came through the inflater, and compressed well
+    assert data_in > sum(len(m['raw']) for m in mailbox.messages)
+    assert wire_in < data_in / 2
+    assert 0 < wire_out and 0 < data_out
+
+
+@pytest.mark.parametrize("engine", ["imaplib", "async"])
+def test_no_deflate(export, mailbox, tmp_path, monkeypatch, engine):
+    monkeypatch.setattr(muttpu, "IMAP_DEFLATE", False)
+    before = muttpu.DEFLATE_STATS.snapshot()
+    exporter = export(format="mbox", raw=True)
+    assert exporter.finished and not exporter.errors
+    assert muttpu.DEFLATE_STATS.snapshot() == before
@@ -0,0 +1,185 @@
+"""Export, resume and recovery against the stand-in IMAP server"""
+
+import mailbox as mailboxes
+import os
+import signal
+import threading
+
+import pytest
+
+import muttpu
+
+
+def message_ids(path):
+    return [message['Message-ID'] for message in mailboxes.mbox(str(path))]
+
+
+def expected_ids(box):
+    return [f"<bench{m['uid']}@example.com>" for m in box.messages]
+
+
+@pytest.mark.parametrize("engine", ["imaplib", "async"])
+def test_export_eml(export, mailbox, tmp_path):
+    exporter = export(raw=True)
+    assert exporter.finished and not exporter.errors
+    assert len(list((tmp_path / "out").glob("*.eml"))) == len(mailbox.messages)
+
+
+def test_resume_exports_the_rest(export, mailbox, tmp_path):
+    export(format="mbox", limit=25)
+    exporter = export(format="mbox")
+    assert exporter.state.total_exported == len(mailbox.messages)
+    assert message_ids(tmp_path / "out" / "INBOX.mbox") == expected_ids(mailbox)
+
+
+def test_resume_discards_uncommitted_tail(export, mailbox, tmp_path):
+    export(format="mbox", limit=25)
+    archive = tmp_path / "out" / "INBOX.mbox"
+    size = archive.stat().st_size
+    # A crash after writing a message but before the state was saved
+    with open(archive, "ab") as f:
+        f.write(b"From MAILER-DAEMON Thu Jan  1 00:00:00 2015\nMessage-ID: <torn@example.com>\n\nhalf")
+    with open(archive.with_name("INBOX.mbox.idx"), "ab") as f:
+        f.write(f"26 {size} {archive.stat().st_size}\n".encode())
+
+    exporter = export(format="mbox")
+    assert exporter.finished and not exporter.errors
+    assert message_ids(archive) == expected_ids(mailbox)
+
+
+def test_dropped_connection_is_retried(export, server, mailbox, tmp_path):
+    fetches = []
+
+    def on_fetch(args):
+        fetches.append(args)
+        return "drop" if len(fetches) == 3 else None
+    server.on_fetch = on_fetch
+
+    exporter = export(format="mbox", fetch_batch=10)
+    assert exporter.finished and not exporter.errors
+    assert message_ids(tmp_path / "out" / "INBOX.mbox") == expected_ids(mailbox)
+
+
+@pytest.mark.parametrize("engine", ["imaplib", "async"])
+@pytest.mark.parametrize("connections", [1, 2])
+def test_failed_retry_keeps_new_session(export, server, mailbox, tmp_path, connections):
+    fetches = []
+
+    def on_fetch(args):
+        if "RFC822.SIZE" in args.upper():
+            return None
+        fetches.append(args)
+        # Drop one batch's connection, then refuse its retry on the new one
+        return {2: "drop", 3: "Message not available"}.get(len(fetches))
+    server.on_fetch = on_fetch
+
+    exporter = export(format="mbox", raw=True, fetch_batch=5, connections=connections)
+    assert len(exporter.errors) <= 5
+    assert exporter.state.total_exported >= len(mailbox.messages) - 5
+
+
+@pytest.mark.parametrize("format, compress", [("mbox", None), ("tar", "gzip"), ("store", None)])
+def test_fresh_export_keeps_existing_archive(export, mailbox, tmp_path, format, compress):
+    export(format=format, compress=compress, raw=True)
+    out = tmp_path / "out"
+    before = {path.name: path.stat().st_size for path in out.iterdir() if path.name.startswith("INBOX")}
+
+    exporter = export(format=format, compress=compress, raw=True, fresh=True, limit=10)
+    assert exporter.finished
+    kept = [path for path in out.iterdir() if path.name.startswith("INBOX-")]
+    archive = [name for name in before if not name.endswith(".idx")][0]
+    assert sorted(path.stat().st_size for path in kept) == sorted(before.values())
+    assert any(path.name.endswith(archive.partition(".")[2]) for path in kept)
+
+
+def test_uidvalidity_change_keeps_existing_archive(export, mailbox, tmp_path):
+    export(format="mbox")
+    mailbox.uidvalidity += 1
+    mailbox.messages = mailbox.messages[:10]
+
+    export(format="mbox")
+    out = tmp_path / "out"
+    [kept] = [path for path in out.glob("INBOX-*.mbox")]
+    assert len(message_ids(kept)) == 60
+    assert len(message_ids(out / "INBOX.mbox")) == 10
+
+
+def test_maildir_resume_after_crash_before_state_save(export, mailbox, tmp_path, monkeypatch):
+    flushes = []
+    original = muttpu.MaildirWriter.flush
+
+    def crash_in_second_flush(self):
+        # Half the batch reaches cur/, the rest is left in tmp/
+        flushes.append(len(self.pending))
+        if len(flushes) == 2:
+            self.pending = self.pending[:len(self.pending) // 2]
+            original(self)
+            raise KeyboardInterrupt
+        original(self)
+    monkeypatch.setattr(muttpu.MaildirWriter, "flush", crash_in_second_flush)
+    with pytest.raises(KeyboardInterrupt):
+        export(format="maildir", raw=True, batch_size=10, fetch_batch=10)
+    monkeypatch.setattr(muttpu.MaildirWriter, "flush", original)
+    tmp = tmp_path / "out" / "INBOX" / "tmp"
+    assert os.listdir(tmp)
+
+    exporter = export(format="maildir", raw=True)
+    assert exporter.finished and exporter.state.total_exported == len(mailbox.messages)
+    delivered = [name.split(",U=")[1] for name in os.listdir(tmp_path / "out" / "INBOX" / "cur")]
+    assert len(delivered) == len(set(delivered)) == len(mailbox.messages)
+    assert os.listdir(tmp) == []
+
+
+@pytest.mark.parametrize("format", ["mbox", "store"])
+def test_large_message_sizes_are_released(export, mailbox, tmp_path, format):
+    for message in mailbox.messages[::4]:
+        message['raw'] += b"x" * 20000 + b"\r\n"
+    exporter = export(format=format, raw=True, fetch_bytes=16384)
+    assert exporter.finished and not exporter.errors
+    assert exporter.state.total_exported == len(mailbox.messages)
+    assert exporter.large_sizes == {}
+
+
+def test_connection_that_gives_up_hands_back_its_batch(export, server, mailbox, tmp_path):
+    seen, doomed = set(), set()
+
+    def on_fetch(args):
+        thread = threading.current_thread()
+        if not doomed and "RFC822.SIZE" not in args.upper() and len(seen) >= 2:
+            doomed.add(thread)
+        if doomed and thread not in seen - doomed:
+            # The doomed connection and every reconnect attempt fail
+            return "drop"
+        seen.add(thread)
+        return None
+    server.on_fetch = on_fetch
+
+    exporter = export(format="mbox", raw=True, fetch_batch=5, connections=2)
+    assert doomed and not exporter.errors
+    # Several connections append in completion order
+    assert sorted(message_ids(tmp_path / "out" / "INBOX.mbox")) == sorted(expected_ids(mailbox))
+
+
+def test_killed_parse_worker_falls_back_to_in_process(export, server, mailbox, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(muttpu.MailboxExporter, "_pools", {})
+    monkeypatch.setattr(muttpu.MailboxExporter, "_pools_broken", False)
+    failures = muttpu.STATS.counters['parse_pool_failures']
+    fetches = []
+
+    def on_fetch(args):
+        if "RFC822.SIZE" in args.upper():
+            return None
+        fetches.append(args)
+        if len(fetches) == 4:
+            for pool in muttpu.MailboxExporter._pools.values():
+                for process in list((pool._processes or {}).values()):
+                    os.kill(process.pid, signal.SIGKILL)
+    server.on_fetch = on_fetch
+
+    exporter = export(format="mbox", parse_workers=2, fetch_batch=5)
+    assert exporter.finished and not exporter.errors
+    assert exporter.state.total_exported == len(mailbox.messages)
+    assert message_ids(tmp_path / "out" / "INBOX.mbox") == expected_ids(mailbox)
+    assert muttpu.MailboxExporter._pools == {}
+    assert muttpu.STATS.counters['parse_pool_failures'] == failures + 1
+    assert "Parse workers failed" in capsys.readouterr().out
@@ -0,0 +1,32 @@
+"""--incremental sync points and filtered runs"""
+
+import muttpu
+from conftest import add_messages
+
+
+def test_incremental_picks_up_new_messages(export, mailbox):
+    export(format="mbox", raw=True)
+    add_messages(mailbox, 5)
+    exporter = export(format="mbox", raw=True, incremental=True)
+    assert exporter.state.total_exported == len(mailbox.messages)
+
+
+def test_year_export_does_not_set_sync_point(export, mailbox):
+    first = export(format="mbox", raw=True, year=2020)
+    in_2020 = sum(m['date'].year == 2020 for m in mailbox.messages)
+    assert 0 < first.state.total_exported == in_2020
+    assert first.state.data["uidnext"] is None
+
+    exporter = export(format="mbox", raw=True, incremental=True)
+    assert exporter.state.total_exported == len(mailbox.messages)
+
+
+def test_filtered_account_export_does_not_skip_folders(server, mailbox, tmp_path):
+    options = dict(format="mbox", raw=True, parse_workers=0)
+    muttpu.AccountExporter(tmp_path, year=2020, **options).export()
+    first = muttpu.ExportState(tmp_path / "INBOX" / ".export_state.json", "INBOX", "mbox")
+    assert first.total_exported < len(mailbox.messages)
+
+    muttpu.AccountExporter(tmp_path, **options).export()
+    state = muttpu.ExportState(tmp_path / "INBOX" / ".export_state.json", "INBOX", "mbox")
+    assert state.total_exported == len(mailbox.messages)
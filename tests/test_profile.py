@@ -0,0 +1,47 @@
+"""--profile reports, written through main()"""
+
+import sys
+
+import pytest
+
+import muttpu
+
+
+@pytest.fixture
+def run_main(server, tmp_path, monkeypatch):
+    token = tmp_path / "token.json"
+    token.write_text("{}")
+    monkeypatch.setattr(muttpu, "TOKEN_FILE", token)
+    monkeypatch.setattr(muttpu, "PROFILER", None)
+
+    def run(*argv):
+        monkeypatch.setattr(sys, "argv", ["muttpu.py", *argv])
+        muttpu.main()
+    return run
+
+
+def test_cpu_profile_includes_parsing(run_main, tmp_path):
+    out = tmp_path / "out"
+    run_main("--profile", "cpu", "export", "INBOX", str(out), "--parse-workers", "2")
+    [report] = out.glob("muttpu-cpu-export-*.txt")
+    assert "prepare_message" in report.read_text()
+    assert list(out.glob("muttpu-cpu-export-*.prof"))
+
+
+def test_mem_profile_has_a_final_snapshot(run_main, tmp_path):
+    run_main("--profile", "mem", "--profile-dir", str(tmp_path / "profiles"), "list")
+    [report] = (tmp_path / "profiles").glob("muttpu-mem-list-*.txt")
+    assert "== end of run" in report.read_text()
+
+
+# One per checkpoint of 10 messages and one for the final save, or just the first
+@pytest.mark.parametrize("interval, snapshots", [(None, 7), ("3600", 1)])
+def test_mem_profile_snapshots_checkpoints(run_main, tmp_path, interval, snapshots):
+    out = tmp_path / "out"
+    options = ["--profile-interval", interval] if interval else []
+    run_main("--profile", "mem", *options, "export", "INBOX", str(out), "--format", "mbox",
+             "--batch-size", "10", "--fetch-batch", "10")
+    [report] = out.glob("muttpu-mem-export-*.txt")
+    text = report.read_text()
+    assert text.count("== INBOX: ") == snapshots
+    assert "== end of run" in text
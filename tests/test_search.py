@@ -0,0 +1,64 @@
+"""search_uids: ESEARCH shortcuts and windowed searches"""
+
+import pytest
+
+import muttpu
+
+
+@pytest.fixture
+def imap(server, mailbox):
+    # Gaps in the UIDs, so no shortcut applies
+    mailbox.messages = [m for m in mailbox.messages if m['uid'] % 3]
+    session = muttpu.connect_imap(quiet=True)
+    muttpu.select_mailbox(session, "INBOX")
+    yield session
+    session.logout()
+
+
+def expected(mailbox):
+    return [m['uid'] for m in mailbox.messages]
+
+
+def test_esearch_windows(imap, mailbox):
+    assert "ESEARCH" in imap.capabilities
+    assert list(muttpu.search_uids(imap, 'ALL', len(mailbox.messages), window=7)) == expected(mailbox)
+    # Small enough for one compact ESEARCH ALL
+    assert list(muttpu.search_uids(imap, 'ALL', len(mailbox.messages))) == expected(mailbox)
+
+
+def test_unsorted_plain_search_windows(server, imap, mailbox):
+    imap.capabilities = tuple(c for c in imap.capabilities if c != "ESEARCH")
+    server.reverse_search = True
+    assert list(muttpu.search_uids(imap, 'ALL', len(mailbox.messages), window=7)) == expected(mailbox)
+
+
+def test_search_with_date_criteria(imap, mailbox):
+    in_2020 = [m['uid'] for m in mailbox.messages if m['date'].year == 2020]
+    uids = muttpu.search_uids(imap, 'SINCE 01-Jan-2020 BEFORE 01-Jan-2021', len(mailbox.messages), window=5)
+    assert list(uids) == in_2020
+
+
+def test_bulk_summaries_parse_envelopes(imap, mailbox):
+    uids = expected(mailbox)
+    summaries = [muttpu.envelope_summary(m) for m in muttpu.fetch_summaries(imap, uids, batch=8)]
+    assert [s['uid'] for s in summaries] == uids
+    first = mailbox.messages[0]
+    assert summaries[0]['size'] == len(first['raw'])
+    assert summaries[0]['subject'].endswith(f"#{first['uid']}")
+    assert summaries[0]['date'].startswith(first['date'].strftime("%Y-%m-%d"))
+
+
+@pytest.mark.parametrize("period, key", [("year", "%Y"), ("month", "%Y-%m")])
+def test_date_histogram(imap, mailbox, period, key):
+    counts, total = muttpu.date_histogram(imap, expected(mailbox), period)
+    wanted = {}
+    for m in mailbox.messages:
+        wanted[m['date'].strftime(key)] = wanted.get(m['date'].strftime(key), 0) + 1
+    assert counts == wanted and total == len(mailbox.messages)
+
+
+def test_search_command_prints_histogram(server, mailbox, capsys):
+    muttpu.search_by_date("INBOX", histogram="year")
+    out = capsys.readouterr().out
+    assert f"Found {len(mailbox.messages):,} messages" in out
+    assert "2015" in out and "2024" in out
@@ -0,0 +1,54 @@
+"""--shard layouts for eml exports and the reshard command"""
+
+import hashlib
+
+import muttpu
+from conftest import add_messages
+
+
+def layout(out):
+    """{file name: directory relative to out} for every exported .eml"""
+    return {path.name: str(path.parent.relative_to(out)) for path in out.rglob("*.eml")}
+
+
+def test_date_shards_follow_message_dates(export, mailbox, tmp_path):
+    exporter = export(raw=True, shard="date")
+    assert exporter.finished and not exporter.errors
+    files = layout(tmp_path / "out")
+    assert len(files) == len(mailbox.messages)
+    dates = {m['uid']: m['date'] for m in mailbox.messages}
+    for name, directory in files.items():
+        uid = int(name.split("_")[2])
+        assert directory == f"{dates[uid]:%Y/%m}"
+
+
+def test_reshard_round_trip(export, mailbox, tmp_path):
+    out = tmp_path / "out"
+    export(raw=True, shard="date")
+    names = set(layout(out))
+
+    muttpu.reshard_export(out, "hash")
+    files = layout(out)
+    assert set(files) == names
+    for name, directory in files.items():
+        assert directory == hashlib.sha1(name.split("_")[2].encode()).hexdigest()[:3]
+    # The date directories were emptied and removed
+    assert not [p for p in out.iterdir() if p.is_dir() and len(p.name) == 4 and p.name.isdigit()]
+
+    muttpu.reshard_export(out, "none")
+    assert layout(out) == dict.fromkeys(names, ".")
+    assert not [p for p in out.iterdir() if p.is_dir()]
+
+    # A resumed export keeps the new layout and does not repeat anything
+    add_messages(mailbox, 5)
+    exporter = export(raw=True)
+    assert exporter.shard == "none" and exporter.state.total_exported == len(mailbox.messages)
+    assert set(layout(out).values()) == {"."} and len(layout(out)) == len(mailbox.messages)
+
+
+def test_changing_shard_needs_reshard(export, tmp_path, capsys):
+    export(raw=True, limit=10, shard="uid")
+    exporter = export(raw=True, shard="date")
+    assert not exporter.finished
+    assert "reshard" in capsys.readouterr().out
+    assert set(layout(tmp_path / "out").values()) == {"000000"}
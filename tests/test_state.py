@@ -0,0 +1,68 @@
+"""ExportState: UID ranges, the append-only journal and resume"""
+
+import json
+
+import muttpu
+
+
+def new_state(tmp_path, fresh=False):
+    return muttpu.ExportState(tmp_path / ".export_state.json", "INBOX", "mbox", fresh=fresh)
+
+
+def test_journal_checkpoints_survive_a_crash(tmp_path):
+    state = new_state(tmp_path)
+    state.set_uidvalidity(7)
+    state.compact()
+    for uid in range(1, 11):
+        state.add(uid)
+    state.save()
+    state.add(20)
+    state.save()
+    # No final compact: the run died here, with a torn last journal line
+    with open(tmp_path / ".export_state.journal", "a") as f:
+        f.write("21:3")
+
+    resumed = new_state(tmp_path)
+    assert str(resumed.exported) == "1:10,20"
+    assert 20 in resumed and 21 not in resumed and resumed.total_exported == 11
+
+
+def test_compact_folds_the_journal_into_ranges(tmp_path):
+    state = new_state(tmp_path)
+    state.set_uidvalidity(7)
+    for uid in [*range(1, 500), *range(600, 700)]:
+        state.add(uid)
+        state.save()
+    state.compact()
+
+    assert not (tmp_path / ".export_state.journal").exists()
+    data = json.loads((tmp_path / ".export_state.json").read_text())
+    assert data["exported"] == "1:499,600:699" and data["total_exported"] == 599
+
+
+def test_legacy_uid_list_is_migrated(tmp_path):
+    (tmp_path / ".export_state.json").write_text(json.dumps(
+        {"mailbox": "INBOX", "format": "mbox", "exported_uids": ["3", "1", "2", "9"], "total_exported": 4}))
+    state = new_state(tmp_path)
+    assert str(state.exported) == "1:3,9"
+    assert "exported_uids" not in json.loads((tmp_path / ".export_state.json").read_text())
+
+
+def test_uidvalidity_change_and_fresh_start_drop_uids(tmp_path):
+    state = new_state(tmp_path)
+    state.set_uidvalidity(7)
+    state.add(1)
+    state.save()
+    assert new_state(tmp_path).total_exported == 1
+    assert new_state(tmp_path, fresh=True).total_exported == 0
+
+    state = new_state(tmp_path)
+    assert state.set_uidvalidity(8) and state.total_exported == 0
+
+
+def test_export_leaves_compact_state(export, mailbox, tmp_path):
+    export(format="mbox", raw=True, batch_size=10, fetch_batch=10)
+    data = json.loads((tmp_path / "out" / ".export_state.json").read_text())
+    assert data["exported"] == f"1:{len(mailbox.messages)}"
+    assert data["uidvalidity"] == mailbox.uidvalidity
+    assert not (tmp_path / "out" / ".export_state.journal").exists()
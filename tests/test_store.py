@@ -0,0 +1,58 @@
+"""ContentStore objects and their index rows"""
+
+import muttpu
+import muttpu_bench
+
+
+def rows(store):
+    return store.db.execute('SELECT sha256, size, message_id FROM objects').fetchall()
+
+
+MESSAGE = b"Subject: hi\r\n\r\nbody\r\n"
+
+
+def test_put_indexes_object_already_on_disk(tmp_path):
+    store = muttpu.ContentStore(tmp_path)
+    digest, new = store.put(MESSAGE, "<a@example.com>")
+    assert new
+    # An interrupted run (or a restored store.db) lost the row
+    store.db.execute('DELETE FROM objects')
+    store.db.commit()
+
+    assert store.put(MESSAGE, "<a@example.com>") == (digest, False)
+    store.flush()
+    assert rows(store) == [(digest, len(MESSAGE), "<a@example.com>")]
+    assert store.lookup("<a@example.com>", len(MESSAGE)) == digest
+
+
+def test_put_file_indexes_object_already_on_disk(tmp_path):
+    store = muttpu.ContentStore(tmp_path / "store")
+    digest, _ = store.put(MESSAGE)
+    store.db.execute('DELETE FROM objects')
+    store.db.commit()
+
+    spool = tmp_path / "spool"
+    spool.write_bytes(MESSAGE)
+    assert store.put_file(spool, "<b@example.com>") == (digest, False)
+    assert not spool.exists()
+    store.flush()
+    assert rows(store) == [(digest, len(MESSAGE), "<b@example.com>")]
+
+
+def test_account_store_does_not_clash_with_folders(server, mailbox, tmp_path):
+    # A folder whose directory would be the store's objects/
+    sizes = muttpu_bench.size_distribution("uniform:2k:6k")
+    server.mailboxes["objects"] = muttpu_bench.SyntheticMailbox("objects", 20, sizes, seed=1)
+    out = tmp_path / "out"
+    muttpu.AccountExporter(out, format="store", parse_workers=0).export()
+
+    store = out / muttpu.AccountExporter.STORE_DIR
+    assert (store / "store.db").exists()
+    for folder, count in (("INBOX", len(mailbox.messages)), ("objects", 20)):
+        refs = (out / folder / f"{folder}.refs").read_text().split("\n")[:-1]
+        assert len(refs) == count
+        for line in refs:
+            digest = line.split()[1]
+            assert (store / "objects" / digest[:2] / digest).exists()
+    # The folder directory holds only that folder's export
+    assert not [path for path in (out / "objects").iterdir() if path.is_dir()]
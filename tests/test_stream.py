@@ -0,0 +1,55 @@
+"""Very large messages streamed in BODY.PEEK[]<offset.length> chunks"""
+
+import tarfile
+
+import pytest
+
+import muttpu
+
+CHUNK = 4096
+
+
+@pytest.fixture
+def large(server, mailbox, monkeypatch):
+    """Make every twelfth message large enough to be streamed; return {uid: raw}"""
+    monkeypatch.setattr(muttpu.MailboxExporter, "STREAM_THRESHOLD", 4 * CHUNK)
+    monkeypatch.setattr(muttpu.MailboxExporter, "STREAM_CHUNK", CHUNK)
+    for n, message in enumerate(mailbox.messages[::12]):
+        body = bytes(range(32, 127)) * 300 + b"\r\nFrom the end of a line\r\n\r\n"
+        raw = message['raw'] + body
+        if n == 0:
+            # Ends exactly on a chunk boundary: the last chunk comes back empty
+            raw = raw.ljust(6 * CHUNK, b".")[:6 * CHUNK]
+        message['raw'] = raw
+    partial = []
+    server.on_fetch = lambda args: partial.append(args) if "BODY.PEEK[]<" in args else None
+    yield {m['uid']: m['raw'] for m in mailbox.messages}
+    assert len({args.split()[0] for args in partial}) == len(mailbox.messages[::12])
+
+
+def exported(format, out, uid):
+    """Bytes of the message with this UID in an export"""
+    if format == "eml":
+        [path] = out.glob(f"*_{uid}_*.eml")
+        return path.read_bytes()
+    if format == "maildir":
+        [path] = (out / "INBOX" / "cur").glob(f"*,U={uid},*")
+        return path.read_bytes()
+    if format == "tar":
+        with tarfile.open(out / "INBOX.tar") as tar:
+            [member] = [m for m in tar.getmembers() if f"_{uid}_" in m.name]
+            return tar.extractfile(member).read()
+    refs = dict(line.split() for line in (out / "INBOX.refs").read_text().splitlines())
+    digest = refs[str(uid)]
+    return (out / "objects" / digest[:2] / digest).read_bytes()
+
+
+@pytest.mark.parametrize("format", ["eml", "maildir", "tar", "store"])
+def test_streamed_messages_are_byte_exact(export, large, mailbox, tmp_path, format):
+    exporter = export(format=format, raw=True)
+    assert exporter.finished and not exporter.errors
+    assert exporter.large_messages == len(mailbox.messages[::12])
+    for uid, raw in large.items():
+        assert exported(format, tmp_path / "out", uid) == raw
+    # No spool files are left behind
+    assert not list((tmp_path / "out").rglob(".muttpu-*.part"))
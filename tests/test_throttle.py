@@ -0,0 +1,47 @@
+"""RateController and the export's reaction to a throttling server"""
+
+import time
+
+import muttpu
+from test_export import expected_ids, message_ids
+
+THROTTLED = "[THROTTLED] Request is throttled. Suggested Backoff Time: 50 milliseconds"
+
+
+def test_throttled_batches_are_retried(export, server, mailbox, tmp_path):
+    fetches = []
+
+    def on_fetch(args):
+        if "RFC822.SIZE" in args.upper():
+            return None
+        fetches.append(args)
+        return THROTTLED if len(fetches) in (2, 3) else None
+    server.on_fetch = on_fetch
+
+    started = time.monotonic()
+    exporter = export(format="mbox", raw=True, fetch_batch=5, connections=2)
+    assert exporter.finished and not exporter.errors
+    assert sorted(message_ids(tmp_path / "out" / "INBOX.mbox")) == sorted(expected_ids(mailbox))
+    assert sum(exporter.requeues.values()) == 2
+    assert exporter.rate_control.throttles == 1  # Once per cooldown
+    # The server's suggested backoff is used rather than the default pause
+    assert time.monotonic() - started < 2
+
+
+def test_rate_controller_halves_then_paces():
+    control = muttpu.RateController(4)
+    control.COOLDOWN = 0
+    for _ in range(3):
+        control.wait_time()
+    assert control.throttle(THROTTLED) == "paused 0.1s, down to 2 requests in flight"
+    control.throttle(THROTTLED)
+    assert control.limit == 1 and control.rate is None
+    control.throttle(THROTTLED)
+    assert control.rate is not None and control.wait_time() > 0
+
+    # Each round of successes gives a step back: rate first, then concurrency
+    while control.rate is not None:
+        control.success(0, 0)
+    assert control.limit == 1
+    control.success(0, 0)
+    assert control.limit == 2
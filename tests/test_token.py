@@ -0,0 +1,91 @@
+"""TokenProvider: expiry, refresh and the per-account disk cache"""
+
+import base64
+import json
+import os
+import stat
+import subprocess
+import time
+
+import pytest
+
+import muttpu
+import muttpu_bench
+
+
+def jwt(expires):
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": expires}).encode()).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+@pytest.fixture
+def oauth_script(monkeypatch):
+    """Stand in for mutt_oauth2.py, handing out the tokens in .tokens"""
+    script = type("Script", (), {"calls": 0, "tokens": []})()
+
+    def run(command, **kwargs):
+        script.calls += 1
+        token = script.tokens[min(script.calls, len(script.tokens)) - 1]
+        return subprocess.CompletedProcess(command, 0, stdout=token + "\n")
+    monkeypatch.setattr(muttpu.subprocess, "run", run)
+    return script
+
+
+def test_opaque_token_is_kept_until_rejected(oauth_script):
+    oauth_script.tokens = ["opaque-1", "opaque-2"]
+    provider = muttpu.TokenProvider()
+    assert provider.get() == provider.get() == "opaque-1"
+    assert provider.expires is None and oauth_script.calls == 1
+
+    provider.invalidate()
+    assert provider.get() == "opaque-2" and oauth_script.calls == 2
+
+
+def test_jwt_is_refreshed_before_it_expires(oauth_script):
+    oauth_script.tokens = [jwt(time.time() + 60), jwt(time.time() + 3600)]
+    provider = muttpu.TokenProvider()
+    first = provider.get()
+    # Inside REFRESH_MARGIN: the script runs again
+    second = provider.get()
+    assert first != second and oauth_script.calls == 2
+    assert provider.get() == second and oauth_script.calls == 2
+    assert abs(provider.expires - time.time() - 3600) < 5
+
+
+def test_disk_cache_is_per_account_and_private(oauth_script, tmp_path, monkeypatch):
+    oauth_script.tokens = ["token-a", "token-b"]
+    monkeypatch.setattr(muttpu, "EMAIL", "a@example.com")
+    provider = muttpu.TokenProvider(cache_dir=tmp_path, cache_ttl=600)
+    cache_a = provider.cache_file
+    cache_a.write_text("{}")
+    os.chmod(cache_a, 0o644)
+    assert provider.get() == "token-a"
+    assert stat.S_IMODE(os.stat(cache_a).st_mode) == 0o600
+
+    # A later invocation for the same account skips the script
+    assert muttpu.TokenProvider(cache_dir=tmp_path, cache_ttl=600).get() == "token-a"
+    assert oauth_script.calls == 1
+
+    monkeypatch.setattr(muttpu, "EMAIL", "b@example.com")
+    other = muttpu.TokenProvider(cache_dir=tmp_path, cache_ttl=600)
+    assert other.cache_file != cache_a
+    assert other.get() == "token-b" and oauth_script.calls == 2
+
+
+def test_export_with_opaque_token_keeps_its_sessions(export, server, oauth_script, monkeypatch, mailbox):
+    oauth_script.tokens = [muttpu_bench.BENCH_TOKEN]
+    monkeypatch.setattr(muttpu, "TOKENS", muttpu.TokenProvider())
+    monkeypatch.setattr(muttpu, "get_token", muttpu.TOKENS.get)
+    connects = []
+    original = muttpu.MailboxExporter._connect
+
+    def connect(self, primary=False):
+        connects.append(primary)
+        imap, exists = original(self, primary)
+        assert imap.token_expires is None
+        return imap, exists
+    monkeypatch.setattr(muttpu.MailboxExporter, "_connect", connect)
+
+    exporter = export(format="mbox", raw=True, fetch_batch=5, connections=2)
+    assert exporter.state.total_exported == len(mailbox.messages)
+    assert oauth_script.calls == 1 and len(connects) == 3